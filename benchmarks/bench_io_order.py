@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+
+# Video Renamer - A small tool to rename many video files at once using their meta data.
+# Copyright (C) 2017  Hakan Bayindir
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Time metadata extraction on a cold page cache with the files in discovery, inode and extent order.
+
+This is what --io-order and --prefetch are for: on a rotating disk, reading many files is mostly
+seeking, and the order the files are read in decides how far the heads travel. Every mode
+evicts the files from the page cache first (posix_fadvise(DONTNEED) after a sync, or with
+--drop-caches all of the page, dentry and inode caches, which needs root), then orders the
+discovered files with orderForIO, optionally hints them with a Prefetcher, and has exiftool read
+their titles in batches. The time includes ordering, since --io-order extent opens every file.
+
+Without DIRECTORY, a corpus of FILES files is written to a temporary directory, in a tree so
+that files written one after the other end up in different directories and discovery order
+differs from the order on the disk. Use a directory on the disk to measure: a temporary
+directory on tmpfs measures nothing. The median of the rounds is reported.
+
+Usage: bench_io_order.py [--files N] [--payload BYTES] [--exiftool PATH] [--jobs N] [--batch-size N]
+                         [--rounds N] [--drop-caches] [DIRECTORY]
+'''
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import importlib.util
+
+import make_corpus
+
+# The benchmarks live next to the code they measure. The script name has a dash, so it is loaded by path.
+benchmarkDirectory = os.path.dirname(os.path.abspath(__file__))
+sourceDirectory = os.path.join(benchmarkDirectory, os.pardir)
+sys.path.insert(0, sourceDirectory)
+
+import exiftool
+
+moduleSpec = importlib.util.spec_from_file_location('video_renamer', os.path.join(sourceDirectory, 'video-renamer.py'))
+videoRenamer = importlib.util.module_from_spec(moduleSpec)
+moduleSpec.loader.exec_module(videoRenamer)
+
+# Mode name, --io-order and --prefetch.
+MODES = [
+    ('discovery', 'none', False),
+    ('discovery+prefetch', 'none', True),
+    ('inode', 'inode', False),
+    ('inode+prefetch', 'inode', True),
+    ('extent', 'extent', False),
+    ('extent+prefetch', 'extent', True),
+]
+
+'''
+evict: Drop the files from the page cache, so the next read comes from the disk.
+'''
+def evict (paths, dropCaches):
+    os.sync()
+
+    if dropCaches:
+        with open('/proc/sys/vm/drop_caches', 'w') as dropFile:
+            dropFile.write('3\n')
+
+        return
+
+    for path in paths:
+        fileDescriptor = os.open(path, os.O_RDONLY)
+
+        try:
+            os.posix_fadvise(fileDescriptor, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fileDescriptor)
+
+'''
+timeMode: Extract the titles of the files once, in the given order, and return the seconds it took.
+'''
+def timeMode (pool, patterns, order, prefetch, batchSize):
+    startTime = time.perf_counter()
+    entries = videoRenamer.discoverFiles(patterns, recursive = True)
+    prefetcher = None
+
+    if order != 'none':
+        entries = videoRenamer.orderForIO(entries, order)
+
+    if prefetch:
+        prefetcher = videoRenamer.Prefetcher()
+        entries = prefetcher.prefetch(entries, batchSize)
+
+    batches = ([entry.path for entry in chunk] for chunk in videoRenamer.chunked(entries, batchSize))
+    files = sum(len(metadata) for metadata in pool.imap(lambda et, batch: et.get_tags_batch(['Title'], batch), batches))
+
+    if prefetcher is not None:
+        prefetcher.close()
+
+    elapsed = time.perf_counter() - startTime
+
+    if files == 0:
+        raise RuntimeError('exiftool found no files.')
+
+    return elapsed
+
+if __name__ == '__main__':
+    argumentParser = argparse.ArgumentParser(description = 'Time metadata extraction on a cold cache in different I/O orders.')
+    argumentParser.add_argument ('--files', metavar = 'N', type = int, default = 2000, help = 'Files of the generated corpus (default: %(default)s).')
+    argumentParser.add_argument ('--payload', metavar = 'BYTES', type = int, default = 1 << 20, help = 'Media data per generated file, spreading the files over the disk (default: %(default)s).')
+    argumentParser.add_argument ('--exiftool', metavar = 'EXIFTOOL_PATH', default = os.path.join(benchmarkDirectory, 'fake_exiftool.py'), help = 'exiftool to run (default: fake_exiftool.py).')
+    argumentParser.add_argument ('--jobs', metavar = 'N', type = int, default = 1, help = 'exiftool processes (default: %(default)s).')
+    argumentParser.add_argument ('--batch-size', metavar = 'N', type = int, default = 100, help = 'Files per exiftool batch (default: %(default)s).')
+    argumentParser.add_argument ('--rounds', metavar = 'N', type = int, default = 3, help = 'Rounds of all modes, the median is reported (default: %(default)s).')
+    argumentParser.add_argument ('--drop-caches', help = 'Drop all caches with /proc/sys/vm/drop_caches instead of evicting the files only (needs root).', action = 'store_true')
+    argumentParser.add_argument ('DIRECTORY', help = 'Existing corpus to read, recursively (default: a generated one).', nargs = '?')
+    arguments = argumentParser.parse_args()
+
+    if hasattr(os, 'posix_fadvise') == False:
+        print('This benchmark needs posix_fadvise, which this platform does not have.', file = sys.stderr)
+        sys.exit(2)
+
+    workDirectory = None
+    corpus = arguments.DIRECTORY
+
+    try:
+        if corpus is None:
+            workDirectory = tempfile.mkdtemp(prefix = 'video-renamer-bench-')
+            corpus = os.path.join(workDirectory, 'corpus')
+            make_corpus.generateCorpus(corpus, arguments.files, 'deep', 2, 8, container = 'mixed', payload = arguments.payload)
+
+        patterns = [os.path.join(corpus, '**', '*.*')]
+        paths = [entry.path for entry in videoRenamer.discoverFiles(patterns, recursive = True)]
+        timings = dict((name, []) for name, _, _ in MODES)
+
+        with exiftool.ExifToolPool(executable_ = arguments.exiftool, jobs = arguments.jobs, common_args = videoRenamer.exiftoolArguments()) as pool:
+            for roundNumber in range(arguments.rounds):
+                # Take turns going first, in case the disk has its own cache.
+                for name, order, prefetch in MODES[roundNumber % len(MODES):] + MODES[:roundNumber % len(MODES)]:
+                    evict(paths, arguments.drop_caches)
+                    timings[name].append(timeMode(pool, patterns, order, prefetch, arguments.batch_size))
+
+        print('%d files, %d exiftool jobs, %d files per batch, median of %d rounds on a cold cache.' % (len(paths), arguments.jobs, arguments.batch_size, arguments.rounds))
+        baseline = statistics.median(timings['discovery'])
+
+        for name, _, _ in MODES:
+            seconds = statistics.median(timings[name])
+            print('%-20s %8.3f s %+7.0f%%' % (name, seconds, (seconds / baseline - 1) * 100))
+    finally:
+        if workDirectory is not None:
+            shutil.rmtree(workDirectory, ignore_errors = True)
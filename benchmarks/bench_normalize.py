@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+# Video Renamer - A small tool to rename many video files at once using their meta data.
+# Copyright (C) 2017  Hakan Bayindir
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Compare FileNamePolicy against the original, replace based normalizeFileName.
+
+Both get the same synthetic titles with FAT32 safety and console friendliness on, which is
+the slowest case of the original. The outputs are checked to be equal before timing.
+
+Usage: bench_normalize.py [--names N] [--seed N]
+'''
+
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import importlib.util
+
+# The benchmarks live next to the code they measure. The script name has a dash, so it is loaded by path.
+sourceDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, sourceDirectory)
+
+moduleSpec = importlib.util.spec_from_file_location('video_renamer', os.path.join(sourceDirectory, 'video-renamer.py'))
+videoRenamer = importlib.util.module_from_spec(moduleSpec)
+moduleSpec.loader.exec_module(videoRenamer)
+
+'''
+The normalizeFileName of video-renamer 0.0.2, kept here as the baseline.
+'''
+def legacyNormalizeFileName (fileName, fat32Safe = False, consoleFriendly = False):
+    localLogger = logging.getLogger ('normalizeFileName')
+    localLogger.debug('File name to normalize is "%s"', fileName)
+    localLogger.debug('FAT32 safety is set to %s', fat32Safe)
+    localLogger.debug('Console friendly renaming is set to %s', consoleFriendly)
+
+    fileName = fileName.strip()
+    fileName = fileName.replace('/', '_')
+
+    if fat32Safe:
+        for character in ['\\', ':', '*', '?', '"', '<', '>', '|']:
+            fileName = fileName.replace(character, '_')
+
+    if consoleFriendly:
+        for character in ['`', '~', '!', '#', '$', '&', '*', '(', ')', '\t', '[', ']', '{', '}', '|', '\\', ';', '\'', '"', '<', '>', '?', ' ']:
+            fileName = fileName.replace(character, '_')
+
+    return fileName
+
+def makeNames (count, seed):
+    generator = random.Random(seed)
+    alphabet = 'abcdefghijklmnopqrstuvwxyz ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789:?!/\'"()[]-,.&é'
+    return [''.join(generator.choice(alphabet) for _ in range(generator.randint(10, 60))) for _ in range(count)]
+
+def timeIt (function):
+    startTime = time.perf_counter()
+    result = function()
+    return time.perf_counter() - startTime, result
+
+if __name__ == '__main__':
+    argumentParser = argparse.ArgumentParser(description = 'Benchmark file name normalization.')
+    argumentParser.add_argument ('--names', metavar = 'N', type = int, default = 1000000, help = 'Number of names to normalize (default: %(default)s).')
+    argumentParser.add_argument ('--seed', metavar = 'N', type = int, default = 2017, help = 'Seed of the name generator (default: %(default)s).')
+    arguments = argumentParser.parse_args()
+
+    names = makeNames(arguments.names, arguments.seed)
+    policy = videoRenamer.FileNamePolicy(fat32Safe = True, consoleFriendly = True)
+
+    legacyTime, legacyResult = timeIt(lambda: [legacyNormalizeFileName(name, True, True) for name in names])
+    policyTime, policyResult = timeIt(lambda: [policy.normalize(name) for name in names])
+    batchTime, batchResult = timeIt(lambda: policy.normalizeBatch(names))
+
+    if legacyResult != policyResult or legacyResult != batchResult:
+        print('Normalized names differ from the original implementation!', file = sys.stderr)
+        sys.exit(1)
+
+    print('%d names, FAT32 safe and console friendly.' % len(names))
+    print('%-26s %10s %14s %9s' % ('implementation', 'seconds', 'names/s', 'speedup'))
+
+    for name, elapsed in [('original normalizeFileName', legacyTime), ('FileNamePolicy.normalize', policyTime), ('normalizeBatch', batchTime)]:
+        print('%-26s %10.3f %14.0f %8.1fx' % (name, elapsed, len(names) / elapsed, legacyTime / elapsed))
@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+
+# Video Renamer - A small tool to rename many video files at once using their meta data.
+# Copyright (C) 2017  Hakan Bayindir
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Check the built-in QuickTime title reader against exiftool, and compare their speed.
+
+Every file is read by both; a title the built-in reader returns must equal exiftool's
+QuickTime:Title. Files the reader declines are counted, since the renamer sends them to
+exiftool. Exits with 1 if any title differs.
+
+Usage: bench_quicktime_title.py [--exiftool PATH] [--batch-size N] FILE...
+'''
+
+import os
+import sys
+import time
+import argparse
+import glob
+import importlib.util
+
+# The benchmarks live next to the code they measure. The script name has a dash, so it is loaded by path.
+sourceDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, sourceDirectory)
+import exiftool
+
+moduleSpec = importlib.util.spec_from_file_location('video_renamer', os.path.join(sourceDirectory, 'video-renamer.py'))
+videoRenamer = importlib.util.module_from_spec(moduleSpec)
+moduleSpec.loader.exec_module(videoRenamer)
+
+if __name__ == '__main__':
+    argumentParser = argparse.ArgumentParser(description = 'Check and benchmark the built-in QuickTime title reader against exiftool.')
+    argumentParser.add_argument ('--exiftool', metavar = 'EXIFTOOL_PATH', help = 'exiftool binary to compare with.')
+    argumentParser.add_argument ('--batch-size', metavar = 'N', type = int, default = 100, help = 'Files per exiftool batch (default: %(default)s).')
+    argumentParser.add_argument ('FILE', nargs = '+', help = 'Video files to read, wildcards are expanded recursively.')
+    arguments = argumentParser.parse_args()
+
+    files = [path for pattern in arguments.FILE for path in glob.iglob(pattern, recursive = True) if os.path.isfile(path)]
+
+    if len(files) == 0:
+        print('No files to check.', file = sys.stderr)
+        sys.exit(2)
+
+    startTime = time.perf_counter()
+    nativeTitles = [videoRenamer.readQuickTimeTitle(path) for path in files]
+    nativeTime = time.perf_counter() - startTime
+
+    exiftoolTitles = list ()
+    startTime = time.perf_counter()
+
+    with exiftool.ExifTool(executable_ = arguments.exiftool) as et:
+        for index in range(0, len(files), arguments.batch_size):
+            exiftoolTitles.extend(et.get_tag_batch('QuickTime:Title', files[index:index + arguments.batch_size]))
+
+    exiftoolTime = time.perf_counter() - startTime
+
+    declined = 0
+    mismatches = 0
+
+    for path, native, expected in zip(files, nativeTitles, exiftoolTitles):
+        if native is None:
+            declined += 1
+        elif native['QuickTime:Title'] != expected:
+            mismatches += 1
+            print('Mismatch in %s: %r, exiftool says %r.' % (path, native['QuickTime:Title'], expected))
+
+    print('%d files, %d declined by the built-in reader, %d mismatches.' % (len(files), declined, mismatches))
+    print('built-in: %.3f s (%.1f files/s)' % (nativeTime, len(files) / nativeTime))
+    print('exiftool: %.3f s (%.1f files/s)' % (exiftoolTime, len(files) / exiftoolTime))
+    print('speedup: %.1fx' % (exiftoolTime / nativeTime))
+
+    sys.exit(1 if mismatches > 0 else 0)
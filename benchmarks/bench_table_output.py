@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+
+# Video Renamer - A small tool to rename many video files at once using their meta data.
+# Copyright (C) 2017  Hakan Bayindir
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Compare the JSON extraction path (get_tags_batch) against the tabular one (get_tag_table_batch).
+
+Both modes read the same files for the tags the renamer uses, in batches with a single exiftool
+process. Besides the total time, the replies are kept and parsed again on their own, so the
+cost of decoding can be told apart from the time exiftool needs to produce the output.
+Use 10000 files or more to see the difference.
+
+Usage: bench_table_output.py [--exiftool PATH] [--batch-size N] [--rounds N] FILE...
+'''
+
+import os
+import sys
+import time
+import argparse
+import glob
+import json
+
+# The benchmarks live next to the code they measure.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import exiftool
+
+# The tags video-renamer.py asks for with its default naming.
+RENAME_TAGS = ['File:FileTypeExtension', 'File:Directory', 'File:FileName', 'Title']
+
+def runJson (et, batch):
+    params = [exiftool.fsencode('-' + tag) for tag in RENAME_TAGS] + batch
+    output = et.execute(b'-j', *params)
+
+    return output, lambda: json.loads(output.decode('utf-8')) if output else []
+
+def runTable (et, batch):
+    # Same request get_tag_table_batch sends, kept apart from the parsing.
+    params, batch = exiftool._table_request(RENAME_TAGS, batch)
+    output = et.execute(*params)
+
+    return output, lambda: exiftool._parse_table(output, batch)
+
+MODES = [
+    ('json', runJson),
+    ('table', runTable),
+]
+
+def runMode (executable, run, files, batchSize):
+    outputBytes = 0
+    parsers = list ()
+
+    with exiftool.ExifTool(executable_ = executable) as et:
+        startTime = time.perf_counter()
+
+        for index in range(0, len(files), batchSize):
+            output, parse = run(et, [exiftool.fsencode(fileName) for fileName in files[index:index + batchSize]])
+            parse()
+            outputBytes += len(output)
+            parsers.append(parse)
+
+        elapsed = time.perf_counter() - startTime
+
+    startTime = time.perf_counter()
+
+    for parse in parsers:
+        parse()
+
+    return elapsed, time.perf_counter() - startTime, outputBytes
+
+if __name__ == '__main__':
+    argumentParser = argparse.ArgumentParser(description = 'Benchmark JSON versus tabular (-T) tag extraction.')
+    argumentParser.add_argument ('--exiftool', metavar = 'EXIFTOOL_PATH', help = 'exiftool binary to benchmark.')
+    argumentParser.add_argument ('--batch-size', metavar = 'N', type = int, default = 100, help = 'Files per exiftool batch (default: %(default)s).')
+    argumentParser.add_argument ('--rounds', metavar = 'N', type = int, default = 3, help = 'Rounds per mode, the best one is reported (default: %(default)s).')
+    argumentParser.add_argument ('FILE', nargs = '+', help = 'Video files to read, wildcards are expanded recursively.')
+    arguments = argumentParser.parse_args()
+
+    files = [path for pattern in arguments.FILE for path in glob.iglob(pattern, recursive = True) if os.path.isfile(path)]
+
+    if len(files) == 0:
+        print('No files to benchmark.', file = sys.stderr)
+        sys.exit(2)
+
+    print('%d files, batch size %d, best of %d rounds.' % (len(files), arguments.batch_size, arguments.rounds))
+    print('%-10s %10s %12s %14s %14s' % ('mode', 'seconds', 'files/s', 'parse seconds', 'output bytes'))
+
+    for name, run in MODES:
+        results = [runMode(arguments.exiftool, run, files, arguments.batch_size) for _ in range(arguments.rounds)]
+        elapsed, parseElapsed, outputBytes = min(results)
+        print('%-10s %10.3f %12.1f %14.4f %14d' % (name, elapsed, len(files) / elapsed, parseElapsed, outputBytes))
@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+
+# Video Renamer - A small tool to rename many video files at once using their meta data.
+# Copyright (C) 2017  Hakan Bayindir
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Compare full metadata extraction against the tag-restricted extraction the renamer uses.
+
+Every mode reads the same files in batches with a single exiftool process, and the best
+of a few rounds is reported, together with the size of the JSON exiftool produced.
+
+Usage: bench_tag_extraction.py [--exiftool PATH] [--batch-size N] [--rounds N] FILE...
+'''
+
+import os
+import sys
+import time
+import argparse
+import glob
+
+# The benchmarks live next to the code they measure.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import exiftool
+
+# The tags video-renamer.py asks for with its default naming.
+RENAME_TAGS = ['File:FileTypeExtension', 'File:Directory', 'File:FileName', 'Title']
+
+# Mode name, common arguments and the tags to extract (None means all of them).
+MODES = [
+    ('full', ['-G', '-n'], None),
+    ('restricted', ['-G', '-n'], RENAME_TAGS),
+    ('restricted -fast', ['-G', '-n', '-fast'], RENAME_TAGS),
+    ('restricted -fast2', ['-G', '-n', '-fast2'], RENAME_TAGS),
+]
+
+def runMode (executable, commonArguments, tags, files, batchSize):
+    outputBytes = 0
+
+    with exiftool.ExifTool(executable_ = executable, common_args = commonArguments) as et:
+        startTime = time.perf_counter()
+
+        for index in range(0, len(files), batchSize):
+            batch = [exiftool.fsencode(fileName) for fileName in files[index:index + batchSize]]
+
+            if tags is None:
+                output = et.execute(b'-j', *batch)
+            else:
+                output = et.execute(b'-j', *([exiftool.fsencode('-' + tag) for tag in tags] + batch))
+
+            outputBytes += len(output)
+
+        return time.perf_counter() - startTime, outputBytes
+
+if __name__ == '__main__':
+    argumentParser = argparse.ArgumentParser(description = 'Benchmark full versus tag-restricted metadata extraction.')
+    argumentParser.add_argument ('--exiftool', metavar = 'EXIFTOOL_PATH', help = 'exiftool binary to benchmark.')
+    argumentParser.add_argument ('--batch-size', metavar = 'N', type = int, default = 100, help = 'Files per exiftool batch (default: %(default)s).')
+    argumentParser.add_argument ('--rounds', metavar = 'N', type = int, default = 3, help = 'Rounds per mode, the best one is reported (default: %(default)s).')
+    argumentParser.add_argument ('FILE', nargs = '+', help = 'Video files to read, wildcards are expanded recursively.')
+    arguments = argumentParser.parse_args()
+
+    files = [path for pattern in arguments.FILE for path in glob.iglob(pattern, recursive = True) if os.path.isfile(path)]
+
+    if len(files) == 0:
+        print('No files to benchmark.', file = sys.stderr)
+        sys.exit(2)
+
+    print('%d files, batch size %d, best of %d rounds.' % (len(files), arguments.batch_size, arguments.rounds))
+    print('%-20s %10s %12s %14s' % ('mode', 'seconds', 'files/s', 'JSON bytes'))
+
+    for name, commonArguments, tags in MODES:
+        results = [runMode(arguments.exiftool, commonArguments, tags, files, arguments.batch_size) for _ in range(arguments.rounds)]
+        elapsed, outputBytes = min(results)
+        print('%-20s %10.3f %12.1f %14d' % (name, elapsed, len(files) / elapsed, outputBytes))
@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+
+# Video Renamer - A small tool to rename many video files at once using their meta data.
+# Copyright (C) 2017  Hakan Bayindir
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+A stand-in for exiftool, to run the renamer and the benchmarks without Perl.
+
+It speaks the part of exiftool the renamer uses: '-stay_open True -@ -' with '-common_args',
+'-execute[NUMBER]' answered by '{ready[NUMBER]}', JSON (-j) and tab separated (-T, -E) output,
+group names (-G) and tag selection. It knows the file name, directory, size and type tags,
+ExifToolVersion and the QuickTime:Title of the files make_corpus.py writes (iTunes and
+QuickTime style titles). Other options are accepted and ignored.
+
+exiftool's own cost can be imitated with these environment variables, all in seconds:
+FAKE_EXIFTOOL_STARTUP (once, before the first request), FAKE_EXIFTOOL_LATENCY (per request)
+and FAKE_EXIFTOOL_FILE_LATENCY (per file).
+
+Usage: fake_exiftool.py -stay_open True -@ - [-common_args OPTION...]
+       fake_exiftool.py [OPTION...] FILE...
+'''
+
+import os
+import sys
+import html
+import json
+import time
+import struct
+
+VERSION = '12.40'
+
+# Options without a value, which are not tags either.
+FLAGS = frozenset(['-G', '-n', '-j', '-T', '-E', '-fast', '-fast2', '-q', '-m'])
+BRANDS = {b'qt  ': 'mov', b'isom': 'mp4', b'iso2': 'mp4', b'mp41': 'mp4', b'mp42': 'mp4', b'M4V ': 'm4v'}
+
+def boxes (data, start, end):
+    offset = start
+
+    while offset + 8 <= end:
+        size, boxType = struct.unpack_from('>I4s', data, offset)
+
+        if size < 8 or offset + size > end:
+            return
+
+        yield boxType, offset + 8, offset + size
+        offset += size
+
+def findBox (data, start, end, path):
+    for boxType in path:
+        for currentType, start, end in boxes(data, start, end):
+            if currentType == boxType:
+                break
+        else:
+            return None
+
+    return start, end
+
+def readTitle (data):
+    userData = findBox(data, 0, len(data), [b'moov', b'udta'])
+
+    if userData is None:
+        return None
+
+    meta = findBox(data, userData[0], userData[1], [b'meta'])
+
+    if meta is not None:
+        # Skip the version and flags of MP4 style full boxes.
+        start = meta[0] + 4 if data[meta[0] + 4:meta[0] + 8] != b'hdlr' else meta[0]
+        title = findBox(data, start, meta[1], [b'ilst', b'\xa9nam', b'data'])
+
+        if title is not None:
+            return data[title[0] + 8:title[1]].decode('utf-8', 'replace')
+
+    title = findBox(data, userData[0], userData[1], [b'\xa9nam'])
+
+    if title is not None:
+        length = struct.unpack_from('>H', data, title[0])[0]
+        return data[title[0] + 4:title[0] + 4 + length].decode('utf-8', 'replace')
+
+    return None
+
+def readTags (path):
+    with open(path, 'rb') as videoFile:
+        data = videoFile.read(1 << 20)
+
+    extension = BRANDS.get(data[8:12]) if data[4:8] == b'ftyp' else None
+    tags = [
+        ('ExifTool:ExifToolVersion', VERSION),
+        ('File:FileName', os.path.basename(path)),
+        ('File:Directory', os.path.dirname(path) or '.'),
+        ('File:FileSize', os.path.getsize(path)),
+        ('File:FileTypeExtension', extension or os.path.splitext(path)[1][1:].lower()),
+    ]
+    title = readTitle(data) if extension is not None else None
+
+    if title is not None:
+        tags.append(('QuickTime:Title', title))
+
+    return tags
+
+def selectTags (tags, wanted, groups):
+    selected = list ()
+
+    for tag in wanted or [tag for tag, _ in tags]:
+        for name, value in tags:
+            if tag == name or tag == name.split(':')[1]:
+                selected.append((name if groups else name.split(':')[1], value))
+                break
+        else:
+            selected.append((tag if groups or ':' not in tag else tag.split(':')[1], None))
+
+    return selected
+
+def run (arguments):
+    options = set(argument for argument in arguments if argument in FLAGS)
+    wanted = [argument[1:] for argument in arguments if argument.startswith('-') and argument not in FLAGS]
+    files = [argument for argument in arguments if argument.startswith('-') == False]
+    records = list ()
+    rows = list ()
+    fileLatency = float(os.environ.get('FAKE_EXIFTOOL_FILE_LATENCY', '0'))
+
+    for path in files:
+        try:
+            tags = readTags(path)
+        except OSError:
+            sys.stderr.write('Error: File not found - %s\n' % path)
+            continue
+
+        time.sleep(fileLatency)
+        selected = selectTags(tags, wanted, '-G' in options)
+
+        if '-T' in options:
+            values = ['-' if value is None else str(value) for _, value in selected]
+
+            if '-E' in options:
+                values = [html.escape(value).replace('\t', '&#9;').replace('\n', '&#10;') for value in values]
+
+            rows.append('\t'.join(values) + '\n')
+        else:
+            record = {'SourceFile': path}
+            record.update((name, value) for name, value in selected if value is not None)
+            records.append(record)
+
+    if '-T' in options:
+        return ''.join(rows)
+    elif len(records) == 0:
+        return ''
+    elif '-j' in options:
+        return json.dumps(records, indent = 2, ensure_ascii = False) + '\n'
+    else:
+        return ''.join('%-32s: %s\n' % (name.split(':')[-1], value) for record in records for name, value in record.items() if name != 'SourceFile')
+
+def stayOpen (commonArguments):
+    time.sleep(float(os.environ.get('FAKE_EXIFTOOL_STARTUP', '0')))
+    latency = float(os.environ.get('FAKE_EXIFTOOL_LATENCY', '0'))
+    output = sys.stdout.buffer
+    arguments = list ()
+
+    for line in sys.stdin.buffer:
+        argument = line.rstrip(b'\r\n').decode('utf-8', 'surrogateescape')
+
+        if argument.startswith('-execute'):
+            time.sleep(latency)
+            reply = run(arguments + commonArguments)
+            output.write(reply.encode('utf-8', 'surrogateescape') + b'{ready' + argument[8:].encode() + b'}\n')
+            output.flush()
+            arguments = list ()
+        elif argument == '-stay_open':
+            if sys.stdin.buffer.readline().strip().lower() == b'false':
+                return
+        else:
+            arguments.append(argument)
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    commonArguments = list ()
+
+    if '-common_args' in arguments:
+        commonArguments = arguments[arguments.index('-common_args') + 1:]
+        arguments = arguments[:arguments.index('-common_args')]
+
+    if arguments[:4] == ['-stay_open', 'True', '-@', '-']:
+        stayOpen(commonArguments)
+    elif arguments == ['-ver']:
+        print(VERSION)
+    else:
+        sys.stdout.write(run(arguments + commonArguments))
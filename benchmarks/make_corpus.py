@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+
+# Video Renamer - A small tool to rename many video files at once using their meta data.
+# Copyright (C) 2017  Hakan Bayindir
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Generate a synthetic corpus of tiny, valid MP4 and MOV files with titles, for the benchmarks.
+
+The files have just the boxes exiftool and the built-in QuickTime reader look at (ftyp, moov
+with a title in udta, and mdat with some random payload). MP4 files carry iTunes style titles
+(moov/udta/meta/ilst/©nam), MOV files QuickTime style ones (moov/udta/©nam). The tree is
+either flat or DEPTH levels deep with FANOUT directories on every level, files going to the
+leaf directories in turn. Some titles can be repeated within a directory, so renames collide,
+and some files can have no title at all. The same seed always gives the same corpus.
+
+Usage: make_corpus.py [--files N] [--shape flat|deep] [--depth N] [--fanout N] [--duplicates RATIO]
+                      [--missing-titles RATIO] [--container mp4|mov|mixed] [--payload BYTES] [--seed N] DIRECTORY
+'''
+
+import os
+import sys
+import struct
+import random
+import argparse
+
+WORDS = ['alpha', 'bravo', 'Conference', 'Day', 'holiday', 'Talk', 'recording', 'draft', 'final', 'Interview',
+         'part', 'Episode', 'trailer', 'backup', 'Q&A', 'keynote', 'café', 'naïve', 'demo', 'review']
+SEPARATORS = [' ', ' ', ' ', ': ', ' - ', '/', ', ', ' (', ') ', '? ', '! ', "'"]
+
+def box (boxType, payload):
+    return struct.pack('>I4s', 8 + len(payload), boxType) + payload
+
+'''
+makeMp4: An ISO base media file with an iTunes style title, or without user data if title is None.
+'''
+def makeMp4 (title, payload):
+    movie = box(b'mvhd', bytes(100))
+
+    if title is not None:
+        data = box(b'data', struct.pack('>II', 1, 0) + title.encode('utf-8'))
+        handler = box(b'hdlr', bytes(8) + b'mdirappl' + bytes(9))
+        # In MP4 files the meta box is a full box, with a version and flags first.
+        movie += box(b'udta', box(b'meta', bytes(4) + handler + box(b'ilst', box(b'\xa9nam', data))))
+
+    return box(b'ftyp', b'isom' + struct.pack('>I', 512) + b'isomiso2mp41') + box(b'moov', movie) + box(b'mdat', payload)
+
+'''
+makeMov: A QuickTime file with a QuickTime style title, or without user data if title is None.
+'''
+def makeMov (title, payload):
+    movie = box(b'mvhd', bytes(100))
+
+    if title is not None:
+        text = title.encode('utf-8')
+        # Language 0x55c4 is the packed ISO 639 code 'und', so the text is UTF-8.
+        movie += box(b'udta', box(b'\xa9nam', struct.pack('>HH', len(text), 0x55c4) + text))
+
+    return box(b'ftyp', b'qt  ' + struct.pack('>I', 0x200) + b'qt  ') + box(b'moov', movie) + box(b'mdat', payload)
+
+def makeTitle (generator):
+    pieces = list ()
+
+    for _ in range(generator.randint(2, 6)):
+        pieces.append(generator.choice(WORDS))
+        pieces.append(generator.choice(SEPARATORS))
+
+    pieces.append(str(generator.randint(1, 99999)))
+
+    return ''.join(pieces)
+
+'''
+leafDirectories: The directories files are put in, relative to the corpus root.
+'''
+def leafDirectories (shape, depth, fanout):
+    if shape == 'flat' or depth < 1:
+        return ['']
+
+    directories = ['']
+
+    for level in range(depth):
+        directories = [os.path.join(parent, 'd%d-%d' % (level, index)) for parent in directories for index in range(fanout)]
+
+    return directories
+
+'''
+generateCorpus: Write the corpus under root, and return the number of files written per kind.
+'''
+def generateCorpus (root, files = 1000, shape = 'flat', depth = 3, fanout = 4, duplicates = 0.0, missingTitles = 0.0, container = 'mp4', payload = 1024, seed = 2017):
+    generator = random.Random(seed)
+    directories = leafDirectories(shape, depth, fanout)
+    # Titles already used, by directory, to pick duplicates from.
+    usedTitles = dict ()
+    counts = {'files': 0, 'duplicate titles': 0, 'missing titles': 0}
+
+    for directory in directories:
+        os.makedirs(os.path.join(root, directory), exist_ok = True)
+
+    for index in range(files):
+        directory = directories[index % len(directories)]
+        previous = usedTitles.setdefault(directory, [])
+
+        if generator.random() < missingTitles:
+            title = None
+            counts['missing titles'] += 1
+        elif len(previous) > 0 and generator.random() < duplicates:
+            title = generator.choice(previous)
+            counts['duplicate titles'] += 1
+        else:
+            title = makeTitle(generator)
+            previous.append(title)
+
+        if container == 'mov' or (container == 'mixed' and index % 2 == 1):
+            fileName, content = 'clip%06d.mov' % index, makeMov(title, generator.randbytes(payload))
+        else:
+            fileName, content = 'clip%06d.mp4' % index, makeMp4(title, generator.randbytes(payload))
+
+        with open(os.path.join(root, directory, fileName), 'wb') as videoFile:
+            videoFile.write(content)
+
+        counts['files'] += 1
+
+    return counts
+
+if __name__ == '__main__':
+    argumentParser = argparse.ArgumentParser(description = 'Generate a synthetic corpus of small video files for the benchmarks.')
+    argumentParser.add_argument ('--files', metavar = 'N', type = int, default = 1000, help = 'Number of files (default: %(default)s).')
+    argumentParser.add_argument ('--shape', choices = ['flat', 'deep'], default = 'flat', help = 'All files in one directory, or in a tree (default: %(default)s).')
+    argumentParser.add_argument ('--depth', metavar = 'N', type = int, default = 3, help = 'Directory levels of a deep tree (default: %(default)s).')
+    argumentParser.add_argument ('--fanout', metavar = 'N', type = int, default = 4, help = 'Subdirectories per directory of a deep tree (default: %(default)s).')
+    argumentParser.add_argument ('--duplicates', metavar = 'RATIO', type = float, default = 0.0, help = 'Share of files repeating a title of their directory (default: %(default)s).')
+    argumentParser.add_argument ('--missing-titles', metavar = 'RATIO', type = float, default = 0.0, help = 'Share of files without a title (default: %(default)s).')
+    argumentParser.add_argument ('--container', choices = ['mp4', 'mov', 'mixed'], default = 'mp4', help = 'File format (default: %(default)s).')
+    argumentParser.add_argument ('--payload', metavar = 'BYTES', type = int, default = 1024, help = 'Size of the media data of every file (default: %(default)s).')
+    argumentParser.add_argument ('--seed', metavar = 'N', type = int, default = 2017, help = 'Seed of the generator (default: %(default)s).')
+    argumentParser.add_argument ('DIRECTORY', help = 'Where to write the corpus, created if needed.')
+    arguments = argumentParser.parse_args()
+
+    if arguments.files < 1 or arguments.fanout < 1:
+        print('There must be at least one file and one directory per level.', file = sys.stderr)
+        sys.exit(2)
+
+    counts = generateCorpus(arguments.DIRECTORY, arguments.files, arguments.shape, arguments.depth, arguments.fanout, arguments.duplicates,
+                            arguments.missing_titles, arguments.container, arguments.payload, arguments.seed)
+    print('Wrote %(files)d files, %(duplicate titles)d with duplicate titles, %(missing titles)d without titles.' % counts)
@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+
+# Video Renamer - A small tool to rename many video files at once using their meta data.
+# Copyright (C) 2017  Hakan Bayindir
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Run video-renamer.py end to end on synthetic corpora, time every stage and compare with a baseline.
+
+Every scenario generates a fresh corpus with make_corpus.py in a temporary directory and
+renames it for real with fake_exiftool.py (or a real exiftool) and --stats-json. The stages
+reported are the ones of --stats: discovery, exiftool (ExifTool.execute round trips), decode,
+plan with fields (indexFields/findField) and normalize (normalizeFileName) inside it, and
+rename, besides the wall time of the whole process. The best of a few rounds is kept.
+
+Results are compared with the baseline file, if there is one: a time more than the tolerance
+above its baseline (and at least 5 ms more, to ignore noise) is flagged as a regression and
+the suite exits with 1. --save-baseline stores the results as the new baseline. Baselines only
+mean something on the machine they were made on, so they are not kept in the repository.
+
+Usage: run_suite.py [--scenario NAME]... [--rounds N] [--exiftool PATH] [--latency SECONDS]
+                    [--baseline FILE] [--save-baseline] [--tolerance RATIO]
+'''
+
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import make_corpus
+
+benchmarkDirectory = os.path.dirname(os.path.abspath(__file__))
+renamerPath = os.path.join(benchmarkDirectory, os.pardir, 'video-renamer.py')
+
+# Scenario name, make_corpus.generateCorpus arguments and extra video-renamer.py arguments.
+SCENARIOS = [
+    ('flat', {'files': 5000}, []),
+    ('deep', {'files': 5000, 'shape': 'deep', 'depth': 3, 'fanout': 5}, []),
+    ('collisions', {'files': 5000, 'duplicates': 0.5, 'missingTitles': 0.1}, []),
+    ('mov', {'files': 5000, 'container': 'mov'}, []),
+    ('exiftool', {'files': 5000, 'container': 'mixed'}, ['--no-quicktime-reader']),
+    ('exiftool asyncio', {'files': 5000, 'container': 'mixed'}, ['--no-quicktime-reader', '--asyncio']),
+]
+
+# Stages of --stats-json, in the order they are reported.
+STAGES = ['discovery', 'exiftool', 'decode', 'plan', 'fields', 'normalize', 'rename']
+
+# Differences below this many seconds are never regressions.
+MINIMUM_DIFFERENCE = 0.005
+
+'''
+runScenario: Rename a fresh corpus once, return the seconds of every stage and of the whole run.
+'''
+def runScenario (corpusArguments, renamerArguments, executable, latency):
+    workDirectory = tempfile.mkdtemp(prefix = 'video-renamer-bench-')
+
+    try:
+        corpus = os.path.join(workDirectory, 'corpus')
+        statsPath = os.path.join(workDirectory, 'stats.json')
+        make_corpus.generateCorpus(corpus, **corpusArguments)
+
+        environment = dict(os.environ, FAKE_EXIFTOOL_LATENCY = str(latency))
+        # A broker started by the user would answer with its own exiftool, and skew the timing.
+        command = [sys.executable, renamerPath, '--alternative-exiftool', executable, '--no-cache', '--no-broker', '-q', '-r',
+                   '--stats-json', statsPath] + renamerArguments + [os.path.join(corpus, '**', '*.*')]
+
+        startTime = time.perf_counter()
+        completed = subprocess.run(command, env = environment, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE)
+        elapsed = time.perf_counter() - startTime
+
+        if completed.returncode != 0 or os.path.exists(statsPath) == False:
+            raise RuntimeError('video-renamer.py exited with %d: %s' % (completed.returncode, completed.stderr.decode(errors = 'replace').strip()))
+
+        with open(statsPath, encoding = 'utf-8') as statsFile:
+            summary = json.load(statsFile)
+
+        results = {'total': elapsed}
+        results.update((stage, figures['seconds']) for stage, figures in summary['stages'].items())
+
+        return results
+    finally:
+        shutil.rmtree(workDirectory, ignore_errors = True)
+
+def bestOf (rounds):
+    best = dict ()
+
+    for results in rounds:
+        for metric, seconds in results.items():
+            best[metric] = min(seconds, best.get(metric, seconds))
+
+    return best
+
+'''
+compare: Print the results next to their baseline, and return the number of regressions.
+'''
+def compare (results, baseline, tolerance):
+    regressions = 0
+    print('%-18s %-10s %10s %10s %8s' % ('scenario', 'stage', 'seconds', 'baseline', 'change'))
+
+    for scenario, metrics in results.items():
+        previous = baseline.get(scenario, {})
+
+        for metric in ['total'] + [stage for stage in STAGES if stage in metrics]:
+            seconds = metrics[metric]
+
+            if metric not in previous:
+                print('%-18s %-10s %10.3f %10s %8s' % (scenario, metric, seconds, '-', '-'))
+                continue
+
+            change = seconds / previous[metric] - 1 if previous[metric] > 0 else 0.0
+            regressed = change > tolerance and seconds - previous[metric] > MINIMUM_DIFFERENCE
+            regressions += regressed
+            print('%-18s %-10s %10.3f %10.3f %+7.0f%%%s' % (scenario, metric, seconds, previous[metric], change * 100, '  REGRESSION' if regressed else ''))
+
+    return regressions
+
+if __name__ == '__main__':
+    argumentParser = argparse.ArgumentParser(description = 'Time video-renamer.py stage by stage on synthetic corpora.')
+    argumentParser.add_argument ('--scenario', metavar = 'NAME', action = 'append', choices = [name for name, _, _ in SCENARIOS], help = 'Scenario to run, can be repeated (default: all of them).')
+    argumentParser.add_argument ('--rounds', metavar = 'N', type = int, default = 3, help = 'Rounds per scenario, the best time of every stage is kept (default: %(default)s).')
+    argumentParser.add_argument ('--exiftool', metavar = 'EXIFTOOL_PATH', default = os.path.join(benchmarkDirectory, 'fake_exiftool.py'), help = 'exiftool to run (default: fake_exiftool.py).')
+    argumentParser.add_argument ('--latency', metavar = 'SECONDS', type = float, default = 0.0, help = 'Extra time fake_exiftool.py takes per request (default: %(default)s).')
+    argumentParser.add_argument ('--baseline', metavar = 'FILE', default = os.path.join(benchmarkDirectory, 'baseline.json'), help = 'Baseline to compare with (default: %(default)s).')
+    argumentParser.add_argument ('--save-baseline', help = 'Store the results as the new baseline.', action = 'store_true')
+    argumentParser.add_argument ('--tolerance', metavar = 'RATIO', type = float, default = 0.25, help = 'Slowdown over the baseline flagged as a regression (default: %(default)s).')
+    arguments = argumentParser.parse_args()
+
+    baseline = dict ()
+
+    if os.path.exists(arguments.baseline):
+        with open(arguments.baseline, encoding = 'utf-8') as baselineFile:
+            baseline = json.load(baselineFile)['scenarios']
+
+    results = dict ()
+
+    for name, corpusArguments, renamerArguments in SCENARIOS:
+        if arguments.scenario is None or name in arguments.scenario:
+            try:
+                results[name] = bestOf(runScenario(corpusArguments, renamerArguments, arguments.exiftool, arguments.latency) for _ in range(arguments.rounds))
+            except (RuntimeError, OSError) as exception:
+                print('Scenario %s failed: %s' % (name, exception), file = sys.stderr)
+                sys.exit(2)
+
+    print('Best of %d rounds%s.' % (arguments.rounds, '' if len(baseline) > 0 else ', no baseline to compare with'))
+    regressions = compare(results, baseline, arguments.tolerance)
+
+    if arguments.save_baseline:
+        with open(arguments.baseline, 'w', encoding = 'utf-8') as baselineFile:
+            json.dump({'python': sys.version.split()[0], 'rounds': arguments.rounds, 'latency': arguments.latency, 'scenarios': results}, baselineFile, indent = 2)
+            baselineFile.write('\n')
+
+        print('Saved the results as the baseline in %s.' % arguments.baseline)
+    elif regressions > 0:
+        print('%d regressions over %.0f%%.' % (regressions, arguments.tolerance * 100), file = sys.stderr)
+        sys.exit(1)
@@ -51,6 +51,23 @@ Example usage::
     for d in metadata:
         print("{:20.20} {:20.20}".format(d["SourceFile"],
                                          d["EXIF:DateTimeOriginal"]))
+
+For asyncio programs, :py:class:`AsyncExifTool` provides the same
+methods as coroutines and lets several batches be in flight at once::
+
+    async with exiftool.AsyncExifTool() as et:
+        metadata = await et.get_metadata_batch(files)
+
+To use more than one core, :py:class:`ExifToolPool` runs several
+``exiftool`` processes and spreads batches of files across them::
+
+    with exiftool.ExifToolPool(jobs=4) as pool:
+        for metadata in pool.imap_metadata_batch(batches):
+            ...
+
+Programs which only read a few files per run can skip starting
+``exiftool`` by borrowing a running process from an
+:py:class:`ExifToolBroker` with :py:class:`ExifToolClient`.
 """
 
 from __future__ import unicode_literals
@@ -61,6 +78,22 @@ import os
 import json
 import warnings
 import codecs
+import select
+import re
+import itertools
+import collections
+import threading
+import concurrent.futures
+import time
+import struct
+import errno
+import contextvars
+
+# asyncio takes longer to import than everything else here, and is only
+# needed by AsyncExifTool, which imports it when started.  socket is only
+# needed by the broker and its clients, and html only for replies with
+# entities in them, so these are imported where they are used too.  The
+# renamer imports this module on every run, even for --version.
 
 try:        # Py3k compatibility
     basestring
@@ -74,14 +107,22 @@ If the executable is not located in one of the paths listed in the
 ``PATH`` environment variable, the full path should be given here.
 """
 
+# The arguments included in every command, unless the caller asks for
+# different ones.  ``-G`` prefixes tag names with their group and ``-n``
+# disables the print conversion of values.
+default_common_args = ["-G", "-n"]
+
 # Sentinel indicating the end of the output of a sequence of commands.
 # The standard value should be fine.
 sentinel = b"{ready}"
 
 # The block size when reading from exiftool.  The standard value
 # should be fine, though other values might give better performance in
-# some cases.
+# some cases.  Reads which fill the whole block double the block size
+# for the next read, up to max_block_size, so large replies need fewer
+# system calls.
 block_size = 4096
+max_block_size = 1048576
 
 # This code has been adapted from Lib/os.py in the Python source tree
 # (sha1 265e36e277f3)
@@ -112,6 +153,213 @@ def _fscodec():
 fsencode = _fscodec()
 del _fscodec
 
+class ExifToolError(IOError):
+    """Raised when ``exiftool`` dies or stops answering during a batch."""
+
+class ExifToolTimeout(ExifToolError):
+    """Raised when ``exiftool`` doesn't finish a batch in time."""
+
+class ExifToolEvent(collections.namedtuple(
+        "ExifToolEvent",
+        ["kind", "seconds", "request_bytes", "reply_bytes", "error"])):
+    """What happened in one step of a request, as passed to hooks.
+
+    ``kind`` is ``"execute"`` for a round trip to ``exiftool``, with
+    the size of the request and of the reply in bytes, or ``"decode"``
+    for parsing a reply of ``reply_bytes`` bytes.  ``seconds`` is the
+    wall time the step took, and ``error`` the exception it raised, or
+    ``None``.
+    """
+    __slots__ = ()
+
+def _notify(hooks, kind, started, request_bytes, reply_bytes, error=None):
+    event = ExifToolEvent(kind, time.perf_counter() - started,
+                          request_bytes, reply_bytes, error)
+    for hook in hooks:
+        hook(event)
+
+def _decode(hooks, decode, output):
+    # Run decode() on a reply, reporting it to the hooks.
+    if not hooks:
+        return decode(output)
+    started = time.perf_counter()
+    try:
+        result = decode(output)
+    except ValueError as e:
+        _notify(hooks, "decode", started, 0, len(output), e)
+        raise
+    _notify(hooks, "decode", started, 0, len(output))
+    return result
+
+def _decode_json(output):
+    return json.loads(output.decode("utf-8")) if output else []
+
+# Waiting for output with a timeout needs select(), which only works
+# with pipes on POSIX systems.  Elsewhere timeouts are ignored.
+_can_time_out = os.name == "posix"
+
+# Requests up to this size fit into an empty pipe in a single write and
+# are written directly; larger ones are written from a helper thread.
+_pipe_buf = getattr(select, "PIPE_BUF", 512)
+
+class _PipeTransport(object):
+    """Send requests to a ``-stay_open`` process and read its replies.
+
+    Replies are collected in a ``bytearray``, so reading a reply is
+    linear in its size, and only the tail of the reply is searched for
+    the sentinel after every read.  Requests which might not fit into
+    the pipe are written from a separate thread while the reply is
+    being read, so the process can never block on a full stdout pipe
+    while we block on a full stdin pipe.
+    """
+
+    def __init__(self, process):
+        self._stdin = process.stdin
+        self._fd = process.stdout.fileno()
+        self.read_size = block_size
+
+    def _write(self, payload, errors):
+        try:
+            self._stdin.write(payload)
+            self._stdin.flush()
+        except (IOError, OSError, ValueError) as e:
+            errors.append(e)
+
+    def communicate(self, payload, sentinel, timeout=None):
+        """Write ``payload`` and return the reply up to ``sentinel``.
+
+        The returned ``bytes`` object excludes the sentinel and the
+        whitespace surrounding the reply.  :py:exc:`ExifToolError` is
+        raised if the process closes its output before sending the
+        sentinel, and :py:exc:`ExifToolTimeout` if ``timeout`` seconds
+        pass without the complete reply.
+        """
+        deadline = None
+        if timeout is not None and _can_time_out:
+            deadline = time.monotonic() + timeout
+        errors = []
+        writer = None
+        if len(payload) > _pipe_buf:
+            writer = threading.Thread(target=self._write,
+                                      args=(payload, errors))
+            writer.daemon = True
+            writer.start()
+        else:
+            self._write(payload, errors)
+
+        output = bytearray()
+        # Only this many bytes at the end of the output can hold the
+        # sentinel together with the whitespace around it.
+        tail = len(sentinel) + 32
+        try:
+            while True:
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if (remaining <= 0 or
+                            not select.select([self._fd], [], [],
+                                              remaining)[0]):
+                        raise ExifToolTimeout(
+                            "exiftool didn't finish the batch in %g "
+                            "seconds." % timeout)
+                block = os.read(self._fd, self.read_size)
+                if not block:
+                    raise ExifToolError("exiftool exited before "
+                                        "finishing the batch.")
+                output += block
+                if output[-tail:].rstrip().endswith(sentinel):
+                    break
+                if (len(block) == self.read_size and
+                        self.read_size < max_block_size):
+                    self.read_size *= 2
+        finally:
+            if writer is not None:
+                writer.join()
+        if errors:
+            raise errors[0]
+
+        end = len(output)
+        while output[end - 1:end].isspace():
+            end -= 1
+        end -= len(sentinel)
+        start = 0
+        while start < end and output[start:start + 1].isspace():
+            start += 1
+        return bytes(memoryview(output)[start:end])
+
+# Tabular output (-T) has one line per file and one tab separated column
+# per tag, with "-" for missing tags.  -E escapes tabs, newlines and "&"
+# in values as HTML entities, so the columns can't be confused.  The
+# first columns identify the file: ExifToolVersion is never blank, so
+# stripping the reply can't eat into a real value, and Directory and
+# FileName are derived from the file name exiftool was given.
+_table_params = [b"-T", b"-E", b"-ExifToolVersion", b"-Directory",
+                 b"-FileName"]
+_table_id_columns = len(_table_params) - 2
+
+def _table_request(tags, filenames):
+    if isinstance(tags, basestring):
+        raise TypeError("The argument 'tags' must be "
+                        "an iterable of strings")
+    if isinstance(filenames, basestring):
+        raise TypeError("The argument 'filenames' must be "
+                        "an iterable of strings")
+    filenames = list(filenames)
+    params = list(_table_params)
+    params.extend(b"-" + fsencode(t) for t in tags)
+    params.extend(map(fsencode, filenames))
+    return params, filenames
+
+def _table_rows(lines, filenames):
+    # Pair every row with the requested file it belongs to.  exiftool
+    # answers in the order of the request, so if every file has a row,
+    # they simply line up.  Otherwise some files were skipped, and every
+    # row is matched to the next requested file with the same directory
+    # and name.
+    if len(lines) == len(filenames):
+        return zip(filenames, lines)
+    names = [os.path.split(f.decode(sys.getfilesystemencoding(),
+                                    "surrogateescape")
+                           if isinstance(f, bytes) else f)
+             for f in filenames]
+    pairs = []
+    position = 0
+    for line in lines:
+        values = line.split("\t")
+        if "&" in line:
+            from html import unescape
+            values = [unescape(v) for v in values]
+        directory, name = values[1:_table_id_columns]
+        if directory == ".":
+            directory = ""
+        while position < len(names):
+            head, tail = names[position]
+            position += 1
+            if tail == name and (head.rstrip("/") == directory.rstrip("/")
+                                 or head == "." and not directory):
+                pairs.append((filenames[position - 1], line))
+                break
+        else:
+            raise ValueError("exiftool returned a row for a file "
+                             "which wasn't requested: %r" % line)
+    return pairs
+
+def _parse_table(output, filenames):
+    output = output.rstrip(b"\r\n")
+    if not output:
+        return []
+    lines = output.decode("utf-8", "surrogateescape").split("\n")
+    result = []
+    for source, line in _table_rows(lines, filenames):
+        values = line.rstrip("\r").split("\t")
+        if "&" in line:
+            from html import unescape
+            values = [unescape(v) for v in values]
+        values[:_table_id_columns] = [source]
+        if "-" in values:
+            values = [None if v == "-" else v for v in values]
+        result.append(tuple(values))
+    return result
+
 class ExifTool(object):
     """Run the `exiftool` command-line tool and communicate to it.
 
@@ -119,6 +367,12 @@ class ExifTool(object):
     argument to the constructor.  The default value ``exiftool`` will
     only work if the executable is in your ``PATH``.
 
+    The optional ``common_args`` argument replaces the default common
+    arguments ``-G`` and ``-n``, which are included in every command.
+    This is the place for options like ``-fast`` which should apply
+    to every batch.  Note that the format of the returned dictionaries
+    depends on ``-G``.
+
     Most methods of this class are only available after calling
     :py:meth:`start()`, which will actually launch the subprocess.  To
     avoid leaving the subprocess running, make sure to call
@@ -136,11 +390,23 @@ class ExifTool(object):
         with ExifTool() as et:
             ...
 
-    .. warning:: Note that there is no error handling.  Nonsensical
-       options will be silently ignored by exiftool, so there's not
-       much that can be done in that regard.  You should avoid passing
-       non-existent files to any of the methods, since this will lead
-       to undefied behaviour.
+    ``hooks`` is an iterable of callables, which are called with an
+    :py:class:`ExifToolEvent` after every round trip to ``exiftool``
+    and after every reply is parsed, e.g. to collect statistics.  They
+    can be changed later through the ``hooks`` list attribute.
+
+    If ``timeout`` is given, a batch which takes longer than this many
+    seconds raises :py:exc:`ExifToolTimeout`.  When ``exiftool`` dies
+    or times out during a batch, :py:exc:`ExifToolError` is raised, the
+    process is killed, and a new one is started by the next call to
+    :py:meth:`execute()`.  The batch methods accept an ``on_failure``
+    callback, with which a failing batch is split up to find the files
+    causing the failure, while the other files still get their results;
+    see :py:meth:`get_metadata_batch()`.
+
+    .. warning:: Nonsensical options will be silently ignored by
+       exiftool, so there's not much that can be done in that regard.
+       Non-existent files are left out of the results.
 
     .. py:attribute:: running
 
@@ -148,20 +414,30 @@ class ExifTool(object):
        associated with a running subprocess.
     """
 
-    def __init__(self, executable_=None):
+    def __init__(self, executable_=None, common_args=None, timeout=None,
+                 hooks=None):
         if executable_ is None:
             self.executable = executable
         else:
             self.executable = executable_
+        if common_args is None:
+            self.common_args = list(default_common_args)
+        else:
+            self.common_args = list(common_args)
+        self.timeout = timeout
+        self.hooks = list(hooks or ())
         self.running = False
+        self._failed = False
+        self._stopping = False
 
     def start(self):
         """Start an ``exiftool`` process in batch mode for this instance.
 
         This method will issue a ``UserWarning`` if the subprocess is
-        already running.  The process is started with the ``-G`` and
-        ``-n`` as common arguments, which are automatically included
-        in every command you run with :py:meth:`execute()`.
+        already running.  The process is started with the common
+        arguments given to the constructor (``-G`` and ``-n`` by
+        default), which are automatically included in every command
+        you run with :py:meth:`execute()`.
         """
         if self.running:
             warnings.warn("ExifTool already running; doing nothing.")
@@ -169,10 +445,12 @@ class ExifTool(object):
         with open(os.devnull, "w") as devnull:
             self._process = subprocess.Popen(
                 [self.executable, "-stay_open", "True",  "-@", "-",
-                 "-common_args", "-G", "-n"],
+                 "-common_args"] + self.common_args,
                 stdin=subprocess.PIPE, stdout=subprocess.PIPE,
                 stderr=devnull)
+        self._transport = _PipeTransport(self._process)
         self.running = True
+        self._failed = False
 
     def terminate(self):
         """Terminate the ``exiftool`` process of this instance.
@@ -181,12 +459,43 @@ class ExifTool(object):
         """
         if not self.running:
             return
-        self._process.stdin.write(b"-stay_open\nFalse\n")
-        self._process.stdin.flush()
+        try:
+            self._process.stdin.write(b"-stay_open\nFalse\n")
+            self._process.stdin.flush()
+        except (IOError, OSError, ValueError):
+            # The process is already gone (e.g. killed by Ctrl-C
+            # together with us); there is nobody left to tell.
+            pass
         self._process.communicate()
         del self._process
+        del self._transport
         self.running = False
 
+    def kill(self):
+        """Kill the ``exiftool`` process of this instance immediately.
+
+        Unlike :py:meth:`terminate()`, this does not wait for the batch
+        being processed to finish.  If the subprocess isn't running,
+        this method will do nothing.
+        """
+        if not self.running:
+            return
+        self._process.kill()
+        self._process.wait()
+        del self._process
+        del self._transport
+        self.running = False
+
+    def stop(self):
+        """Kill the ``exiftool`` process of this instance for good.
+
+        Unlike after :py:meth:`kill()`, a batch in progress in another
+        thread fails with :py:exc:`ExifToolError` without being
+        bisected, and :py:meth:`execute()` doesn't start a new process.
+        """
+        self._stopping = True
+        self.kill()
+
     def __enter__(self):
         self.start()
         return self
@@ -213,18 +522,36 @@ class ExifTool(object):
         encoding exiftool accepts.  For filenames, this should be the
         system's filesystem encoding.
 
+        If the process died or timed out during the previous batch, a
+        new one is started first.  If it dies or times out during this
+        batch, :py:exc:`ExifToolError` is raised and the process is
+        killed, since its output can't be matched to the batches anymore.
+
         .. note:: This is considered a low-level method, and should
            rarely be needed by application developers.
         """
         if not self.running:
-            raise ValueError("ExifTool instance not running.")
-        self._process.stdin.write(b"\n".join(params + (b"-execute\n",)))
-        self._process.stdin.flush()
-        output = b""
-        fd = self._process.stdout.fileno()
-        while not output[-32:].strip().endswith(sentinel):
-            output += os.read(fd, block_size)
-        return output.strip()[:-len(sentinel)]
+            if not self._failed or self._stopping:
+                raise ValueError("ExifTool instance not running.")
+            self.start()
+        payload = b"\n".join(params + (b"-execute\n",))
+        started = time.perf_counter()
+        try:
+            output = self._transport.communicate(payload, sentinel,
+                                                 self.timeout)
+        except ExifToolError as e:
+            if self._stopping:
+                # stop() killed the process, and cleans up after it.
+                raise
+            self.kill()
+            self._failed = True
+            if self.hooks:
+                _notify(self.hooks, "execute", started, len(payload), 0, e)
+            raise
+        if self.hooks:
+            _notify(self.hooks, "execute", started, len(payload),
+                    len(output))
+        return output
 
     def execute_json(self, *params):
         """Execute the given batch of parameters and parse the JSON output.
@@ -247,16 +574,59 @@ class ExifTool(object):
         pass in filenames according to the convention of the
         respective Python version – as raw strings in Python 2.x and
         as Unicode strings in Python 3.x.
+
+        If none of the files could be read, an empty list is returned.
         """
         params = map(fsencode, params)
-        return json.loads(self.execute(b"-j", *params).decode("utf-8"))
+        return _decode(self.hooks, _decode_json, self.execute(b"-j", *params))
+
+    def _isolate(self, function, filenames, on_failure):
+        # Run function on the files, and if exiftool fails on them,
+        # bisect them until the failing files are found.  Smaller
+        # batches get a proportionally smaller timeout, so a file which
+        # hangs exiftool costs about twice the timeout in total.
+        filenames = list(filenames)
+        timeout = self.timeout
+
+        def run(part):
+            try:
+                return function(part)
+            except (ExifToolError, ValueError) as e:
+                # ValueError covers output which isn't valid JSON.
+                if self._stopping:
+                    raise
+                if len(part) < 2:
+                    if not part:
+                        raise
+                    on_failure(part[0], e)
+                    return []
+            middle = len(part) // 2
+            if timeout is not None:
+                self.timeout = max(timeout * middle / len(filenames),
+                                   min(timeout, 10.0))
+            return run(part[:middle]) + run(part[middle:])
 
-    def get_metadata_batch(self, filenames):
+        try:
+            return run(filenames)
+        finally:
+            self.timeout = timeout
+
+    def get_metadata_batch(self, filenames, on_failure=None):
         """Return all meta-data for the given files.
 
         The return value will have the format described in the
         documentation of :py:meth:`execute_json()`.
+
+        If ``on_failure`` is given and ``exiftool`` fails on the batch
+        (it dies, times out or produces invalid output), the batch is
+        bisected to find the files causing the failure.
+        ``on_failure(filename, exception)`` is called for each of these,
+        and the results of all other files are returned.  Without it,
+        the exception is raised.
         """
+        if on_failure is not None:
+            return self._isolate(self.get_metadata_batch, filenames,
+                                 on_failure)
         return self.execute_json(*filenames)
 
     def get_metadata(self, filename):
@@ -267,7 +637,7 @@ class ExifTool(object):
         """
         return self.execute_json(filename)[0]
 
-    def get_tags_batch(self, tags, filenames):
+    def get_tags_batch(self, tags, filenames, on_failure=None):
         """Return only specified tags for the given files.
 
         The first argument is an iterable of tags.  The tag names may
@@ -276,7 +646,8 @@ class ExifTool(object):
         The second argument is an iterable of file names.
 
         The format of the return value is the same as for
-        :py:meth:`execute_json()`.
+        :py:meth:`execute_json()`.  See :py:meth:`get_metadata_batch()`
+        for ``on_failure``.
         """
         # Explicitly ruling out strings here because passing in a
         # string would lead to strange and hard-to-find errors
@@ -286,6 +657,11 @@ class ExifTool(object):
         if isinstance(filenames, basestring):
             raise TypeError("The argument 'filenames' must be "
                             "an iterable of strings")
+        if on_failure is not None:
+            tags = list(tags)
+            return self._isolate(
+                lambda part: self.get_tags_batch(tags, part), filenames,
+                on_failure)
         params = ["-" + t for t in tags]
         params.extend(filenames)
         return self.execute_json(*params)
@@ -298,6 +674,32 @@ class ExifTool(object):
         """
         return self.get_tags_batch(tags, [filename])[0]
 
+    def get_tag_table_batch(self, tags, filenames, on_failure=None):
+        """Return the values of a fixed list of tags for the given files.
+
+        This asks ``exiftool`` for tabular output (``-T``) instead of
+        JSON, which is a lot cheaper to produce and to parse when many
+        files are read for a few known tags.  The return value is a
+        list with one tuple per file, holding the file name as given
+        in ``filenames``, followed by the value of every tag in the
+        order of ``tags``.  Values are strings, or ``None`` for tags
+        the file doesn't have.  Unlike :py:meth:`get_tags_batch()`,
+        numbers are not converted, and a tag found in several groups
+        only gives one value.
+
+        Files ``exiftool`` can't read are left out.  See
+        :py:meth:`get_metadata_batch()` for ``on_failure``.
+        """
+        if on_failure is not None:
+            tags = list(tags)
+            return self._isolate(
+                lambda part: self.get_tag_table_batch(tags, part),
+                filenames, on_failure)
+        params, filenames = _table_request(tags, filenames)
+        return _decode(self.hooks,
+                       lambda output: _parse_table(output, filenames),
+                       self.execute(*params))
+
     def get_tag_batch(self, tag, filenames):
         """Extract a single tag from the given files.
 
@@ -323,3 +725,875 @@ class ExifTool(object):
         ``None`` if this tag was not found in the file.
         """
         return self.get_tag_batch(tag, [filename])[0]
+
+class ExifToolPool(object):
+    """Run several ``exiftool`` processes and spread batches across them.
+
+    A single :py:class:`ExifTool` instance can only keep one core busy.
+    This class keeps up to ``jobs`` instances, each one owned by a
+    worker thread, and sends every batch of files to the next idle
+    instance.  ``jobs`` defaults to the number of CPUs.  The
+    ``exiftool`` processes are only launched when a batch actually
+    needs one, so a pool that has little work to do will not start all
+    of them.
+
+    ``common_args``, ``timeout`` and ``hooks`` are passed on to every
+    :py:class:`ExifTool` instance.  Hooks are called from the worker
+    threads, so they must be thread-safe.  The instances are made by
+    calling ``factory(executable_, common_args, timeout, hooks)``,
+    which defaults to :py:class:`ExifTool`; e.g. pass
+    ``functools.partial(ExifToolClient, address)`` to use the processes
+    of a broker.  Like :py:class:`ExifTool`, the pool must be started before use and
+    should be used as a context manager, which terminates every worker
+    process, also when the block is left by an exception such as
+    ``KeyboardInterrupt``::
+
+        with ExifToolPool(jobs=8) as pool:
+            metadata = pool.get_metadata_batch(files)
+
+    .. py:attribute:: running
+
+       A Boolean value indicating whether this pool is currently
+       accepting batches.
+    """
+
+    def __init__(self, executable_=None, jobs=None, common_args=None,
+                 timeout=None, hooks=None, factory=None):
+        self.running = False
+        if executable_ is None:
+            self.executable = executable
+        else:
+            self.executable = executable_
+        self.common_args = common_args
+        self.timeout = timeout
+        self.hooks = list(hooks or ())
+        self.factory = ExifTool if factory is None else factory
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        if jobs < 1:
+            raise ValueError("An ExifToolPool needs at least one job.")
+        self.jobs = jobs
+
+    def start(self):
+        """Prepare the pool for accepting batches.
+
+        This method will issue a ``UserWarning`` if the pool is already
+        running.  The ``exiftool`` processes themselves are launched on
+        demand by the worker threads.
+        """
+        if self.running:
+            warnings.warn("ExifToolPool already running; doing nothing.")
+            return
+        self._workers = []
+        self._workers_lock = threading.Lock()
+        self._local = threading.local()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.jobs, thread_name_prefix="exiftool")
+        self._stopping = False
+        self.running = True
+
+    def terminate(self, kill=False):
+        """Terminate all ``exiftool`` processes of this pool.
+
+        Batches which haven't been started yet are cancelled.  If
+        ``kill`` is true, the processes are stopped (see
+        :py:meth:`ExifTool.stop()`) instead of waiting for the batches in
+        progress to finish, which then fail.  Either way, this returns
+        once the worker threads are done.  If the pool isn't running,
+        this method will do nothing.
+        """
+        if not self.running:
+            return
+        self.running = False
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._workers_lock:
+            # No worker starts a process after this.
+            self._stopping = True
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            if kill:
+                worker.stop()
+            else:
+                worker.terminate()
+        self._executor.shutdown(wait=True)
+        del self._executor
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # Don't wait for the batches in progress if we are leaving
+        # because of an error or Ctrl-C.
+        self.terminate(kill=exc_type is not None)
+
+    def __del__(self):
+        self.terminate()
+
+    def _worker(self):
+        # Every worker thread owns exactly one exiftool process, so
+        # the processes never have to be locked.
+        worker = getattr(self._local, "worker", None)
+        if worker is None:
+            worker = self.factory(self.executable, self.common_args,
+                                  self.timeout, self.hooks)
+            worker.start()
+            with self._workers_lock:
+                if self._stopping:
+                    worker.kill()
+                    raise ValueError("ExifToolPool instance not running.")
+                self._workers.append(worker)
+            self._local.worker = worker
+        return worker
+
+    def _run(self, function, batch):
+        if not batch:
+            return []
+        return function(self._worker(), batch)
+
+    def imap(self, function, batches, ordered=True):
+        """Apply ``function`` to every batch, using all workers.
+
+        ``function`` is called as ``function(et, batch)`` in a worker
+        thread, where ``et`` is a running :py:class:`ExifTool`
+        instance.  ``batches`` can be any iterable, including a
+        generator; at most two batches per job are taken from it
+        ahead of the results being consumed.  Empty batches are not
+        sent to ``exiftool`` and produce an empty list.
+
+        This is a generator yielding the return value of ``function``
+        for every batch.  If ``ordered`` is true, the results come in
+        the order of ``batches``; otherwise they come as soon as they
+        are finished.  Exceptions raised by ``function`` are re-raised
+        when the corresponding result is reached.
+        """
+        if not self.running:
+            raise ValueError("ExifToolPool instance not running.")
+        limit = 2 * self.jobs
+        pending = collections.deque()
+
+        def next_result():
+            if ordered:
+                return pending.popleft().result()
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            future = done.pop()
+            pending.remove(future)
+            return future.result()
+
+        try:
+            for batch in batches:
+                pending.append(
+                    self._executor.submit(self._run, function, batch))
+                while len(pending) >= limit:
+                    yield next_result()
+            while pending:
+                yield next_result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def imap_metadata_batch(self, batches, ordered=True, on_failure=None):
+        """Return all meta-data for every batch of files in ``batches``.
+
+        This is a generator yielding one list per batch, in the format
+        described in :py:meth:`ExifTool.execute_json()`.  See
+        :py:meth:`imap()` for the meaning of ``ordered``, and
+        :py:meth:`ExifTool.get_metadata_batch()` for ``on_failure``,
+        which is called from the worker threads.
+        """
+        return self.imap(
+            lambda et, batch: et.get_metadata_batch(batch, on_failure),
+            batches, ordered)
+
+    def imap_tags_batch(self, tags, batches, ordered=True, on_failure=None):
+        """Return only specified tags for every batch in ``batches``.
+
+        This is the pool version of :py:meth:`ExifTool.get_tags_batch()`;
+        see :py:meth:`imap_metadata_batch()` for the return value.
+        """
+        if isinstance(tags, basestring):
+            raise TypeError("The argument 'tags' must be "
+                            "an iterable of strings")
+        tags = list(tags)
+        return self.imap(
+            lambda et, batch: et.get_tags_batch(tags, batch, on_failure),
+            batches, ordered)
+
+    def imap_tag_table_batch(self, tags, batches, ordered=True,
+                             on_failure=None):
+        """Return the values of a fixed list of tags for every batch.
+
+        This is the pool version of
+        :py:meth:`ExifTool.get_tag_table_batch()`, yielding one list of
+        tuples per batch.
+        """
+        if isinstance(tags, basestring):
+            raise TypeError("The argument 'tags' must be "
+                            "an iterable of strings")
+        tags = list(tags)
+        return self.imap(
+            lambda et, batch: et.get_tag_table_batch(tags, batch,
+                                                     on_failure),
+            batches, ordered)
+
+    def _split(self, filenames):
+        if isinstance(filenames, basestring):
+            raise TypeError("The argument 'filenames' must be "
+                            "an iterable of strings")
+        filenames = list(filenames)
+        size = max(1, -(-len(filenames) // self.jobs))
+        return [filenames[i:i + size]
+                for i in range(0, len(filenames), size)]
+
+    def get_metadata_batch(self, filenames, on_failure=None):
+        """Return all meta-data for the given files.
+
+        The files are split evenly across the workers.  The return
+        value is a single list in the order of ``filenames``, with the
+        format described in :py:meth:`ExifTool.execute_json()`.
+        """
+        result = []
+        for metadata in self.imap_metadata_batch(
+                self._split(filenames), on_failure=on_failure):
+            result.extend(metadata)
+        return result
+
+    def get_tags_batch(self, tags, filenames, on_failure=None):
+        """Return only specified tags for the given files.
+
+        This is the pool version of :py:meth:`ExifTool.get_tags_batch()`;
+        see :py:meth:`get_metadata_batch()` for the return value.
+        """
+        result = []
+        for metadata in self.imap_tags_batch(
+                tags, self._split(filenames), on_failure=on_failure):
+            result.extend(metadata)
+        return result
+
+# Requests and replies between ExifToolClient and ExifToolBroker are
+# frames: a header with the kind of the request or the status of the
+# reply, the timeout of the request in seconds (negative for none) and
+# the length of the payload, followed by the payload.  The payload of a
+# hello is the executable and the common arguments, one per line, and
+# the payload of a request is what ExifTool.execute() would write to the
+# process; replies carry the output, or the error message.
+_frame = struct.Struct("!BdI")
+_HELLO, _EXECUTE = 0, 1
+_OK, _FAILED, _TIMED_OUT = 0, 1, 2
+
+def _send_frame(connection, kind, timeout, payload):
+    connection.sendall(_frame.pack(kind, timeout, len(payload)) + payload)
+
+def _receive_exactly(connection, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = connection.recv_into(view[received:])
+        if not count:
+            raise ExifToolError("The exiftool broker connection was "
+                                "closed.")
+        received += count
+    return bytes(buffer)
+
+def _receive_frame(connection):
+    kind, timeout, length = _frame.unpack(
+        _receive_exactly(connection, _frame.size))
+    return kind, timeout, _receive_exactly(connection, length)
+
+class _SocketTransport(object):
+    """Send requests to an :py:class:`ExifToolBroker` and read replies.
+
+    This has the interface of :py:class:`_PipeTransport`.  The broker
+    applies the timeout to its ``exiftool`` process, so the connection
+    itself gets a few more seconds, for the broker to report back.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def communicate(self, payload, sentinel, timeout=None):
+        import socket
+        self._connection.settimeout(None if timeout is None
+                                    else timeout + 5.0)
+        try:
+            _send_frame(self._connection, _EXECUTE,
+                        -1.0 if timeout is None else timeout, payload)
+            status, _, reply = _receive_frame(self._connection)
+        except socket.timeout:
+            raise ExifToolTimeout("The exiftool broker didn't finish the "
+                                  "batch in %g seconds." % timeout)
+        except ExifToolError:
+            raise
+        except OSError as e:
+            raise ExifToolError("Lost the connection to the exiftool "
+                                "broker: %s" % e)
+        if status == _TIMED_OUT:
+            raise ExifToolTimeout(reply.decode("utf-8", "replace"))
+        if status != _OK:
+            raise ExifToolError(reply.decode("utf-8", "replace"))
+        return reply
+
+class ExifToolClient(ExifTool):
+    """An :py:class:`ExifTool` using a process kept by a broker.
+
+    Starting ``exiftool`` means starting a Perl interpreter and loading
+    its modules, which takes longer than reading a few files.  An
+    :py:class:`ExifToolBroker` running in another program keeps
+    ``exiftool`` processes running, and this class borrows one of them
+    through the broker's Unix domain socket at ``address`` from
+    :py:meth:`start()` to :py:meth:`terminate()`.  The other arguments
+    and all methods are the same as for :py:class:`ExifTool`, and the
+    broker starts the same ``exiftool`` with the same common arguments
+    the instance would.
+
+    :py:meth:`start()` raises ``OSError`` if there is no broker at
+    ``address`` or it can't start ``exiftool``, so a program can fall
+    back to :py:class:`ExifTool`.  If the broker goes away later,
+    batches fail with :py:exc:`ExifToolError` and the next one connects
+    again, like an :py:class:`ExifTool` restarts its process.
+    """
+
+    def __init__(self, address, executable_=None, common_args=None,
+                 timeout=None, hooks=None):
+        super(ExifToolClient, self).__init__(executable_, common_args,
+                                             timeout, hooks)
+        self.address = address
+
+    def start(self):
+        """Borrow an ``exiftool`` process from the broker."""
+        if self.running:
+            warnings.warn("ExifToolClient already running; doing nothing.")
+            return
+        import socket
+        if not hasattr(socket, "AF_UNIX"):
+            raise OSError("Unix domain sockets are not supported here.")
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(self.address)
+            _send_frame(connection, _HELLO, -1.0, b"\n".join(
+                fsencode(a) for a in [self.executable] + self.common_args))
+            status, _, reply = _receive_frame(connection)
+            if status != _OK:
+                raise ExifToolError(reply.decode("utf-8", "replace"))
+        except BaseException:
+            connection.close()
+            raise
+        self._connection = connection
+        self._transport = _SocketTransport(connection)
+        self.running = True
+        self._failed = False
+
+    def terminate(self):
+        """Give the ``exiftool`` process back to the broker.
+
+        If the instance isn't connected, this method will do nothing.
+        """
+        if not self.running:
+            return
+        import socket
+        try:
+            # Wakes up a thread waiting for a reply, close() alone doesn't.
+            self._connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._connection.close()
+        del self._connection
+        del self._transport
+        self.running = False
+
+    # A batch in progress can't be taken back, the broker finishes or
+    # times it out on its own.
+    kill = terminate
+
+class ExifToolBroker(object):
+    """Keep ``exiftool`` processes running for other programs.
+
+    The broker listens on a Unix domain socket at ``address``, and
+    lends a running ``exiftool`` process to every
+    :py:class:`ExifToolClient` connecting to it, for as long as the
+    client stays connected.  Processes are started for the executable
+    and common arguments every client asks for, and up to ``jobs`` of
+    each kind are kept running when they are given back (default: the
+    number of CPUs).  :py:meth:`start()` already starts ``jobs``
+    processes of ``executable_`` with ``common_args``, the ones most
+    clients are expected to ask for.
+
+    ``timeout`` applies to the batches of clients which don't give one.
+    The socket is only accessible to the user running the broker, since
+    clients choose the executable it runs.  Use the broker as a context
+    manager and call :py:meth:`serve_forever()`, which returns when
+    interrupted, e.g. by ``KeyboardInterrupt``::
+
+        with ExifToolBroker("/run/user/1000/exiftool.sock") as broker:
+            broker.serve_forever()
+    """
+
+    def __init__(self, address, jobs=None, executable_=None,
+                 common_args=None, timeout=None):
+        self.address = address
+        if executable_ is None:
+            self.executable = executable
+        else:
+            self.executable = executable_
+        if common_args is None:
+            self.common_args = list(default_common_args)
+        else:
+            self.common_args = list(common_args)
+        self.timeout = timeout
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        if jobs < 1:
+            raise ValueError("An ExifToolBroker needs at least one job.")
+        self.jobs = jobs
+        self.running = False
+
+    def start(self):
+        """Listen on the socket and start the first processes.
+
+        ``OSError`` is raised if another broker is already listening
+        on ``address``.  A socket left behind by a broker which didn't
+        exit cleanly is replaced.
+        """
+        if self.running:
+            warnings.warn("ExifToolBroker already running; doing nothing.")
+            return
+        import socket
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            if os.path.exists(self.address):
+                try:
+                    listener.connect(self.address)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    os.unlink(self.address)
+                else:
+                    raise OSError(errno.EADDRINUSE, "An exiftool broker is "
+                                  "already listening on %s." % self.address)
+                listener.close()
+                listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            umask = os.umask(0o177)
+            try:
+                listener.bind(self.address)
+            finally:
+                os.umask(umask)
+            listener.listen(64)
+        except BaseException:
+            listener.close()
+            raise
+        self._listener = listener
+        self._idle = {}
+        self._workers = set()
+        self._lock = threading.Lock()
+        self.running = True
+        key = (self.executable, tuple(self.common_args))
+        try:
+            for _ in range(self.jobs):
+                self._give_back(key, self._borrow(key))
+        except BaseException:
+            self.terminate()
+            raise
+
+    def terminate(self):
+        """Stop listening and terminate all ``exiftool`` processes.
+
+        Clients still connected lose their process.  If the broker
+        isn't running, this method will do nothing.
+        """
+        if not self.running:
+            return
+        self.running = False
+        self._listener.close()
+        try:
+            os.unlink(self.address)
+        except OSError:
+            pass
+        with self._lock:
+            workers, self._workers = self._workers, set()
+            self._idle.clear()
+        for worker in workers:
+            worker.kill()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.terminate()
+
+    def __del__(self):
+        self.terminate()
+
+    def _borrow(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+        worker = ExifTool(key[0], list(key[1]), self.timeout)
+        worker.start()
+        with self._lock:
+            self._workers.add(worker)
+        return worker
+
+    def _give_back(self, key, worker):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if self.running and worker.running and len(idle) < self.jobs:
+                idle.append(worker)
+                return
+            self._workers.discard(worker)
+        worker.terminate()
+
+    def _serve(self, connection):
+        worker = None
+        try:
+            kind, _, payload = _receive_frame(connection)
+            if kind != _HELLO:
+                return
+            arguments = [os.fsdecode(a) for a in payload.split(b"\n")]
+            key = (arguments[0], tuple(arguments[1:]))
+            try:
+                worker = self._borrow(key)
+            except OSError as e:
+                _send_frame(connection, _FAILED, 0.0, str(e).encode("utf-8"))
+                return
+            _send_frame(connection, _OK, 0.0, b"")
+            while True:
+                kind, timeout, payload = _receive_frame(connection)
+                # Undo the b"\n".join() of ExifTool.execute().
+                params = payload[:-len(b"-execute\n")].split(b"\n")[:-1]
+                worker.timeout = self.timeout if timeout < 0 else timeout
+                try:
+                    status, reply = _OK, worker.execute(*params)
+                except ExifToolTimeout as e:
+                    status, reply = _TIMED_OUT, str(e).encode("utf-8")
+                except OSError as e:
+                    status, reply = _FAILED, str(e).encode("utf-8")
+                _send_frame(connection, status, 0.0, reply)
+        except OSError:
+            # The client went away, which also ends its batches.
+            pass
+        finally:
+            connection.close()
+            if worker is not None:
+                self._give_back(key, worker)
+
+    def serve_forever(self):
+        """Serve clients, every one from its own thread, until interrupted.
+        """
+        while self.running:
+            try:
+                connection, _ = self._listener.accept()
+            except OSError:
+                if not self.running:
+                    return
+                raise
+            thread = threading.Thread(target=self._serve, args=(connection,),
+                                      name="exiftool-broker")
+            thread.daemon = True
+            thread.start()
+
+class _Interrupted(ExifToolError):
+    """A batch of an :py:class:`AsyncExifTool` lost its process to an
+    earlier batch, and has to be sent again."""
+
+# The timeout of the batches of the current asyncio task while a failed
+# batch is bisected, so batches of other tasks keep theirs.
+_bisect_timeout = contextvars.ContextVar("_bisect_timeout", default=None)
+
+class AsyncExifTool(object):
+    """Run the ``exiftool`` command-line tool from asyncio code.
+
+    This is the asyncio counterpart of :py:class:`ExifTool`, with the
+    same constructor arguments.  The process is started with
+    :py:meth:`start()` and stopped with :py:meth:`terminate()`, both of
+    which are coroutines, or by using the instance as an asynchronous
+    context manager::
+
+        async with AsyncExifTool() as et:
+            metadata = await et.get_metadata_batch(files)
+
+    Every batch is sent with a numbered ``-execute<N>``, and ``exiftool``
+    ends its reply with the matching ``{ready<N>}``.  So any number of
+    coroutines can call :py:meth:`execute()` concurrently: their
+    batches are queued in the process' input right away, keeping it
+    busy, and every reply is handed to the coroutine waiting for it.
+    The ``seconds`` of an ``"execute"`` event passed to the hooks
+    include the time the batch waited behind the ones before it.
+
+    ``timeout`` and the ``on_failure`` callback of the batch methods
+    work as with :py:class:`ExifTool`.  A batch's timeout starts when
+    ``exiftool`` gets to it, that is when the batch before it is
+    answered.  When ``exiftool`` dies or times out, the process is
+    killed and the batch it was working on fails with
+    :py:exc:`ExifToolError`; the batches queued behind it are sent
+    again to a new process, started by the next :py:meth:`execute()`.
+
+    .. py:attribute:: running
+
+       A Boolean value indicating whether this instance is currently
+       associated with a running subprocess.
+    """
+
+    _ready = re.compile(br"\{ready(\d+)\}")
+
+    def __init__(self, executable_=None, common_args=None, timeout=None,
+                 hooks=None):
+        if executable_ is None:
+            self.executable = executable
+        else:
+            self.executable = executable_
+        if common_args is None:
+            self.common_args = list(default_common_args)
+        else:
+            self.common_args = list(common_args)
+        self.timeout = timeout
+        self.hooks = list(hooks or ())
+        self.running = False
+        self._failed = False
+        self._reader = None
+        self._restarting = None
+
+    async def start(self):
+        """Start an ``exiftool`` process in batch mode for this instance.
+
+        See :py:meth:`ExifTool.start()`.
+        """
+        if self.running:
+            warnings.warn("AsyncExifTool already running; doing nothing.")
+            return
+        import asyncio
+        if self._reader is not None:
+            # Reap the process which failed.
+            await self._reader
+        self._process = await asyncio.create_subprocess_exec(
+            self.executable, "-stay_open", "True",  "-@", "-",
+            "-common_args", *self.common_args,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL)
+        self._numbers = itertools.count(1)
+        self._pending = {}
+        self._last = None
+        self._loop = asyncio.get_running_loop()
+        if self._restarting is None:
+            self._restarting = asyncio.Lock()
+        self._reader = asyncio.ensure_future(
+            self._read_replies(self._process, self._pending))
+        self.running = True
+        self._failed = False
+
+    async def terminate(self):
+        """Terminate the ``exiftool`` process of this instance.
+
+        Batches still waiting for their reply fail with
+        :py:exc:`ExifToolError`.  If the subprocess isn't running, this method will do nothing.
+        """
+        if not self.running:
+            if self._reader is not None:
+                await self._reader
+                self._reader = None
+            return
+        self.running = False
+        try:
+            self._process.stdin.write(b"-stay_open\nFalse\n")
+            await self._process.stdin.drain()
+            self._process.stdin.close()
+        except (IOError, OSError):
+            pass
+        await self._process.wait()
+        await self._reader
+        self._reader = None
+        del self._process, self._loop
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None and self.running:
+            # Don't wait for batches nobody is interested in anymore.
+            self._process.kill()
+        await self.terminate()
+
+    def _fail(self, error):
+        # Kill the process, since its output can't be matched to the
+        # batches anymore.  The batch it was working on is the oldest
+        # one still waiting, and fails with error; the others never got
+        # to exiftool, and are sent again.
+        self.running = False
+        self._failed = True
+        try:
+            self._process.kill()
+        except ProcessLookupError:
+            pass
+        for position, future in enumerate(self._pending.values()):
+            if not future.done():
+                future.set_exception(
+                    error if position == 0 else _Interrupted(str(error)))
+        self._pending.clear()
+
+    async def _read_replies(self, process, pending):
+        output = bytearray()
+        # Where to continue looking for the next sentinel.
+        scanned = 0
+        try:
+            while True:
+                block = await process.stdout.read(max_block_size)
+                if not block:
+                    break
+                output += block
+                while True:
+                    match = self._ready.search(output, max(0, scanned - 32))
+                    if match is None:
+                        scanned = len(output)
+                        break
+                    number = int(match.group(1))
+                    reply = bytes(output[:match.start()]).strip()
+                    del output[:match.end()]
+                    scanned = 0
+                    future = pending.pop(number, None)
+                    if future is not None and not future.done():
+                        future.set_result(reply)
+        finally:
+            if self.running and process is self._process:
+                self._fail(ExifToolError("exiftool exited before "
+                                         "finishing the batch."))
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(
+                        ExifToolError("exiftool exited before finishing "
+                                      "the batch."))
+            pending.clear()
+            await process.wait()
+
+    async def execute(self, *params):
+        """Execute the given batch of parameters with ``exiftool``.
+
+        This is the coroutine version of :py:meth:`ExifTool.execute()`,
+        returning the raw ``bytes`` output of the batch.  Other batches
+        may be sent while this one is waiting for its reply.
+        """
+        import asyncio
+        while True:
+            if not self.running:
+                if not self._failed:
+                    raise ValueError("AsyncExifTool instance not running.")
+                async with self._restarting:
+                    if not self.running:
+                        await self.start()
+            number = next(self._numbers)
+            future = self._loop.create_future()
+            self._pending[number] = future
+            previous, self._last = self._last, future
+            payload = b"\n".join(
+                params + (("-execute%d\n" % number).encode("ascii"),))
+            started = time.perf_counter()
+            timeout = _bisect_timeout.get() or self.timeout
+            try:
+                try:
+                    self._process.stdin.write(payload)
+                    await self._process.stdin.drain()
+                except (IOError, OSError):
+                    # exiftool exited; the reader fails the batches.
+                    pass
+                if timeout is not None and previous is not None:
+                    await asyncio.wait([previous])
+                try:
+                    output = await asyncio.wait_for(future, timeout)
+                except asyncio.TimeoutError:
+                    error = ExifToolTimeout(
+                        "exiftool didn't finish the batch in %g "
+                        "seconds." % timeout)
+                    if self.running and not self._failed:
+                        self._fail(error)
+                    raise error
+            except _Interrupted:
+                continue
+            except ExifToolError as e:
+                if self.hooks:
+                    _notify(self.hooks, "execute", started, len(payload), 0, e)
+                raise
+            if self.hooks:
+                _notify(self.hooks, "execute", started, len(payload),
+                        len(output))
+            return output
+
+    async def _isolate(self, function, filenames, on_failure):
+        # The coroutine version of ExifTool._isolate().
+        filenames = list(filenames)
+        timeout = self.timeout
+
+        async def run(part):
+            try:
+                return await function(part)
+            except (ExifToolError, ValueError) as e:
+                if len(part) < 2:
+                    if not part:
+                        raise
+                    on_failure(part[0], e)
+                    return []
+            middle = len(part) // 2
+            if timeout is not None:
+                _bisect_timeout.set(max(timeout * middle / len(filenames),
+                                        min(timeout, 10.0)))
+            return await run(part[:middle]) + await run(part[middle:])
+
+        token = _bisect_timeout.set(None)
+        try:
+            return await run(filenames)
+        finally:
+            _bisect_timeout.reset(token)
+
+    async def execute_json(self, *params):
+        """Execute the given batch of parameters and parse the JSON output.
+
+        See :py:meth:`ExifTool.execute_json()`.
+        """
+        params = map(fsencode, params)
+        return _decode(self.hooks, _decode_json,
+                       await self.execute(b"-j", *params))
+
+    async def get_metadata_batch(self, filenames, on_failure=None):
+        """Return all meta-data for the given files.
+
+        See :py:meth:`ExifTool.get_metadata_batch()`.
+        """
+        if on_failure is not None:
+            return await self._isolate(self.get_metadata_batch, filenames,
+                                       on_failure)
+        return await self.execute_json(*filenames)
+
+    async def get_tags_batch(self, tags, filenames, on_failure=None):
+        """Return only specified tags for the given files.
+
+        See :py:meth:`ExifTool.get_tags_batch()`.
+        """
+        if isinstance(tags, basestring):
+            raise TypeError("The argument 'tags' must be "
+                            "an iterable of strings")
+        if isinstance(filenames, basestring):
+            raise TypeError("The argument 'filenames' must be "
+                            "an iterable of strings")
+        if on_failure is not None:
+            tags = list(tags)
+            return await self._isolate(
+                lambda part: self.get_tags_batch(tags, part), filenames,
+                on_failure)
+        params = ["-" + t for t in tags]
+        params.extend(filenames)
+        return await self.execute_json(*params)
+
+    async def get_tag_table_batch(self, tags, filenames, on_failure=None):
+        """Return the values of a fixed list of tags for the given files.
+
+        See :py:meth:`ExifTool.get_tag_table_batch()`.
+        """
+        if on_failure is not None:
+            tags = list(tags)
+            return await self._isolate(
+                lambda part: self.get_tag_table_batch(tags, part),
+                filenames, on_failure)
+        params, filenames = _table_request(tags, filenames)
+        return _decode(self.hooks,
+                       lambda output: _parse_table(output, filenames),
+                       await self.execute(*params))
@@ -25,80 +25,2811 @@ import sys
 import argparse
 import logging
 import glob
+import collections
+import json
+import time
+import functools
+import mmap
+import struct
+import fnmatch
+import re
+import queue
+import threading
+import concurrent.futures
+import unicodedata
+import zlib
+import stat
+import errno
+import select
+import signal
+import atexit
+
+# asyncio, ctypes and cProfile are imported where they are used, since most runs don't need
+# them and importing them takes longer than a run answered by the cache or an exiftool broker.
+# So are sqlite3 (the cache) and hashlib (--duplicates), and exiftool defers socket and html.
+# With these, --version takes about 95 ms instead of 110 ms here: 15 ms is Python starting, up
+# to 40 ms compiling this script (scripts don't get a cached .pyc), and about 30 ms imports,
+# argparse and logging being most of it. The rest stay: exiftool imports json, select,
+# threading and concurrent.futures (and signal, through subprocess) anyway, and mmap, struct
+# and queue are needed by every run and cost well under a millisecond each.
 
 # External packages come last.
 import exiftool
 
-# List of exit codes:
-# 0: Everything went as planned.
-# 1: Cannot initialize logging subsystem.
-# 2: No files to rename.
-# 3: Exiftool is not found.
+# List of exit codes:
+# 0: Everything went as planned.
+# 1: Cannot initialize logging subsystem.
+# 2: No files to rename.
+# 3: Exiftool is not found.
+# 4: Cannot open the metadata cache.
+# 5: Cannot read or write a rename plan.
+# 6: Cannot read or write the journal.
+# 7: Cannot start the exiftool broker.
+# 130: Interrupted with Ctrl-C, files renamed until then keep their new names.
+
+'''
+FileNamePolicy: The rules to make file names safe, compiled once into translation tables.
+
+The rules can be combined:
+
+- UNIX compatibility will assume that only '/' and NULL is invalid. This is always on.
+- FAT32 Safe: Will only use FAT32 safe characters.
+- Console Friendly: Will only use characters which doesn't need escaping in UNIX shells.
+- Windows Safe: FAT32 safe, no control characters, no reserved device names (CON, NUL, COM1...)
+  and no trailing dots or spaces.
+- Unicode normalization form (NFC, NFD, NFKC or NFKD), e.g. NFC for names which look the same
+  to compare the same.
+- A maximum length in bytes, in the file system encoding.
+
+All restricted characters and console-unfriendly characters are changed with '_'.
+normalize() and normalizeBatch() work on names (or field values of a name), finalize()
+works on the complete file name including the extension.
+'''
+class FileNamePolicy:
+    # Replace the characters which need replace in FAT32. Got the tip from a tooltip (https://i.stack.imgur.com/2Jit2.png).
+    FAT32_CHARACTERS = ['\\', ':', '*', '?', '"', '<', '>', '|']
+    # Replace characters which needs escaping. Got the list from holy stackoverflow (https://unix.stackexchange.com/q/270977/13922)
+    CONSOLE_CHARACTERS = ['`', '~', '!', '#', '$', '&', '*', '(', ')', '\t', '[', ']', '{', '}', '|', '\\', ';', '\'', '"', '<', '>', '?', ' ']
+    # Windows doesn't want control characters either, and reserves some device names, with or without extension.
+    WINDOWS_CHARACTERS = FAT32_CHARACTERS + [chr(code) for code in range(1, 32)]
+    WINDOWS_RESERVED_NAMES = frozenset(['CON', 'PRN', 'AUX', 'NUL'] + ['COM%d' % number for number in range(1, 10)] + ['LPT%d' % number for number in range(1, 10)])
+
+    def __init__ (self, fat32Safe = False, consoleFriendly = False, windowsSafe = False, maxBytes = None, unicodeForm = None):
+        self.fat32Safe = fat32Safe
+        self.consoleFriendly = consoleFriendly
+        self.windowsSafe = windowsSafe
+        self.maxBytes = maxBytes
+        self.unicodeForm = unicodeForm
+
+        # Let's change the '/' character. This is not valid neither in UNIX nor Windows
+        characters = ['/', '\0']
+
+        if fat32Safe:
+            characters.extend(self.FAT32_CHARACTERS)
+
+        if consoleFriendly:
+            characters.extend(self.CONSOLE_CHARACTERS)
+
+        if windowsSafe:
+            characters.extend(self.WINDOWS_CHARACTERS)
+
+        # All restricted characters are ASCII, so a plain string indexed by character code is enough as a
+        # table. It is a lot faster than a dictionary, and translate leaves characters beyond its end alone.
+        characters = frozenset(characters)
+        self.table = ''.join('_' if chr(code) in characters else chr(code) for code in range(128))
+
+    '''
+    normalize: Make a single name safe, see the class description.
+    '''
+    def normalize (self, fileName):
+        if self.unicodeForm is not None:
+            fileName = unicodedata.normalize(self.unicodeForm, fileName)
+
+        # Standard file treatments
+        return fileName.strip().translate(self.table)
+
+    '''
+    normalizeBatch: Make a list of names safe at once, returns a new list.
+    '''
+    def normalizeBatch (self, fileNames):
+        table = self.table
+
+        if self.unicodeForm is not None:
+            unicodeForm = self.unicodeForm
+            normalizeUnicode = unicodedata.normalize
+            return [normalizeUnicode(unicodeForm, fileName).strip().translate(table) for fileName in fileNames]
+
+        return [fileName.strip().translate(table) for fileName in fileNames]
+
+    '''
+    finalize: Apply the rules which need the complete file name: reserved names and length.
+
+    The extension is kept while the rest of the name is shortened to fit into maxBytes.
+    '''
+    def finalize (self, fileName):
+        if self.windowsSafe:
+            # Windows silently drops trailing dots and spaces, which would make the name collide with another.
+            fileName = fileName.rstrip('. ')
+
+        fileName = self.shorten(fileName)
+
+        if self.windowsSafe:
+            # Shortening may leave a dot or space at the end again.
+            fileName = fileName.rstrip('. ')
+
+            # The part before the first dot is dropped the same way, so 'CON .mp4' and 'NUL..mp4' are devices too.
+            if fileName.split('.', 1)[0].rstrip(' .').upper() in self.WINDOWS_RESERVED_NAMES:
+                fileName = self.shorten('_' + fileName).rstrip('. ')
+
+        return fileName
+
+    '''
+    shorten: Cut a file name to maxBytes, keeping its extension if it fits.
+    '''
+    def shorten (self, fileName):
+        if self.maxBytes is None:
+            return fileName
+
+        encodedName = os.fsencode(fileName)
+
+        if len(encodedName) <= self.maxBytes:
+            return fileName
+
+        stem, extension = os.path.splitext(fileName)
+        encodedExtension = os.fsencode(extension)
+
+        # An extension which doesn't fit is cut like the rest of the name.
+        if len(encodedExtension) >= self.maxBytes:
+            stem, encodedExtension = fileName, b''
+
+        # Cutting may split a multi-byte character, drop what is left of it.
+        encodedStem = os.fsencode(stem)[:self.maxBytes - len(encodedExtension)]
+        return encodedStem.decode(sys.getfilesystemencoding(), 'ignore').rstrip() + os.fsdecode(encodedExtension)
+
+# Policies used by normalizeFileName, by their options.
+fileNamePolicies = dict ()
+
+'''
+normalizeFileName: Check the filename string and modify the string if required.
+
+This function will make sure that the file names are UNIX safe, and will support more
+restrictive modes. See FileNamePolicy for the rules, this function keeps a compiled policy
+for every combination of options it is called with.
+
+This function will change all restricted characters and console-unfriendly characters with '_'.
+'''
+def normalizeFileName (fileName, fat32Safe = False, consoleFriendly = False):
+    policy = fileNamePolicies.get((fat32Safe, consoleFriendly))
+
+    if policy is None:
+        policy = fileNamePolicies[(fat32Safe, consoleFriendly)] = FileNamePolicy(fat32Safe = fat32Safe, consoleFriendly = consoleFriendly)
+
+    return policy.normalize(fileName)
+
+'''
+indexFields: Build an index from tag names to their values, in a single pass over the metadata.
+
+Since the ExifTool provides field names unprocessed(*), every part of a field name is indexed,
+as well as the whole name. So both 'Title' and 'QuickTime:Title' find the value of the
+QuickTime:Title field. Values are kept in the order exiftool returned them.
+
+*: ExifTool provides the field names with its belonging class to find them easier (e.g.: QuickTime:Title, Composite:Rotation).
+'''
+def indexFields (metadata):
+    index = dict ()
+
+    for field, value in metadata.items():
+        field = field.strip()
+        index.setdefault(field, []).append(value)
+
+        if ':' in field:
+            for processedFieldElement in field.split(':'):
+                index.setdefault(processedFieldElement, []).append(value)
+
+    return index
+
+'''
+This function searches for a field name inside the metadata dictionary.
+See indexFields for how the field names are matched. When looking up more than one field
+of the same file, build the index once and use it directly instead.
+'''
+def findField (metadata, fieldToFind):
+    return indexFields(metadata).get(fieldToFind, [])
+
+'''
+FileNameTemplate: A file name template like '{Title} - {Year}.{ext}', compiled once for all files.
+
+Fields are tag names, optionally with their group (e.g. {QuickTime:Title}), and are looked up
+in an index built by indexFields. The special {ext} field is the lower case file type extension.
+Field values are normalized by the given function, the text between fields is used as is, so
+it can't hold path separators or NUL. Use '{{' and '}}' for literal braces.
+'''
+class FileNameTemplate:
+    def __init__ (self, template):
+        self.template = template
+        # (is field, text) pairs, in template order.
+        self.pieces = list ()
+
+        position = 0
+
+        for match in re.finditer(r'\{\{|\}\}|\{([^{}]*)\}|[{}]', template):
+            if match.start() > position:
+                self.pieces.append((False, template[position:match.start()]))
+
+            position = match.end()
+            token = match.group(0)
+
+            if token in ('{{', '}}'):
+                self.pieces.append((False, token[0]))
+            elif match.group(1) is None:
+                raise ValueError('Unbalanced "%s" in template "%s".' % (token, template))
+            elif match.group(1).strip() == '':
+                raise ValueError('Empty field in template "%s".' % template)
+            else:
+                self.pieces.append((True, match.group(1).strip()))
+
+        if position < len(template):
+            self.pieces.append((False, template[position:]))
+
+        # A separator would move the file to another directory, NUL can't be in a name at all.
+        for isField, text in self.pieces:
+            for character in (os.sep, os.altsep, '\0'):
+                if isField == False and character is not None and character in text:
+                    raise ValueError('Template "%s" has %r outside of a field, file names cannot contain it.' % (template, character))
+
+        # Tag names to ask exiftool for, in template order and without duplicates.
+        self.fields = list ()
+
+        for isField, text in self.pieces:
+            if isField and text != 'ext' and text not in self.fields:
+                self.fields.append(text)
+
+        if len(self.fields) == 0:
+            raise ValueError('Template "%s" doesn\'t use any metadata fields.' % template)
+
+    '''
+    render: Build the file name from a field index. Raises KeyError with the missing field name.
+
+    Returns the file name and the list of fields which had more than one value, since we may have
+    metadata collisions people need to know about. Raises ValueError if the name is empty, '.' or
+    '..', or would hide the file by starting with a dot.
+    '''
+    def render (self, index, normalize):
+        parts = list ()
+        ambiguousFields = list ()
+
+        for isField, text in self.pieces:
+            if isField == False:
+                parts.append(text)
+                continue
+
+            if text == 'ext':
+                values = index.get('File:FileTypeExtension')
+
+                if not values:
+                    raise KeyError(text)
+
+                parts.append(normalize(str(values[0]).lower()))
+                continue
+
+            values = index.get(text)
+
+            if not values:
+                raise KeyError(text)
+
+            if len(values) > 1:
+                ambiguousFields.append(text)
+
+            parts.append(normalize(str(values[0])))
+
+        fileName = ''.join(parts)
+
+        if fileName == '' or fileName.startswith('.'):
+            raise ValueError('"%s" is not a usable file name.' % fileName)
+
+        return fileName, ambiguousFields
+
+    '''
+    fieldValues: Return the value every field of the template takes from a field index, by field name.
+
+    These are the values render uses, before normalization. Missing fields are left out.
+    '''
+    def fieldValues (self, index):
+        return {field: str(index[field][0]) for field in self.fields if index.get(field)}
+
+'''
+PathEntry: A stand-in for os.DirEntry, for files which were named directly instead of found by scandir.
+
+Like os.DirEntry, the stat result is cached, so the later stages can all ask for it. It can also
+wrap a DirEntry to give it a different path (scandir would prefix the current directory with './').
+'''
+class PathEntry:
+    __slots__ = ('path', 'name', '_entry', '_stat')
+
+    def __init__ (self, path, entry = None):
+        self.path = path
+        self.name = os.path.basename(path)
+        self._entry = entry
+        self._stat = None
+
+    def stat (self):
+        if self._entry is not None:
+            return self._entry.stat()
+
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+
+        return self._stat
+
+    def inode (self):
+        return self.stat().st_ino
+
+    def is_file (self):
+        if self._entry is not None:
+            return self._entry.is_file()
+
+        return os.path.isfile(self.path)
+
+    def __fspath__ (self):
+        return self.path
+
+    def __repr__ (self):
+        return '<PathEntry %r>' % self.path
+
+'''
+splitPattern: Split a glob pattern into a root directory without wildcards and the pattern parts below it.
+
+Consecutive '**' parts are merged when working recursively, since they match the same paths.
+'''
+def splitPattern (pattern, recursive = False):
+    separators = os.sep + (os.altsep or '')
+    parts = re.split('[' + re.escape(separators) + ']+', pattern)
+    rootParts = list ()
+
+    # An absolute pattern has an empty first part.
+    while len(parts) > 1 and glob.has_magic(parts[0]) == False:
+        rootParts.append(parts.pop(0))
+
+    root = os.sep.join(rootParts)
+
+    if len(rootParts) > 0 and root == '':
+        root = os.sep
+
+    mergedParts = list ()
+
+    for part in parts:
+        if recursive and part == '**' and len(mergedParts) > 0 and mergedParts[-1] == '**':
+            continue
+
+        mergedParts.append(part)
+
+    return root, mergedParts
+
+'''
+discoverFiles: Expand the FILE arguments and yield the files they match, one at a time.
+
+File path handling is not easy. We need to expand the vars, the user and glob it to see
+how many files we get. This follows glob.iglob semantics ('*' doesn't match hidden names,
+'**' matches any depth if recursive is set), but walks the directories with os.scandir,
+so the file type comes from the directory listing instead of an extra stat per file.
+Directories are listed concurrently by a pool of threads, and all patterns are worked on
+at once, which matters when every listing is a round trip to a network filesystem.
+
+Yields os.DirEntry objects (or PathEntry objects for patterns without wildcards) as they
+are found. If extensions is given, only files with one of these (lower case, with the dot)
+extensions are yielded. Unreadable directories are skipped, just like glob does.
+'''
+def discoverFiles (patterns, recursive = False, extensions = None, threads = 8):
+    localLogger = logging.getLogger('discoverFiles')
+
+    # Results, and a marker for every finished listing so we know when the walk is over.
+    taskDone = object()
+    results = queue.Queue(maxsize = 10000)
+    stopping = threading.Event()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers = threads, thread_name_prefix = 'discoverFiles')
+    outstanding = [0]
+    outstandingLock = threading.Lock()
+
+    def put (item):
+        # Give up if the consumer went away, instead of blocking on a full queue forever.
+        while stopping.is_set() == False:
+            try:
+                results.put(item, timeout = 0.1)
+                return
+            except queue.Full:
+                pass
+
+    def wanted (name):
+        return extensions is None or os.path.splitext(name)[1].lower() in extensions
+
+    def submit (directory, parts, index):
+        with outstandingLock:
+            outstanding[0] += 1
+
+        executor.submit(walk, directory, parts, index)
+
+    def listDirectory (directory):
+        try:
+            with os.scandir(directory or os.curdir) as iterator:
+                return list(iterator)
+        except OSError as exception:
+            localLogger.debug('Cannot list directory %s, skipping: %s', directory, exception)
+            return []
+
+    def join (directory, name):
+        return os.path.join(directory, name) if directory != '' else name
+
+    def found (directory, entry):
+        put(entry if directory != '' else PathEntry(entry.name, entry))
+
+    def matchListing (directory, entries, parts, index):
+        # Everything below a trailing '**' matches, except hidden names.
+        if index == len(parts):
+            for entry in entries:
+                if entry.name.startswith('.') == False and wanted(entry.name) and entry.is_file():
+                    found(directory, entry)
+            return
+
+        part = parts[index]
+        isLast = index == len(parts) - 1
+        matcher = re.compile(fnmatch.translate(os.path.normcase(part))).match
+        matchHidden = part.startswith('.')
+
+        for entry in entries:
+            if entry.name.startswith('.') and matchHidden == False:
+                continue
+
+            if matcher(os.path.normcase(entry.name)) is None:
+                continue
+
+            if isLast:
+                if wanted(entry.name) and entry.is_file():
+                    found(directory, entry)
+            elif entry.is_dir():
+                submit(join(directory, entry.name), parts, index + 1)
+
+    def walk (directory, parts, index):
+        try:
+            if stopping.is_set():
+                return
+
+            part = parts[index]
+
+            if recursive and part == '**':
+                entries = listDirectory(directory)
+                # '**' matches no directory at all, so the rest of the pattern applies here too.
+                matchListing(directory, entries, parts, index + 1)
+
+                for entry in entries:
+                    if entry.name.startswith('.') == False and entry.is_dir():
+                        submit(join(directory, entry.name), parts, index)
+            elif glob.has_magic(part) == False:
+                # No need to list a directory to find a name we already know.
+                path = join(directory, part)
+
+                if index == len(parts) - 1:
+                    if wanted(part) and os.path.isfile(path):
+                        put(PathEntry(path))
+                else:
+                    submit(path, parts, index + 1)
+            else:
+                matchListing(directory, listDirectory(directory), parts, index)
+        except BaseException as exception:
+            put(exception)
+        finally:
+            put(taskDone)
+
+    try:
+        for inputFile in patterns:
+            root, parts = splitPattern(os.path.expanduser (os.path.expandvars (inputFile)), recursive)
+            localLogger.debug('Pattern %s is split into root %s and parts %s.', inputFile, root, parts)
+            submit(root, parts, 0)
+
+        while True:
+            with outstandingLock:
+                if outstanding[0] == 0 and results.empty():
+                    return
+
+            item = results.get()
+
+            if item is taskDone:
+                with outstandingLock:
+                    outstanding[0] -= 1
+            elif isinstance(item, BaseException):
+                raise item
+            else:
+                localLogger.debug('Found file %s.', item.path)
+                yield item
+    finally:
+        stopping.set()
+        executor.shutdown(wait = False, cancel_futures = True)
+
+'''
+chunked: Group the items of an iterable into lists of at most chunkSize items.
+
+The last chunk may be shorter. Only a single chunk is kept in memory at any time.
+'''
+def chunked (iterable, chunkSize):
+    chunk = list ()
+
+    for item in iterable:
+        chunk.append(item)
+
+        if len(chunk) >= chunkSize:
+            yield chunk
+            chunk = list ()
+
+    if len(chunk) > 0:
+        yield chunk
+
+# Linux FS_IOC_FIEMAP, asking for the first extent of a file: struct fiemap and one struct fiemap_extent.
+FIEMAP_IOCTL = 0xC020660B
+FIEMAP_HEADER = struct.Struct('=QQIIII')
+FIEMAP_EXTENT = struct.Struct('=QQQQQIIII')
+# Set with (among others) FIEMAP_EXTENT_DELALLOC, when the data has no place on the disk yet.
+FIEMAP_EXTENT_UNKNOWN = 0x2
+
+'''
+physicalOffset: Where the data of a file starts on its device, in bytes, or None if the filesystem doesn't tell.
+
+Uses the FIEMAP ioctl, so works on Linux only. Raises OSError, with ENOTTY or EOPNOTSUPP if the
+filesystem has no FIEMAP.
+'''
+def physicalOffset (path):
+    import fcntl
+
+    request = bytearray(FIEMAP_HEADER.size + FIEMAP_EXTENT.size)
+    FIEMAP_HEADER.pack_into(request, 0, 0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0)
+    fileDescriptor = os.open(path, os.O_RDONLY)
+
+    try:
+        fcntl.ioctl(fileDescriptor, FIEMAP_IOCTL, request, True)
+    finally:
+        os.close(fileDescriptor)
+
+    # Empty files, and files stored inline in their inode, have no extents.
+    if FIEMAP_HEADER.unpack_from(request)[3] == 0:
+        return None
+
+    extent = FIEMAP_EXTENT.unpack_from(request, FIEMAP_HEADER.size)
+
+    if extent[5] & FIEMAP_EXTENT_UNKNOWN:
+        return None
+
+    return extent[1]
+
+'''
+orderForIO: Pass on file entries in the order their data is on the disk, sorting windowSize entries at a time.
+
+Discovery gives files in directory order, which has little to do with where they are on the
+disk, so on rotating disks reading them is mostly seeking. With mode 'inode', files are sorted
+by device and inode number, which most filesystems allocate close to the data, without a system
+call besides the stat the other stages need anyway. With mode 'extent', they are sorted by the
+physical offset of their first extent (see physicalOffset), at the cost of an open and an ioctl
+per file. Files without a known offset go after the others of their device, by inode, and
+devices without FIEMAP are not asked again.
+
+Only a window is sorted at a time, so memory stays bounded and the first renames still come
+early. Every window is read from the start of the disk to the end, like an elevator.
+'''
+def orderForIO (entries, mode = 'inode', windowSize = 1000):
+    localLogger = logging.getLogger('orderForIO')
+
+    if mode == 'extent' and sys.platform.startswith('linux') == False:
+        localLogger.warning('Physical extents can only be asked for on Linux, will order files by inode instead.')
+        mode = 'inode'
+
+    # Devices which turned out to have no FIEMAP.
+    withoutExtents = set ()
+
+    def sortKey (entry):
+        try:
+            statResult = entry.stat()
+        except OSError:
+            # Goes first, exiftool will report it.
+            return (-1, 0, 0)
+
+        if mode == 'extent' and statResult.st_dev not in withoutExtents:
+            try:
+                offset = physicalOffset(entry.path)
+            except OSError as exception:
+                if exception.errno in (errno.ENOTTY, errno.EOPNOTSUPP, errno.ENOSYS):
+                    localLogger.info('The filesystem of %s cannot tell where files are on the disk, will order its files by inode.', entry.path)
+                    withoutExtents.add(statResult.st_dev)
+
+                offset = None
+
+            if offset is not None:
+                return (statResult.st_dev, 0, offset)
+
+        return (statResult.st_dev, 1, statResult.st_ino)
+
+    for window in chunked(entries, windowSize):
+        window.sort(key = sortKey)
+        localLogger.debug('Ordered a window of %d files by %s.', len(window), mode)
+
+        for entry in window:
+            yield entry
+
+'''
+Prefetcher: Ask the kernel to read the start and the end of files ahead of time, from a thread of its own.
+
+exiftool and the QuickTime reader read the header of a video file, and for files with their
+index at the end (e.g. MP4 files written by cameras), its trailer. posix_fadvise(WILLNEED) on
+these regions starts reading them into the page cache without waiting, so the disk gets the
+requests of many files at once and can order them itself, and exiftool finds them in memory.
+
+prefetch() passes file entries on leadFiles entries after it hints them. Hints are dropped
+instead of waited for if the thread falls behind, since they are only hints. Needs
+os.posix_fadvise, which Windows and macOS don't have.
+'''
+class Prefetcher:
+    def __init__ (self, regionSize = 256 * 1024, queueSize = 1000):
+        self.regionSize = regionSize
+        self.paths = queue.Queue(maxsize = queueSize)
+        self.stopping = threading.Event()
+        self.hinted = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target = self.run, name = 'prefetch', daemon = True)
+        self.thread.start()
+
+    def run (self):
+        localLogger = logging.getLogger('Prefetcher')
+
+        while self.stopping.is_set() == False:
+            path = self.paths.get()
+
+            if path is None:
+                break
+
+            try:
+                fileDescriptor = os.open(path, os.O_RDONLY)
+
+                try:
+                    size = os.fstat(fileDescriptor).st_size
+                    os.posix_fadvise(fileDescriptor, 0, min(size, self.regionSize), os.POSIX_FADV_WILLNEED)
+
+                    if size > self.regionSize:
+                        trailerStart = max(self.regionSize, size - self.regionSize)
+                        os.posix_fadvise(fileDescriptor, trailerStart, size - trailerStart, os.POSIX_FADV_WILLNEED)
+                finally:
+                    os.close(fileDescriptor)
+            except OSError as exception:
+                # Reading the file will fail too, and report it.
+                localLogger.debug('Cannot prefetch file %s: %s', path, exception)
+                continue
+
+            self.hinted += 1
+
+    '''
+    prefetch: Hint the given file entries to the thread, passing them on leadFiles entries later.
+    '''
+    def prefetch (self, entries, leadFiles = 100):
+        ahead = collections.deque()
+
+        for entry in entries:
+            try:
+                self.paths.put_nowait(entry.path)
+            except queue.Full:
+                self.dropped += 1
+
+            ahead.append(entry)
+
+            if len(ahead) > leadFiles:
+                yield ahead.popleft()
+
+        while len(ahead) > 0:
+            yield ahead.popleft()
+
+    def close (self):
+        self.stopping.set()
+
+        try:
+            self.paths.put_nowait(None)
+        except queue.Full:
+            pass
+
+        self.thread.join()
+        logging.getLogger('Prefetcher').debug('Prefetched %d files, dropped %d hints.', self.hinted, self.dropped)
+
+'''
+BatchScheduler: Form the exiftool batches, by number of files, bytes and measured latency.
+
+Batches hold at most maxFiles files and maxBytes bytes, going by the stat data of the file
+entries (already there if discovery or the metadata cache asked for it, one stat per file
+otherwise). Files of maxBytes or more get a batch of their own, so they don't hold up the
+files which would be batched with them.
+
+The number of files per batch starts small, so the first renames come early, and after every
+batch it is set to the number of files exiftool reads in targetSeconds at the seconds per file
+measured so far. The round trip overhead is part of that, so batches grow while it dominates,
+at most doubling per batch. record() is thread-safe, for calling it from the pool threads.
+'''
+class BatchScheduler:
+    # A batch of a single oversized file, which says nothing about the other files.
+    class IsolatedBatch (list):
+        pass
+
+    def __init__ (self, maxFiles = 100, maxBytes = 16 << 30, targetSeconds = 0.5, initialFiles = 8):
+        self.maxFiles = maxFiles
+        self.maxBytes = maxBytes
+        self.targetSeconds = targetSeconds
+        self.batchFiles = min(initialFiles, maxFiles)
+        self.secondsPerFile = None
+        self.lock = threading.Lock()
+
+    '''
+    record: Adjust the number of files per batch to how long a batch took.
+    '''
+    def record (self, batch, seconds):
+        if len(batch) == 0 or isinstance(batch, self.IsolatedBatch):
+            return
+
+        with self.lock:
+            secondsPerFile = seconds / len(batch)
+
+            # Smooth out single slow batches.
+            if self.secondsPerFile is not None:
+                secondsPerFile = 0.7 * self.secondsPerFile + 0.3 * secondsPerFile
+
+            self.secondsPerFile = secondsPerFile
+            wantedFiles = int(self.targetSeconds / secondsPerFile) if secondsPerFile > 0 else self.maxFiles
+            self.batchFiles = max(1, min(self.maxFiles, wantedFiles, 2 * self.batchFiles))
+
+    '''
+    batches: Turn an iterable of lists of file entries into batches of paths.
+
+    A list which doesn't complete a batch gives an empty batch, so the consumer keeps getting
+    results for the files it answered itself. The rest is sent when the lists run out.
+    '''
+    def batches (self, entryLists):
+        batch = list ()
+        batchBytes = 0
+
+        for entries in entryLists:
+            batchesGiven = 0
+
+            for entry in entries:
+                try:
+                    size = entry.stat().st_size
+                except OSError:
+                    # exiftool will report it.
+                    size = 0
+
+                if size >= self.maxBytes:
+                    yield self.IsolatedBatch([entry.path])
+                    batchesGiven += 1
+                    continue
+
+                if len(batch) > 0 and batchBytes + size > self.maxBytes:
+                    yield batch
+                    batchesGiven += 1
+                    batch = list ()
+                    batchBytes = 0
+
+                batch.append(entry.path)
+                batchBytes += size
+
+                if len(batch) >= self.batchFiles:
+                    yield batch
+                    batchesGiven += 1
+                    batch = list ()
+                    batchBytes = 0
+
+            if batchesGiven == 0:
+                yield list ()
+
+        if len(batch) > 0:
+            yield batch
+
+'''
+Stats: Per-stage timers and counters of a run, for --stats and --stats-json.
+
+Stages are timed in wall seconds, summed over all threads, so stages running in parallel (e.g.
+several exiftool jobs) can add up to more than the run took. exiftoolHook collects the exiftool
+round trips and reply decoding from ExifTool hooks, with a histogram of batch latencies in
+power of two millisecond buckets. All methods are thread-safe.
+'''
+class Stats:
+    def __init__ (self):
+        self.lock = threading.Lock()
+        self.startTime = time.perf_counter()
+        # Stage name -> [calls, seconds], in the order stages are first seen.
+        self.stages = dict ()
+        self.counters = collections.Counter()
+        self.renamesByDirectory = collections.Counter()
+        # Upper bound in milliseconds -> number of exiftool batches.
+        self.batchLatencies = collections.Counter()
+
+    def addTime (self, stage, seconds, calls = 1):
+        with self.lock:
+            stageTime = self.stages.setdefault(stage, [0, 0.0])
+            stageTime[0] += calls
+            stageTime[1] += seconds
+
+    def count (self, counter, amount = 1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def countRename (self, directory, seconds):
+        with self.lock:
+            stageTime = self.stages.setdefault('rename', [0, 0.0])
+            stageTime[0] += 1
+            stageTime[1] += seconds
+            self.renamesByDirectory[directory] += 1
+
+    '''
+    timed: Wrap a function, adding the time spent in every call to a stage.
+    '''
+    def timed (self, stage, function):
+        def timedFunction (*arguments, **keywordArguments):
+            startTime = time.perf_counter()
+
+            try:
+                return function(*arguments, **keywordArguments)
+            finally:
+                self.addTime(stage, time.perf_counter() - startTime)
+
+        return timedFunction
+
+    '''
+    timedIterator: Pass on the items of an iterator, adding the time spent waiting for every item to a stage.
+    '''
+    def timedIterator (self, stage, iterable):
+        iterator = iter(iterable)
+
+        while True:
+            startTime = time.perf_counter()
+
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.addTime(stage, time.perf_counter() - startTime, 0)
+                return
+
+            self.addTime(stage, time.perf_counter() - startTime)
+            yield item
+
+    '''
+    exiftoolHook: Collect an exiftool.ExifToolEvent, pass this to the hooks of ExifTool or ExifToolPool.
+    '''
+    def exiftoolHook (self, event):
+        if event.kind == 'execute':
+            bucket = 1
+
+            while bucket < event.seconds * 1000:
+                bucket *= 2
+
+            with self.lock:
+                self.batchLatencies[bucket] += 1
+                self.counters['exiftool bytes sent'] += event.request_bytes
+                self.counters['exiftool bytes read'] += event.reply_bytes
+
+                if event.error is not None:
+                    self.counters['exiftool failures'] += 1
+
+            self.addTime('exiftool', event.seconds)
+        else:
+            self.addTime('decode', event.seconds)
+
+    '''
+    summary: Return the collected figures as a dictionary, ready for JSON.
+    '''
+    def summary (self):
+        with self.lock:
+            elapsed = time.perf_counter() - self.startTime
+            files = self.counters.get('files', 0)
+
+            return {
+                'seconds': elapsed,
+                'files per second': files / elapsed if elapsed > 0 else 0.0,
+                'stages': {stage: {'calls': calls, 'seconds': seconds} for stage, (calls, seconds) in self.stages.items()},
+                'counters': dict(self.counters),
+                'batch latency ms': {str(bucket): count for bucket, count in sorted(self.batchLatencies.items())},
+                'renames by directory': dict(self.renamesByDirectory.most_common()),
+            }
+
+    '''
+    format: Return the collected figures as a human readable text, with the busiest directories only.
+    '''
+    def format (self, directories = 10):
+        summary = self.summary()
+        lines = ['Run took %.3f seconds, %.1f files per second.' % (summary['seconds'], summary['files per second']), '', '%-12s %10s %12s' % ('stage', 'calls', 'seconds')]
+
+        for stage, stageTime in summary['stages'].items():
+            lines.append('%-12s %10d %12.3f' % (stage, stageTime['calls'], stageTime['seconds']))
+
+        if len(summary['counters']) > 0:
+            lines.append('')
+
+            for counter, value in sorted(summary['counters'].items()):
+                lines.append('%-24s %12d' % (counter, value))
+
+        if len(self.batchLatencies) > 0:
+            lines.extend(['', 'exiftool batch latency:'])
+
+            for bucket, count in summary['batch latency ms'].items():
+                lines.append('  <= %6s ms %10d' % (bucket, count))
+
+        if len(self.renamesByDirectory) > 0:
+            lines.extend(['', 'Renames by directory (top %d of %d):' % (min(directories, len(self.renamesByDirectory)), len(self.renamesByDirectory))])
+
+            for directory, count in self.renamesByDirectory.most_common(directories):
+                lines.append('  %8d %s' % (count, directory))
+
+        return '\n'.join(lines)
+
+'''
+reportStats: Print the summary of the stats to standard error and/or write it to a JSON file.
+'''
+def reportStats (stats, printSummary = False, jsonPath = None):
+    if printSummary:
+        print(stats.format(), file = sys.stderr)
+
+    if jsonPath is not None:
+        try:
+            with open(jsonPath, 'w', encoding = 'utf-8') as jsonStream:
+                json.dump(stats.summary(), jsonStream, indent = 2)
+                jsonStream.write('\n')
+        except OSError as exception:
+            logging.getLogger('main').error('Cannot write the stats: %s', exception)
+
+'''
+requiredTags: Build the minimal list of tags exiftool needs to extract for the rename.
+
+The file tags are always needed to find and rename the file, the rest comes from the
+fields used to build the new name. Asking only for these makes exiftool skip formatting
+every other tag in the file, and keeps the JSON we need to parse small.
+'''
+def requiredTags (fields):
+    tags = ['File:FileTypeExtension', 'File:Directory', 'File:FileName']
+
+    for field in fields:
+        if field not in tags:
+            tags.append(field)
+
+    return tags
+
+'''
+exiftoolArguments: Build the common arguments for exiftool from the scan mode.
+
+fastLevel 1 adds -fast (don't read to the end of the file looking for trailers) and
+fastLevel 2 adds -fast2 (also skip the maker notes). See exiftool documentation for details.
+'''
+def exiftoolArguments (fastLevel = 0):
+    commonArguments = ['-G', '-n']
+
+    if fastLevel == 1:
+        commonArguments.append('-fast')
+    elif fastLevel >= 2:
+        commonArguments.append('-fast2')
+
+    return commonArguments
+
+# File type extensions of ISO base media files by major brand, as exiftool reports them.
+QUICKTIME_BRANDS = {
+    b'qt  ': 'mov',
+    b'isom': 'mp4', b'iso2': 'mp4', b'mp41': 'mp4', b'mp42': 'mp4', b'avc1': 'mp4', b'dash': 'mp4', b'mmp4': 'mp4',
+    b'M4V ': 'm4v', b'M4VH': 'm4v', b'M4VP': 'm4v',
+}
+
+# Extensions of the files worth trying the QuickTime reader on, and the tags it can provide.
+QUICKTIME_EXTENSIONS = ('.mp4', '.m4v', '.mov')
+QUICKTIME_TAGS = frozenset(['File:FileTypeExtension', 'File:Directory', 'File:FileName', 'Title', 'QuickTime:Title'])
+
+'''
+findBox: Find the first box of the given type between start and end, without copying anything.
+
+Returns the (payload start, payload end) offsets of the box, or None if there is no such box
+or the box headers don't make sense.
+'''
+def findBox (buffer, start, end, boxType):
+    offset = start
+
+    while offset + 8 <= end:
+        size, currentType = struct.unpack_from('>I4s', buffer, offset)
+        headerSize = 8
+
+        # Size 1 means a 64 bit size follows, size 0 means the box runs to the end.
+        if size == 1:
+            if offset + 16 > end:
+                return None
+
+            size = struct.unpack_from('>Q', buffer, offset + 8)[0]
+            headerSize = 16
+        elif size == 0:
+            size = end - offset
+
+        if size < headerSize or offset + size > end:
+            return None
+
+        if currentType == boxType:
+            return (offset + headerSize, offset + size)
+
+        offset += size
+
+    return None
+
+'''
+findBoxPath: Walk down a path of nested boxes, see findBox.
+'''
+def findBoxPath (buffer, start, end, boxTypes):
+    box = (start, end)
+
+    for boxType in boxTypes:
+        box = findBox(buffer, box[0], box[1], boxType)
+
+        if box is None:
+            return None
+
+    return box
+
+'''
+readQuickTimeTitle: Find the title of an MP4/MOV/M4V file without exiftool.
+
+The file is memory mapped and only the box headers on the way to the title are looked at.
+Both iTunes style (moov/udta/meta/ilst/©nam) and QuickTime style (moov/udta/©nam) titles
+are read. Returns the metadata in the format exiftool would, or None if the file is not
+laid out in one of these ways or has no title there, in which case exiftool should be asked.
+'''
+def readQuickTimeTitle (path):
+    try:
+        with open(path, 'rb') as videoFile:
+            with mmap.mmap(videoFile.fileno(), 0, access = mmap.ACCESS_READ) as buffer:
+                title, extension = parseQuickTimeTitle(buffer)
+    except (OSError, ValueError, struct.error, UnicodeDecodeError):
+        return None
+
+    if title is None:
+        return None
+
+    return {'SourceFile': path, 'File:FileName': os.path.basename(path), 'File:Directory': os.path.dirname(path) or '.', 'File:FileTypeExtension': extension, 'QuickTime:Title': title}
+
+'''
+parseQuickTimeTitle: The parsing part of readQuickTimeTitle, returns (title, extension).
+'''
+def parseQuickTimeTitle (buffer):
+    end = len(buffer)
+
+    # The file type box must come first, its major brand tells the extension.
+    if end < 12 or buffer[4:8] != b'ftyp':
+        return (None, None)
+
+    fileType = findBox(buffer, 0, end, b'ftyp')
+
+    if fileType is None or fileType[1] - fileType[0] < 4:
+        return (None, None)
+
+    extension = QUICKTIME_BRANDS.get(bytes(buffer[fileType[0]:fileType[0] + 4]))
+
+    if extension is None:
+        return (None, None)
+
+    userData = findBoxPath(buffer, 0, end, [b'moov', b'udta'])
+
+    if userData is None:
+        return (None, extension)
+
+    # iTunes style: the meta box is a full box in MP4 files, but not in QuickTime ones.
+    metaBox = findBox(buffer, userData[0], userData[1], b'meta')
+
+    if metaBox is not None:
+        metaStart = metaBox[0]
+
+        if buffer[metaStart + 4:metaStart + 8] not in (b'hdlr', b'ilst', b'keys'):
+            metaStart += 4
+
+        dataBox = findBoxPath(buffer, metaStart, metaBox[1], [b'ilst', b'\xa9nam', b'data'])
+
+        # Data boxes start with the type (1: UTF-8, 2: UTF-16) and the locale.
+        if dataBox is not None and dataBox[1] - dataBox[0] >= 8:
+            dataType = struct.unpack_from('>I', buffer, dataBox[0])[0]
+
+            if dataType == 1:
+                return (bytes(buffer[dataBox[0] + 8:dataBox[1]]).decode('utf-8'), extension)
+            elif dataType == 2:
+                return (bytes(buffer[dataBox[0] + 8:dataBox[1]]).decode('utf-16-be'), extension)
+            else:
+                return (None, extension)
+
+    # QuickTime style: a list of (length, language, text) entries, the first one is the title.
+    textBox = findBox(buffer, userData[0], userData[1], b'\xa9nam')
+
+    if textBox is not None and textBox[1] - textBox[0] >= 4:
+        length, language = struct.unpack_from('>HH', buffer, textBox[0])
+
+        if textBox[0] + 4 + length <= textBox[1]:
+            text = bytes(buffer[textBox[0] + 4:textBox[0] + 4 + length])
+
+            # Macintosh language codes mean Mac Roman text, packed ISO 639 codes mean UTF-8.
+            if language < 0x400:
+                return (text.decode('mac_roman'), extension)
+            else:
+                return (text.decode('utf-8'), extension)
+
+    return (None, extension)
+
+'''
+MetadataCache: An on-disk cache of the tags exiftool extracted, kept in an SQLite database.
+
+Entries are keyed by the device and inode of the file, so a renamed file still hits the
+cache, and are only valid while the size and modification time of the file stay the same.
+The file name and directory are never taken from the cache, since these change with renames.
+Entries also carry the exiftool query (tags and arguments) they were made with, so changing
+the query doesn't return entries with missing tags.
+
+When the cache grows beyond maxEntries, the least recently used entries are evicted. If
+refresh is set, existing entries are ignored, but the cache is still updated.
+
+Other runs may use the same database: a locked database is waited for up to timeout seconds.
+If it stays locked, or fails otherwise after it is opened, a warning is logged and the rest of
+the run goes on without the cache: lookups are misses and entries are not stored, so the lock
+is not waited for again and again.
+'''
+class MetadataCache:
+    def __init__ (self, path, query, maxEntries = 1000000, refresh = False, timeout = 5.0):
+        self.query = query
+        self.maxEntries = maxEntries
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self.disabled = False
+
+        # Entries used in this run are marked with the start time, which is enough for LRU between runs.
+        self.runTime = time.time_ns()
+        self.usedKeys = list ()
+
+        if os.path.dirname(path) != '':
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+
+        import sqlite3
+
+        self.databaseError = sqlite3.Error
+        # The asyncio pipeline uses the cache from a worker thread, one call at a time.
+        self.connection = sqlite3.connect(path, timeout = timeout, check_same_thread = False)
+        # WAL without fsync on every commit, losing the last few entries on a power cut is fine for a cache.
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS metadata (device INTEGER, inode INTEGER, query TEXT, size INTEGER, mtime_ns INTEGER, last_used INTEGER, metadata TEXT, PRIMARY KEY (device, inode, query))')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS metadata_last_used ON metadata (last_used)')
+
+    '''
+    fail: Turn the cache off after a failed database operation.
+    '''
+    def fail (self, operation, exception):
+        self.disabled = True
+        logging.getLogger('MetadataCache').warning('Cannot %s the metadata cache, going on without it: %s', operation, exception)
+
+    '''
+    key: Build the cache key of a file from its stat result.
+    '''
+    @staticmethod
+    def key (statResult):
+        return (statResult.st_dev, statResult.st_ino, statResult.st_size, statResult.st_mtime_ns)
+
+    '''
+    lookup: Return the cached tags of the file at path with the given key, or None on a miss.
+    '''
+    def lookup (self, path, key):
+        row = None
+
+        if self.refresh == False and self.disabled == False:
+            try:
+                row = self.connection.execute('SELECT size, mtime_ns, metadata FROM metadata WHERE device = ? AND inode = ? AND query = ?', (key[0], key[1], self.query)).fetchone()
+            except self.databaseError as exception:
+                self.fail('read', exception)
+
+        # A file which changed since it was cached is a miss, it will be overwritten by store().
+        if row is None or row[0] != key[2] or row[1] != key[3]:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.usedKeys.append((self.runTime, key[0], key[1], self.query))
+
+        # The name may have changed since, take it from the path instead.
+        metadata = json.loads(row[2])
+        metadata['SourceFile'] = path
+        metadata['File:Directory'] = os.path.dirname(path) or '.'
+        metadata['File:FileName'] = os.path.basename(path)
+
+        return metadata
+
+    '''
+    store: Add the tags of a file to the cache, replacing any older entry of the same file.
+    '''
+    def store (self, key, metadata):
+        if self.disabled:
+            return
+
+        try:
+            self.connection.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?)', (key[0], key[1], self.query, key[2], key[3], self.runTime, json.dumps(metadata)))
+        except self.databaseError as exception:
+            self.fail('write to', exception)
+
+    '''
+    commit: Write the pending entries and usage marks to disk. They are dropped if the database is locked.
+    '''
+    def commit (self):
+        usedKeys, self.usedKeys = self.usedKeys, list ()
+
+        if self.disabled:
+            return
+
+        try:
+            if len(usedKeys) > 0:
+                self.connection.executemany('UPDATE metadata SET last_used = ? WHERE device = ? AND inode = ? AND query = ?', usedKeys)
+
+            self.connection.commit()
+        except self.databaseError as exception:
+            self.fail('write to', exception)
+
+            # Don't keep the write lock, if we got it, while the rest of the run goes on.
+            try:
+                self.connection.rollback()
+            except self.databaseError:
+                pass
+
+    '''
+    close: Commit, evict the least recently used entries over the size limit and close the database.
+    '''
+    def close (self):
+        self.commit()
+
+        try:
+            # Evicting would only wait for the lock again.
+            if self.disabled:
+                return
+
+            entries = self.connection.execute('SELECT COUNT(*) FROM metadata').fetchone()[0]
+
+            if entries > self.maxEntries:
+                self.connection.execute('DELETE FROM metadata WHERE rowid IN (SELECT rowid FROM metadata ORDER BY last_used LIMIT ?)', (entries - self.maxEntries,))
+                self.connection.commit()
+        except self.databaseError as exception:
+            # Evicting is left to the next run.
+            self.fail('clean up', exception)
+        finally:
+            self.connection.close()
+
+'''
+defaultCachePath: Return the path of the metadata cache, following the XDG base directory specification.
+'''
+def defaultCachePath ():
+    cacheHome = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cacheHome, 'video-renamer', 'metadata.sqlite')
+
+'''
+defaultBrokerPath: Return the path of the exiftool broker socket, in the XDG runtime directory if there is one.
+'''
+def defaultBrokerPath ():
+    runtimeDirectory = os.environ.get('XDG_RUNTIME_DIR') or os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(runtimeDirectory, 'video-renamer', 'exiftool.sock')
+
+'''
+brokerFactory: Return an ExifToolPool factory borrowing exiftool processes from the broker at address.
+
+The broker is asked for a process right away, and None is returned if there is no broker or
+it cannot start the exiftool we want, so the caller can start its own exiftool instead.
+'''
+def brokerFactory (address, executable = None, commonArguments = None):
+    localLogger = logging.getLogger('brokerFactory')
+    probe = exiftool.ExifToolClient(address, executable, commonArguments)
+
+    try:
+        probe.start()
+    except OSError as exception:
+        localLogger.debug('Not using the exiftool broker at %s: %s', address, exception)
+        return None
+
+    probe.terminate()
+    localLogger.debug('Using the exiftool broker at %s.', address)
+
+    return functools.partial(exiftool.ExifToolClient, address)
+
+'''
+extractMetadata: Read the metadata of the given chunks of file entries with an exiftool pool.
+
+Every chunk is a single exiftool batch, and the pool works on a few chunks at once while
+the later stages consume the results. So the memory used depends on the chunk size and
+the number of jobs, not on the number of files. Results come in the order they finish.
+
+If a cache is given, only the files missing from it are sent to exiftool, and what exiftool
+returns is added to the cache. If quickTime is set, MP4/MOV/M4V files are first tried with
+readQuickTimeTitle, which is a lot faster than a trip through exiftool. Since the pool only
+starts exiftool for non-empty chunks, a run where every file is answered this way never
+starts exiftool.
+
+If onFailure is given, chunks exiftool dies or hangs on are split up to find the files causing
+it, onFailure(path, exception) is called for these from the pool threads, and the other files
+of the chunk are passed on as usual.
+
+With a BatchScheduler, the files left for exiftool are batched by it instead of going in one
+batch per chunk, and it is told how long every batch took.
+'''
+def extractMetadata (pool, chunks, tags, cache = None, quickTime = False, onFailure = None, scheduler = None):
+    localLogger = logging.getLogger('extractMetadata')
+
+    # Files answered without exiftool wait here for the current exiftool results to be passed on.
+    readyMetadata = collections.deque()
+    # Cache keys of the files sent to exiftool, by path.
+    pendingKeys = dict ()
+
+    def missingChunks ():
+        for chunk in chunks:
+            chunkMetadata, missing = readWithoutExiftool(chunk, cache, quickTime, pendingKeys)
+            readyMetadata.extend(chunkMetadata)
+
+            # Chunks with nothing left for exiftool are still passed on as empty ones, so the results keep streaming.
+            yield missing
+
+    if scheduler is None:
+        batches = ([entry.path for entry in missing] for missing in missingChunks())
+    else:
+        batches = scheduler.batches(missingChunks())
+
+    # Called from the pool threads, timing every batch for the scheduler.
+    def extract (et, batch):
+        startTime = time.perf_counter()
+        batchMetadata = et.get_tags_batch(tags, batch, onFailure)
+
+        if scheduler is not None:
+            scheduler.record(batch, time.perf_counter() - startTime)
+
+        return batchMetadata
+
+    for chunkMetadata in pool.imap(extract, batches, ordered = False):
+        localLogger.debug('Got metadata for a chunk of %d files.', len(chunkMetadata))
+
+        while len(readyMetadata) > 0:
+            yield readyMetadata.popleft()
+
+        storeExtracted(chunkMetadata, cache, pendingKeys)
+
+        for metadata in chunkMetadata:
+            yield metadata
+
+    while len(readyMetadata) > 0:
+        yield readyMetadata.popleft()
+
+'''
+readWithoutExiftool: Answer what we can of a chunk of file entries from the cache and the QuickTime reader.
+
+Returns the list of metadata found this way and the list of file entries still to be sent to
+exiftool. The cache keys of the latter are put in pendingKeys, for storeExtracted to use.
+'''
+def readWithoutExiftool (chunk, cache, quickTime, pendingKeys):
+    localLogger = logging.getLogger('extractMetadata')
+
+    if cache is None and quickTime == False:
+        return [], list(chunk)
+
+    found = list ()
+    missing = list ()
+
+    for entry in chunk:
+        path = entry.path
+        key = None
+
+        if cache is not None:
+            try:
+                key = cache.key(entry.stat())
+            except OSError as exception:
+                localLogger.error('Cannot stat file %s, will skip: %s', path, exception)
+                continue
+
+            metadata = cache.lookup(path, key)
+
+            if metadata is not None:
+                found.append(metadata)
+                continue
+
+        # Not cached, since reading these again is about as fast as a cache lookup.
+        if quickTime and path.lower().endswith(QUICKTIME_EXTENSIONS):
+            metadata = readQuickTimeTitle(path)
+
+            if metadata is not None:
+                found.append(metadata)
+                continue
+
+        if key is not None:
+            pendingKeys[path] = key
+
+        missing.append(entry)
+
+    localLogger.debug('%d of %d files in chunk are read without exiftool.', len(found), len(chunk))
+
+    return found, missing
+
+'''
+storeExtracted: Add the metadata exiftool returned for a chunk to the cache, see readWithoutExiftool.
+'''
+def storeExtracted (chunkMetadata, cache, pendingKeys):
+    if cache is None:
+        return
+
+    for metadata in chunkMetadata:
+        key = pendingKeys.pop(metadata['SourceFile'], None)
+
+        if key is not None:
+            cache.store(key, metadata)
+
+    cache.commit()
+
+'''
+renameFilesAsync: The asyncio version of the whole pipeline after discovery, using one AsyncExifTool.
+
+Up to inFlight chunks are worked on at once: while exiftool reads one, the replies of others
+are turned into plans and renamed. Discovery and renaming block on the filesystem, so they run
+in the default executor, and renames are done one batch at a time. Cache lookups, the QuickTime
+reader and planning run on a worker thread of their own, so they don't hold up the replies of
+exiftool either. exiftool is only started once a file can't be answered from the cache or the
+QuickTime reader. A chunk which fails is logged and skipped, the other chunks go on.
+
+This lets the renamer run inside another asyncio program. Returns the number of files renamed.
+With stats, exiftool and planning are timed like in the threaded pipeline. A batch exiftool dies
+or hangs on for timeout seconds is bisected like there, and onFailure is called with the files
+it fails on.
+'''
+async def renameFilesAsync (chunks, tags, template, policy, executor, executable = None, commonArguments = None, cache = None, quickTime = False, inFlight = 4, stats = None, timeout = None, onFailure = None):
+    import asyncio
+
+    localLogger = logging.getLogger('renameFilesAsync')
+    loop = asyncio.get_running_loop()
+    et = exiftool.AsyncExifTool(executable_ = executable, common_args = commonArguments, timeout = timeout, hooks = None if stats is None else [stats.exiftoolHook])
+    renameLock = asyncio.Lock()
+    pendingKeys = dict ()
+
+    # exiftool restarts itself after a failure, so it is only started here once.
+    startTask = None
+
+    # The cache, pendingKeys and planning are only used from this thread, one chunk at a time.
+    metadataWorker = concurrent.futures.ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'metadata')
+
+    async def processChunk (chunk):
+        nonlocal startTask
+
+        try:
+            chunkMetadata, missing = await loop.run_in_executor(metadataWorker, readWithoutExiftool, chunk, cache, quickTime, pendingKeys)
+
+            if len(missing) > 0:
+                if startTask is None:
+                    startTask = asyncio.ensure_future(et.start())
+
+                await startTask
+                extracted = await et.get_tags_batch(tags, [entry.path for entry in missing], onFailure)
+                localLogger.debug('Got metadata for a chunk of %d files.', len(extracted))
+                await loop.run_in_executor(metadataWorker, storeExtracted, extracted, cache, pendingKeys)
+                chunkMetadata.extend(extracted)
+
+            plans = await loop.run_in_executor(metadataWorker, lambda: list(planRenames(chunkMetadata, template, policy, stats)))
+
+            # The executor keeps a name index per directory, so batches must not run over each other.
+            async with renameLock:
+                return await loop.run_in_executor(None, executor.run, plans)
+        except FileNotFoundError:
+            # exiftool is missing, the other chunks can't be read either.
+            raise
+        except (exiftool.ExifToolError, ValueError, OSError) as exception:
+            localLogger.error('Cannot rename a chunk of %d files, will skip them: %s', len(chunk), exception)
+            return 0
+
+    # Adds up the files the finished chunks renamed. Chunks which failed anyway are logged one by one.
+    def collect (done):
+        renamed = 0
+        missingExiftool = None
+
+        for task in done:
+            if task.cancelled():
+                continue
+
+            exception = task.exception()
+
+            if exception is None:
+                renamed += task.result()
+            elif isinstance(exception, FileNotFoundError):
+                missingExiftool = exception
+            else:
+                localLogger.error('A chunk failed, will skip it: %r', exception, exc_info = exception)
+
+        # Only raised once the other finished chunks are counted and their failures logged.
+        if missingExiftool is not None:
+            raise missingExiftool
+
+        return renamed
+
+    chunkIterator = iter(chunks)
+    pending = set()
+    renamedFiles = 0
+
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunkIterator, None)
+
+            if chunk is None:
+                break
+
+            pending.add(asyncio.ensure_future(processChunk(chunk)))
+
+            if len(pending) >= inFlight:
+                done, pending = await asyncio.wait(pending, return_when = asyncio.FIRST_COMPLETED)
+                renamedFiles += collect(done)
+
+        if len(pending) > 0:
+            done, pending = await asyncio.wait(pending)
+            renamedFiles += collect(done)
+    finally:
+        for task in pending:
+            task.cancel()
+
+        await et.terminate()
+        metadataWorker.shutdown()
+
+    return renamedFiles
+
+'''
+planRename: Compute the new name of a file from its metadata and the file name template.
+
+Every field value is normalized with the file name policy, and the complete name is finalized
+with it. Returns a (directory, old file name, new file name) tuple, or None if the file misses
+a field of the template or would get an unusable name (see FileNameTemplate.render), which is
+reported. With stats, field lookup and normalization are timed.
+'''
+def planRename (metadata, template, policy, stats = None):
+    localLogger = logging.getLogger('planRenames')
+
+    if stats is None:
+        index = indexFields(metadata)
+        normalize = policy.normalize
+    else:
+        index = stats.timed('fields', indexFields)(metadata)
+        normalize = stats.timed('normalize', policy.normalize)
+
+    try:
+        normalizedFileName, ambiguousFields = template.render(index, normalize)
+    except KeyError as exception:
+        localLogger.error ('No matching fields found for field %s of file %s, will skip.', exception.args[0], metadata['File:FileName'])
+        return None
+    except ValueError as exception:
+        localLogger.error ('Cannot rename file %s from its metadata, will skip: %s', metadata['File:FileName'], exception)
+        return None
+
+    # We may have metadata collision, warn people.
+    for field in ambiguousFields:
+        localLogger.warning ('There a more than one field which contains %s in file %s. Please make sure the file is renamed correctly.', field, metadata['File:FileName'])
+
+    return (metadata['File:Directory'], metadata['File:FileName'], policy.finalize(normalizedFileName))
+
+'''
+planRenames: Plan the renames for a stream of metadata with planRename, skipping the files which can't be renamed.
+
+With stats, the time spent planning is added to the 'plan' stage.
+'''
+def planRenames (metadataStream, template, policy, stats = None):
+    planFile = planRename if stats is None else stats.timed('plan', planRename)
+
+    for metadata in metadataStream:
+        plan = planFile(metadata, template, policy, stats)
+
+        if plan is not None:
+            yield plan
+
+'''
+DuplicateFinder: Find byte-identical files among files competing for the same name.
+
+Files are told apart in steps, each step only looking at the files the one before could not
+tell apart: first the size, then a hash of three samples (head, middle and tail) read through
+mmap, and last a hash of the whole file, read in blocks, to confirm. So files which merely
+share a title cost a stat, and different files of the same size a few small reads, however
+large they are. Files not larger than the three samples are hashed whole in the second step.
+
+Files are hashed on up to `threads` threads per call, and at most `threads` files are read at
+once over all calls, so parallel directories don't flood the disk.
+'''
+class DuplicateFinder:
+    SAMPLE_SIZE = 65536
+    BLOCK_SIZE = 1048576
+
+    def __init__ (self, threads = 4):
+        import hashlib
+
+        self.threads = threads
+        self.readers = threading.BoundedSemaphore(threads)
+        self.newDigest = hashlib.blake2b
+
+    def sampleHash (self, path, size):
+        digest = self.newDigest()
+
+        with self.readers, open(path, 'rb') as videoFile:
+            if size <= 3 * self.SAMPLE_SIZE:
+                digest.update(videoFile.read())
+            else:
+                with mmap.mmap(videoFile.fileno(), 0, access = mmap.ACCESS_READ) as buffer:
+                    for offset in (0, (len(buffer) - self.SAMPLE_SIZE) // 2, len(buffer) - self.SAMPLE_SIZE):
+                        digest.update(buffer[offset:offset + self.SAMPLE_SIZE])
+
+        return digest.digest()
+
+    def fullHash (self, path):
+        digest = self.newDigest()
+
+        with self.readers, open(path, 'rb') as videoFile:
+            for block in iter(functools.partial(videoFile.read, self.BLOCK_SIZE), b''):
+                digest.update(block)
+
+        return digest.digest()
+
+    '''
+    split: Split every group of paths by the key of its paths, keeping the groups with more than one path in order.
+
+    Keys are computed in parallel, files which cannot be read are left out.
+    '''
+    @staticmethod
+    def split (groups, keyFunction, executor):
+        def tryKey (path):
+            try:
+                return keyFunction(path)
+            except (OSError, ValueError) as exception:
+                logging.getLogger('DuplicateFinder').warning('Cannot read file %s to compare it: %s', path, exception)
+                return None
+
+        keys = iter(executor.map(tryKey, [path for group in groups for path in group]))
+        splitGroups = list ()
+
+        for group in groups:
+            groupsByKey = dict ()
+
+            for path in group:
+                key = next(keys)
+
+                if key is not None:
+                    groupsByKey.setdefault(key, []).append(path)
+
+            splitGroups.extend(splitGroup for splitGroup in groupsByKey.values() if len(splitGroup) > 1)
+
+        return splitGroups
+
+    '''
+    find: Return a dictionary mapping every path identical to an earlier path in paths to the first one of these.
+    '''
+    def find (self, paths):
+        sizes = dict ()
+        groupsBySize = dict ()
+
+        for path in paths:
+            try:
+                statResult = os.stat(path)
+            except OSError as exception:
+                logging.getLogger('DuplicateFinder').warning('Cannot read file %s to compare it: %s', path, exception)
+                continue
+
+            if stat.S_ISREG(statResult.st_mode):
+                sizes[path] = statResult.st_size
+                groupsBySize.setdefault(statResult.st_size, []).append(path)
+
+        groups = [group for group in groupsBySize.values() if len(group) > 1]
+
+        if len(groups) == 0:
+            return dict ()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers = self.threads, thread_name_prefix = 'findDuplicates') as executor:
+            groups = self.split(groups, lambda path: self.sampleHash(path, sizes[path]), executor)
+            # Small files were hashed whole already.
+            confirmedGroups = [group for group in groups if sizes[group[0]] <= 3 * self.SAMPLE_SIZE]
+            confirmedGroups += self.split([group for group in groups if sizes[group[0]] > 3 * self.SAMPLE_SIZE], self.fullHash, executor)
+
+        return dict((path, group[0]) for group in confirmedGroups for path in group[1:])
+
+# renameat2() flag and the descriptor meaning the current directory, Linux only.
+RENAME_NOREPLACE = 1
+AT_FDCWD = -100
+
+'''
+libcRenameat2: Return renameat2() of the C library and ctypes.get_errno, or None where there is no renameat2().
+'''
+@functools.lru_cache(maxsize = None)
+def libcRenameat2 ():
+    if sys.platform.startswith('linux') == False:
+        return None
+
+    import ctypes
+    import ctypes.util
+
+    try:
+        renameat2 = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True).renameat2
+    except (OSError, AttributeError):
+        # glibc before 2.28 and other C libraries may not have it.
+        return None
+
+    renameat2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+    renameat2.restype = ctypes.c_int
+
+    return renameat2, ctypes.get_errno
+
+'''
+renameNoReplace: Rename a file without overwriting the target, raising FileExistsError if it exists.
+
+On Linux, renameat2(RENAME_NOREPLACE) does this atomically. Elsewhere, and on filesystems which
+don't support it, the file is hard linked to the new name and the old name is removed, which
+fails the same way if the name is taken. Only on filesystems without hard links either (e.g.
+FAT32) the target is looked for first, which leaves a short window for other programs. A target
+which is the source itself, like a change of case on a case-insensitive filesystem, is renamed
+to. Paths are relative to directoryDescriptor if it is given.
+'''
+def renameNoReplace (source, target, directoryDescriptor = None):
+    def sameFile ():
+        try:
+            sourceStat = os.stat(source, dir_fd = directoryDescriptor, follow_symlinks = False)
+            targetStat = os.stat(target, dir_fd = directoryDescriptor, follow_symlinks = False)
+        except OSError:
+            return False
+
+        return (sourceStat.st_dev, sourceStat.st_ino) == (targetStat.st_dev, targetStat.st_ino)
+
+    def renameOver ():
+        os.rename(source, target, src_dir_fd = directoryDescriptor, dst_dir_fd = directoryDescriptor)
+
+    renameat2 = libcRenameat2()
+
+    if renameat2 is not None:
+        function, getErrno = renameat2
+        descriptor = AT_FDCWD if directoryDescriptor is None else directoryDescriptor
+
+        if function(descriptor, os.fsencode(source), descriptor, os.fsencode(target), RENAME_NOREPLACE) == 0:
+            return
+
+        errorNumber = getErrno()
+
+        if errorNumber == errno.EEXIST and sameFile():
+            return renameOver()
+
+        # Filesystems without RENAME_NOREPLACE (or kernels without renameat2) go on below.
+        if errorNumber not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+            raise OSError(errorNumber, os.strerror(errorNumber), source, None, target)
+
+    try:
+        os.link(source, target, src_dir_fd = directoryDescriptor, dst_dir_fd = directoryDescriptor)
+    except FileExistsError:
+        if sameFile():
+            return renameOver()
+
+        raise
+    except OSError as exception:
+        if exception.errno not in (errno.EPERM, errno.EOPNOTSUPP, errno.ENOSYS, errno.EMLINK, errno.EXDEV):
+            raise
+
+        try:
+            os.stat(target, dir_fd = directoryDescriptor, follow_symlinks = False)
+        except FileNotFoundError:
+            return renameOver()
+
+        if sameFile():
+            return renameOver()
+
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), source, None, target)
+
+    os.unlink(source, dir_fd = directoryDescriptor)
+
+'''
+RenameExecutor: Carry out planned renames, one directory at a time, without overwriting anything.
+
+Planned renames are grouped by directory. The names in a directory are listed once with a
+single scandir and kept in memory, so collisions, either with files already there or with
+other files renamed to the same name, are found without a stat per target. Colliding names
+get a '_1', '_2'... suffix before the extension, with the name shortened to keep within maxBytes.
+Files are renamed with renameNoReplace, so a name another program took since the directory was
+listed isn't overwritten, the next suffix is tried instead. Within a batch, the files of a directory
+are renamed in the order of their old names, so the suffixes don't depend on the order
+exiftool returned them in.
+
+Renames are done relative to an open directory descriptor where the platform supports it,
+which saves resolving the whole path for every file. With more than one thread, directories
+are worked on in parallel, which helps on high latency network filesystems. In a dry run
+nothing is renamed, but the name index is still updated so the reported names are right.
+If a RenameJournal is given, every completed rename is recorded in it, and with Stats, renames
+are timed and counted by directory. If handledPaths is set to a list, the path every planned
+file ends up at is appended to it, so --watch can tell the events of our own renames apart.
+
+Files competing for the same name are often the same file, downloaded twice. Unless duplicates
+is 'ignore', these are found with a DuplicateFinder before renaming, and are reported ('report'),
+replaced with a hard link to the file they duplicate ('link') or removed ('remove').
+'''
+class RenameExecutor:
+    def __init__ (self, dryRun = False, threads = 1, journal = None, stats = None, duplicates = 'ignore', maxBytes = None):
+        self.dryRun = dryRun
+        self.maxBytes = maxBytes
+        self.threads = threads
+        self.journal = journal
+        self.stats = stats
+        self.duplicates = duplicates
+        self.duplicateFinder = None if duplicates == 'ignore' else DuplicateFinder()
+        self.directoryNames = dict ()
+        self.directoryNamesLock = threading.Lock()
+        self.useDirectoryDescriptors = os.rename in os.supports_dir_fd
+        self.handledPaths = None
+
+    '''
+    existingNames: Return the set of names in a directory, listing it on first use.
+    '''
+    def existingNames (self, directory):
+        with self.directoryNamesLock:
+            names = self.directoryNames.get(directory)
+
+        if names is None:
+            with os.scandir(directory) as iterator:
+                names = set(entry.name for entry in iterator)
+
+            with self.directoryNamesLock:
+                names = self.directoryNames.setdefault(directory, names)
+
+        return names
+
+    '''
+    numberedName: The name with the given number as a suffix before the extension, shortened to fit in maxBytes.
+    '''
+    @staticmethod
+    def numberedName (fileName, number, maxBytes = None):
+        stem, extension = os.path.splitext(fileName)
+        ending = '_%d%s' % (number, extension)
+
+        if maxBytes is not None:
+            encodedStem = os.fsencode(stem)
+            room = max(maxBytes - len(os.fsencode(ending)), 1)
+
+            # Cutting may split a multi-byte character, drop what is left of it (like FileNamePolicy.finalize).
+            if len(encodedStem) > room:
+                stem = encodedStem[:room].decode(sys.getfilesystemencoding(), 'ignore').rstrip()
+
+        return stem + ending
+
+    '''
+    resolveName: Find a free name for a file, adding a numbered suffix if needed.
+
+    The file's own name counts as free, so renaming already renamed files again changes nothing.
+    '''
+    @staticmethod
+    def resolveName (names, oldFileName, newFileName, maxBytes = None):
+        candidate = newFileName
+        suffix = 0
+
+        while candidate != oldFileName and candidate in names:
+            suffix += 1
+            candidate = RenameExecutor.numberedName(newFileName, suffix, maxBytes)
+
+        return candidate
+
+    '''
+    handleDuplicates: Find the files of a directory identical to another file competing for their name, and deal with them.
+
+    The files competing for a name are the ones already having it (or a numbered variant of it)
+    and the ones to be renamed to it, in the order they are renamed in. Only files to be renamed
+    are dealt with, compared to the ones before them, so the first of identical files is kept.
+    Returns the renames left to do, without the removed files.
+    '''
+    def handleDuplicates (self, directory, names, renames):
+        localLogger = logging.getLogger('renameFiles')
+        oldFileNamesByTarget = dict ()
+        removedFiles = set ()
+
+        for oldFileName, newFileName in renames:
+            oldFileNamesByTarget.setdefault(newFileName, []).append(oldFileName)
+
+        for newFileName, oldFileNames in oldFileNamesByTarget.items():
+            competitors = list ()
+            candidate = newFileName
+
+            while candidate in names:
+                competitors.append(candidate)
+                candidate = self.numberedName(newFileName, len(competitors), self.maxBytes)
+
+            competitors += sorted(set(oldFileNames).difference(competitors))
+
+            if len(competitors) < 2:
+                continue
+
+            duplicates = self.duplicateFinder.find([os.path.join(directory, name) for name in competitors])
+
+            for duplicatePath, originalPath in sorted(duplicates.items()):
+                duplicate, original = os.path.basename(duplicatePath), os.path.basename(originalPath)
+
+                if duplicate not in oldFileNames:
+                    continue
+
+                if self.stats is not None:
+                    self.stats.count('duplicates')
+
+                if self.duplicates == 'report':
+                    localLogger.warning('File %s in %s is a duplicate of %s.', duplicate, directory, original)
+                elif self.duplicates == 'link':
+                    localLogger.info('Will replace duplicate file %s with a hard link to %s.', duplicate, original)
+
+                    if self.dryRun == False:
+                        self.linkDuplicate(duplicatePath, originalPath)
+                elif self.duplicates == 'remove':
+                    localLogger.info('Will remove duplicate file %s, it is the same as %s.', duplicate, original)
+
+                    if self.dryRun == False:
+                        try:
+                            os.unlink(duplicatePath)
+                        except OSError as exception:
+                            localLogger.error('Cannot remove duplicate file %s: %s', duplicatePath, exception)
+                            continue
+
+                    names.discard(duplicate)
+                    removedFiles.add(duplicate)
+
+        return [(oldFileName, newFileName) for oldFileName, newFileName in renames if oldFileName not in removedFiles]
+
+    '''
+    linkDuplicate: Replace a file with a hard link to an identical one, through a temporary link so the file is never missing.
+    '''
+    @staticmethod
+    def linkDuplicate (duplicatePath, originalPath):
+        try:
+            if os.path.samefile(duplicatePath, originalPath):
+                return
+
+            temporaryPath = os.path.join(os.path.dirname(duplicatePath), '.%s.video-renamer-link' % os.path.basename(duplicatePath))
+            os.link(originalPath, temporaryPath)
+
+            try:
+                os.replace(temporaryPath, duplicatePath)
+            except OSError:
+                os.unlink(temporaryPath)
+                raise
+        except OSError as exception:
+            logging.getLogger('renameFiles').error('Cannot replace duplicate file %s with a hard link: %s', duplicatePath, exception)
+
+    '''
+    renameInDirectory: Rename the given (old name, new name) pairs of a single directory.
+
+    Returns the number of files renamed.
+    '''
+    def renameInDirectory (self, directory, renames):
+        localLogger = logging.getLogger('renameFiles')
+        renamedFiles = 0
+
+        try:
+            names = self.existingNames(directory)
+        except OSError as exception:
+            localLogger.error('Cannot list directory %s, will skip its %d files: %s', directory, len(renames), exception)
+            return 0
+
+        if self.duplicateFinder is not None:
+            renames = self.handleDuplicates(directory, names, renames)
+
+        directoryDescriptor = None
+
+        if self.dryRun == False and self.useDirectoryDescriptors:
+            try:
+                directoryDescriptor = os.open(directory, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+            except OSError:
+                directoryDescriptor = None
+
+        try:
+            for oldFileName, newFileName in sorted(renames):
+                resolvedFileName = self.resolveName(names, oldFileName, newFileName, self.maxBytes)
+
+                if resolvedFileName == oldFileName:
+                    localLogger.info('File %s is already named correctly.', oldFileName)
+
+                    if self.handledPaths is not None:
+                        self.handledPaths.append(os.path.join(directory, oldFileName))
+
+                    continue
+
+                if resolvedFileName != newFileName:
+                    localLogger.warning('File name %s is already taken in %s, will use %s for %s.', newFileName, directory, resolvedFileName, oldFileName)
+
+                # Talk to me!
+                localLogger.info('Will rename file %s to %s.', oldFileName, resolvedFileName)
+
+                renameTime = time.perf_counter()
+
+                if self.dryRun == False:
+                    try:
+                        resolvedFileName = self.renameFile(directory, directoryDescriptor, names, oldFileName, newFileName, resolvedFileName)
+                    except OSError as exception:
+                        if exception.errno == 22:
+                            localLogger.error('Cannot rename file "%s", some characters may not be supported on this filesystem. Please try --fat32-safe.', oldFileName)
+                        else:
+                            localLogger.error("Cannot rename file %s, an exception ocurred: %s", oldFileName, exception)
+                        continue
+
+                    if self.journal is not None:
+                        self.recordRename(directory, directoryDescriptor, oldFileName, resolvedFileName)
+
+                if self.stats is not None:
+                    self.stats.countRename(directory, time.perf_counter() - renameTime)
+
+                if self.handledPaths is not None:
+                    self.handledPaths.append(os.path.join(directory, oldFileName if self.dryRun else resolvedFileName))
+
+                names.discard(oldFileName)
+                names.add(resolvedFileName)
+                renamedFiles += 1
+        finally:
+            if directoryDescriptor is not None:
+                os.close(directoryDescriptor)
+
+        return renamedFiles
+
+    '''
+    renameFile: Rename a file to resolvedFileName, or to the next free name if another program took it since. Returns the name used.
+    '''
+    def renameFile (self, directory, directoryDescriptor, names, oldFileName, newFileName, resolvedFileName):
+        while True:
+            try:
+                if directoryDescriptor is not None:
+                    renameNoReplace(oldFileName, resolvedFileName, directoryDescriptor)
+                else:
+                    renameNoReplace(os.path.join(directory, oldFileName), os.path.join(directory, resolvedFileName))
+
+                return resolvedFileName
+            except FileExistsError:
+                names.add(resolvedFileName)
+                takenFileName, resolvedFileName = resolvedFileName, self.resolveName(names, oldFileName, newFileName, self.maxBytes)
+                logging.getLogger('renameFiles').warning('File name %s was taken in %s meanwhile, will use %s for %s.', takenFileName, directory, resolvedFileName, oldFileName)
+
+    '''
+    forgetNames: Drop the name index of every directory, for when other programs may have changed them since.
+    '''
+    def forgetNames (self):
+        with self.directoryNamesLock:
+            self.directoryNames.clear()
+
+    '''
+    recordRename: Add a completed rename to the journal, with the device and inode of the renamed file.
+    '''
+    def recordRename (self, directory, directoryDescriptor, oldFileName, newFileName):
+        try:
+            if directoryDescriptor is not None:
+                statResult = os.stat(newFileName, dir_fd = directoryDescriptor, follow_symlinks = False)
+            else:
+                statResult = os.stat(os.path.join(directory, newFileName), follow_symlinks = False)
+
+            self.journal.write({'directory': directory, 'source': oldFileName, 'target': newFileName, 'device': statResult.st_dev, 'inode': statResult.st_ino})
+        except OSError as exception:
+            logging.getLogger('renameFiles').error('Cannot record the rename of file %s in the journal: %s', oldFileName, exception)
+
+    '''
+    run: Rename a batch of (directory, old name, new name) plans. Returns the number of files renamed.
+    '''
+    def run (self, plans):
+        renamesByDirectory = dict ()
+
+        for directory, oldFileName, newFileName in plans:
+            renamesByDirectory.setdefault(directory, []).append((oldFileName, newFileName))
+
+        if self.threads > 1 and len(renamesByDirectory) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers = self.threads, thread_name_prefix = 'renameFiles') as executor:
+                return sum(executor.map(self.renameInDirectory, renamesByDirectory.keys(), renamesByDirectory.values()))
+
+        return sum(self.renameInDirectory(directory, renames) for directory, renames in renamesByDirectory.items())
+
+'''
+RenameJournal: An append-only log of completed renames, to resume interrupted runs and to undo them.
+
+Every line is a JSON record of one rename: the directory, the old (source) and new (target)
+name, and the device and inode of the file. Records are buffered and written in groups, with
+one write and one fsync per groupSize records, and on close, so the journal doesn't slow
+renaming down. No record waits longer than groupSeconds: a timer thread flushes the group that
+long after its first record, also when no more renames follow (e.g. in --watch). A crash loses at most the last group; those
+files look unrenamed to the journal, so a resumed run reads them again (and finds them already
+named correctly), and undo leaves them alone.
+
+Undone renames are recorded as well, with 'undo' set, so a journal stays usable after an undo.
+'''
+class RenameJournal:
+    def __init__ (self, path, groupSize = 1000, groupSeconds = 1.0):
+        self.path = path
+        self.groupSize = groupSize
+        self.groupSeconds = groupSeconds
+        self.pending = list ()
+        self.pendingLock = threading.Lock()
+        # Flushes are done one at a time, but other threads can keep adding records meanwhile.
+        self.flushLock = threading.Lock()
+        # Flushes the pending records groupSeconds after the first of them, if nothing else did.
+        self.timer = None
+
+        # A crash can leave a torn last line, new records must not be glued to it.
+        try:
+            with open(path, 'rb') as journalStream:
+                journalStream.seek(-1, os.SEEK_END)
+                tornLine = journalStream.read(1) != b'\n'
+        except OSError:
+            tornLine = False
+
+        self.stream = open(path, 'a', encoding = 'utf-8')
+
+        if tornLine:
+            self.stream.write('\n')
+
+    def write (self, record):
+        line = json.dumps(record) + '\n'
+
+        with self.pendingLock:
+            self.pending.append(line)
+            due = len(self.pending) >= self.groupSize
+
+            if due == False and self.timer is None:
+                self.timer = threading.Timer(self.groupSeconds, self.flushOnTimer)
+                self.timer.daemon = True
+                self.timer.start()
+
+        if due:
+            self.flush()
+
+    def flushOnTimer (self):
+        try:
+            self.flush()
+        except (OSError, ValueError) as exception:
+            # ValueError if the journal was closed meanwhile.
+            logging.getLogger('RenameJournal').error('Cannot write the journal: %s', exception)
+
+    def flush (self):
+        with self.flushLock:
+            with self.pendingLock:
+                lines, self.pending = self.pending, list ()
+
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+
+            if len(lines) > 0:
+                self.stream.write(''.join(lines))
+                self.stream.flush()
+                os.fsync(self.stream.fileno())
+
+    def close (self):
+        try:
+            self.flush()
+        finally:
+            self.stream.close()
+
+    '''
+    read: Return the renames of a journal which are still in effect, oldest first.
+
+    Undo records cancel the latest rename of the same file. Damaged lines, like a torn last line
+    left by a crash while writing, are ignored. Raises OSError if the journal can't be read.
+    '''
+    @staticmethod
+    def read (path):
+        localLogger = logging.getLogger('RenameJournal')
+        # Renames in effect by (device, inode), with their line number to put them back in order.
+        renamesByFile = dict ()
+
+        with open(path, 'r', encoding = 'utf-8') as journalStream:
+            for lineNumber, line in enumerate(journalStream, 1):
+                try:
+                    record = json.loads(line)
+                    key = (record['device'], record['inode'])
+                except (ValueError, KeyError, TypeError):
+                    localLogger.warning('Line %d of journal %s is damaged, will ignore it.', lineNumber, path)
+                    continue
+
+                renames = renamesByFile.setdefault(key, [])
+
+                if record.get('undo', False) == False:
+                    renames.append((lineNumber, record))
+                elif len(renames) > 0:
+                    renames.pop()
+
+        return [record for lineNumber, record in sorted((rename for renames in renamesByFile.values() for rename in renames), key = lambda rename: rename[0])]
+
+'''
+skipJournaled: Pass on only the file entries a journal doesn't list as already renamed.
+
+renamed maps (device, inode) to the name a file was renamed to. A file is skipped if it still
+has that name, so a reused inode doesn't hide a new file. Only files with a journaled inode are
+stat'ed, since scandir knows the inode already.
+'''
+def skipJournaled (entries, renamed):
+    localLogger = logging.getLogger('skipJournaled')
+    inodes = set(inode for device, inode in renamed)
+
+    for entry in entries:
+        try:
+            inode = entry.inode()
+        except OSError as exception:
+            # Named directly and gone or unreadable since, see PathEntry.
+            localLogger.error('Cannot stat file %s, will skip: %s', entry.path, exception)
+            continue
+
+        if inode in inodes:
+            try:
+                statResult = entry.stat()
+            except OSError:
+                statResult = None
+
+            if statResult is not None and renamed.get((statResult.st_dev, statResult.st_ino)) == entry.name:
+                localLogger.debug('File %s is already renamed according to the journal, will skip.', entry.path)
+                continue
+
+        yield entry
+
+'''
+undoRenames: Rename the files recorded in a journal back to their old names, newest rename first.
+
+A file is only renamed back if it is still there under its new name, is the same file (device
+and inode), and its old name is free. Undone renames are recorded in the journal, unless this
+is a dry run. Returns the number of files renamed back.
+'''
+def undoRenames (records, journal, dryRun = False):
+    localLogger = logging.getLogger('undoRenames')
+    undoneFiles = 0
+
+    for record in reversed(records):
+        targetPath = os.path.join(record['directory'], record['target'])
+        sourcePath = os.path.join(record['directory'], record['source'])
+
+        try:
+            statResult = os.stat(targetPath, follow_symlinks = False)
+        except OSError as exception:
+            localLogger.error('Cannot find renamed file %s, will not rename it back: %s', targetPath, exception)
+            continue
+
+        if (statResult.st_dev, statResult.st_ino) != (record['device'], record['inode']):
+            localLogger.error('File %s is not the file which was renamed, will not rename it back.', targetPath)
+            continue
+
+        if os.path.lexists(sourcePath):
+            localLogger.error('Cannot rename file %s back, %s is taken.', targetPath, sourcePath)
+            continue
+
+        localLogger.info('Will rename file %s back to %s.', targetPath, record['source'])
+
+        if dryRun == False:
+            try:
+                os.rename(targetPath, sourcePath)
+            except OSError as exception:
+                localLogger.error('Cannot rename file %s back, an exception ocurred: %s', targetPath, exception)
+                continue
+
+            journal.write(dict(record, undo = True))
+
+        undoneFiles += 1
+
+    return undoneFiles
+
+'''
+renameFiles: Rename the files as planned in batches, or only talk about it if the executor is in dry run mode.
+
+Returns the number of files renamed (or would be renamed in a dry run).
+'''
+def renameFiles (plans, executor, batchSize = 100):
+    renamedFiles = 0
+
+    for batch in chunked(plans, batchSize):
+        renamedFiles += executor.run(batch)
+
+    return renamedFiles
+
+'''
+parseShard: Parse a shard like '2/4' (the second of four) into an (index, count) tuple. Raises ValueError.
+'''
+def parseShard (text):
+    index, separator, count = text.partition('/')
+
+    if separator == '':
+        raise ValueError('Shard "%s" is not in I/N form.' % text)
+
+    index, count = int(index), int(count)
+
+    if count < 1 or index < 1 or index > count:
+        raise ValueError('Shard "%s" is out of range, I must be between 1 and N.' % text)
+
+    return index, count
 
 '''
-normalizeFileName: Check the filename string and modify the string if required.
+selectShard: Pass on only the file entries of the given shard, out of count shards.
 
-This function will make sure that the file names are UNIX safe, and will support more
-restrictive modes.
+Files are split by their directory, as found from the FILE arguments, with a CRC32 hash. This is
+deterministic across hosts and runs, as long as every host is given the same FILE arguments, and
+keeps the files of a directory together, so name collisions stay within a shard.
+'''
+def selectShard (entries, index, count):
+    shards = dict ()
 
-- UNIX compatibility will assume that only '/' and NULL is invalid.
-- FAT32 Safe: Will only use FAT32 safe characters.
-- Console Friendly: Will only use characters which doesn't need escaping in UNIX shells.
+    for entry in entries:
+        directory = os.path.dirname(entry.path)
+        shard = shards.get(directory)
+
+        if shard is None:
+            shard = shards[directory] = zlib.crc32(os.fsencode(directory)) % count + 1
+
+        if shard == index:
+            yield entry
 
-This function will change all restricted characters and console-unfriendly characters with '_'.
 '''
-def normalizeFileName (fileName, fat32Safe = False, consoleFriendly = False):
-    # Get the lgger and print some debug information.
-    localLogger = logging.getLogger ('normalizeFileName')
-    localLogger.debug('File name to normalize is "%s"', fileName)
-    localLogger.debug('FAT32 safety is set to %s', fat32Safe)
-    localLogger.debug('Console friendly renaming is set to %s', consoleFriendly)
-    
-    # Standard file treatments
-    fileName = fileName.strip()
-    
-    # Let's change the '/' character. This is not valid neither in UNIX nor Windows
-    fileName = fileName.replace('/', '_')
-    
-    # Replace the characters which need replace in FAT32. Got the tip from a tooltip (https://i.stack.imgur.com/2Jit2.png).
-    if fat32Safe:
-        for character in ['\\', ':', '*', '?', '"', '<', '>', '|']:
-            fileName = fileName.replace(character, '_')
-    
-    # Replace characters which needs escaping. Got the list from holy stackoverflow (https://unix.stackexchange.com/q/270977/13922)
-    if consoleFriendly:
-        for character in ['`', '~', '!', '#', '$', '&', '*', '(', ')', '\t', '[', ']', '{', '}', '|', '\\', ';', '\'', '"', '<', '>', '?', ' ']:
-            fileName = fileName.replace(character, '_')
-    
-    return fileName
+writePlan: Write the planned renames to a JSON lines stream instead of renaming, for the apply command.
 
+Every line describes one file: its directory and current name (source), the new name (target),
+the template field values the name was built from, and the device, inode, size and modification
+time of the file, so apply can tell if it changed since. Name collisions are left to apply, which
+sees the plans of all shards. Returns the number of files planned.
 '''
-This function searches for a field name inside the metadata dictionary.
-Since the ExifTool provides field names unprocessed(*), we need to look
-for a field name that we want.
+def writePlan (metadataStream, template, policy, output):
+    localLogger = logging.getLogger('writePlan')
+    plannedFiles = 0
+
+    for metadata in metadataStream:
+        plan = planRename(metadata, template, policy)
+
+        if plan is None:
+            continue
+
+        directory, oldFileName, newFileName = plan
+
+        try:
+            statResult = os.stat(metadata['SourceFile'])
+        except OSError as exception:
+            localLogger.error('Cannot stat file %s, will skip: %s', metadata['SourceFile'], exception)
+            continue
+
+        record = {
+            'directory': directory,
+            'source': oldFileName,
+            'target': newFileName,
+            'fields': template.fieldValues(indexFields(metadata)),
+            'device': statResult.st_dev,
+            'inode': statResult.st_ino,
+            'size': statResult.st_size,
+            'mtime_ns': statResult.st_mtime_ns,
+        }
+
+        output.write(json.dumps(record) + '\n')
+        localLogger.info('Planned to rename file %s to %s.', oldFileName, newFileName)
+        plannedFiles += 1
+
+    return plannedFiles
+
+# Keys every plan record must have for apply.
+PLAN_KEYS = ('directory', 'source', 'target', 'inode', 'size', 'mtime_ns')
 
-*: ExifTool provides the field names with its belonging class to find them easier (e.g.: QuickTime:Title, Composite:Rotation).
 '''
-def findField (metadata, fieldToFind):
-    localLogger = logging.getLogger('findField')
-    localLogger.debug('Will search for field %s', fieldToFind)
-    
-    foundFields = list ()
-    
-    # We need to search this stuff one by one.
-    # A loop, and text processing. A recipe for low performance code.
-    for field in metadata:
-        processedField = field.strip().split(':')
-        localLogger.debug('Field %s is processed as %s.', field, processedField)
-        
-        for processedFieldElement in processedField:
-            if str(processedFieldElement) == fieldToFind:
-                localLogger.debug('Field %s contains the field name we are searching for, adding to results.', field)
-                foundFields.append(metadata[field])
-        
-    
-    localLogger.debug('Found %s field(s) in metadata, returning results.', str(len(foundFields)))
-    return foundFields
+readPlans: Read and merge the plan files written by the plan command. Returns the list of plan records.
+
+Raises OSError if a plan can't be read and ValueError if it isn't a rename plan. A file planned
+more than once with a different new name or state, e.g. by overlapping shards or plans of
+different runs, is a conflict: it's reported and left out. Directories found in more than one
+plan file are reported too, since they mean the shards overlap.
+'''
+def readPlans (planFiles):
+    localLogger = logging.getLogger('applyPlans')
+    records = dict ()
+    conflicts = set ()
+    # The plan file every directory was first seen in.
+    directoryPlans = dict ()
+    overlappingDirectories = set ()
+
+    for planFile in planFiles:
+        with open(planFile, 'r', encoding = 'utf-8') as planStream:
+            for lineNumber, line in enumerate(planStream, 1):
+                if line.strip() == '':
+                    continue
+
+                try:
+                    record = json.loads(line)
+                    planState = tuple(record[name] for name in PLAN_KEYS)
+                except (ValueError, KeyError, TypeError) as exception:
+                    raise ValueError('%s:%d is not a rename plan record: %s' % (planFile, lineNumber, exception))
+
+                directory = record['directory']
+
+                if directoryPlans.setdefault(directory, planFile) != planFile:
+                    overlappingDirectories.add(directory)
+
+                key = (directory, record['source'])
+                previous = records.setdefault(key, record)
+
+                if previous is not record and tuple(previous[name] for name in PLAN_KEYS) != planState:
+                    conflicts.add(key)
+
+    for directory in sorted(overlappingDirectories):
+        localLogger.warning('Directory %s is in more than one plan file, do the shards overlap?', directory)
+
+    for key in sorted(conflicts):
+        localLogger.error('File %s is planned more than once with different names or states, will skip.', os.path.join(*key))
+        del records[key]
+
+    return list(records.values())
+
+'''
+applyPlans: Rename the files of merged plan records in one pass, without exiftool.
+
+Every file is checked first: a file which is gone, or whose inode, size or modification time
+differ from the plan, changed since it was planned and is skipped. The device isn't compared,
+since the hosts of a sharded run may see the same share as different devices. The rest go to
+the rename executor at once, so every directory is listed once, and name collisions, also the
+ones between shards, are resolved as in a normal run. Returns the number of files renamed.
+'''
+def applyPlans (records, executor):
+    localLogger = logging.getLogger('applyPlans')
+
+    def unchanged (record):
+        path = os.path.join(record['directory'], record['source'])
+
+        try:
+            statResult = os.stat(path)
+        except OSError as exception:
+            localLogger.error('Cannot stat file %s, will skip: %s', path, exception)
+            return False
+
+        if (statResult.st_ino, statResult.st_size, statResult.st_mtime_ns) != (record['inode'], record['size'], record['mtime_ns']):
+            localLogger.error('File %s changed since it was planned, will skip.', path)
+            return False
+
+        return True
+
+    # Checking is one stat per file, which is worth spreading over threads on network filesystems.
+    if executor.threads > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers = executor.threads, thread_name_prefix = 'applyPlans') as checker:
+            checks = list(checker.map(unchanged, records))
+    else:
+        checks = [unchanged(record) for record in records]
+
+    return executor.run([(record['directory'], record['source'], record['target']) for record, check in zip(records, checks) if check])
+
+'''
+WatchPatterns: The FILE arguments, compiled to tell which new files and directories they cover.
+
+This follows the same glob semantics as discoverFiles, but for single paths, so a watcher can
+check a path it got an event for without listing its directory. Paths are built like the ones
+discoverFiles yields: joined to the root of the pattern, without a './' prefix.
+'''
+class WatchPatterns:
+    def __init__ (self, patterns, recursive = False, extensions = None):
+        self.recursive = recursive
+        self.extensions = extensions
+        self.patterns = [splitPattern(os.path.expanduser(os.path.expandvars(pattern)), recursive) for pattern in patterns]
+        self.matchers = dict ()
+
+    '''
+    roots: Return the directories the patterns start from, without duplicates.
+    '''
+    def roots (self):
+        return list(dict.fromkeys(root for root, parts in self.patterns))
+
+    '''
+    matchesFile: Tell if a file path is matched by any of the patterns, honouring the extensions.
+    '''
+    def matchesFile (self, path):
+        if self.extensions is not None and os.path.splitext(path)[1].lower() not in self.extensions:
+            return False
+
+        return any(self.matchNames(names, parts, False) for names, parts in self.relativeNames(path))
+
+    '''
+    wantsDirectory: Tell if files matched by any of the patterns can appear in or below a directory.
+    '''
+    def wantsDirectory (self, path):
+        return any(self.matchNames(names, parts, True) for names, parts in self.relativeNames(path))
+
+    def relativeNames (self, path):
+        for root, parts in self.patterns:
+            if root == '':
+                relativePath = path
+            elif path == root:
+                relativePath = ''
+            elif path.startswith(root.rstrip(os.sep) + os.sep):
+                relativePath = path[len(root.rstrip(os.sep)) + 1:]
+            else:
+                continue
+
+            yield ([name for name in relativePath.split(os.sep) if name != ''], parts)
+
+    def matchNames (self, names, parts, directory):
+        if len(names) == 0:
+            # A directory is on the way to a match while some of the pattern is left for its contents.
+            return len(parts) > 0 if directory else len(parts) == 0
+
+        if len(parts) == 0:
+            return False
+
+        part, name = parts[0], names[0]
+
+        if self.recursive and part == '**':
+            if name.startswith('.'):
+                # '**' doesn't go into hidden directories, it can only match nothing here.
+                return self.matchNames(names, parts[1:], directory)
+
+            # Everything below a trailing '**' matches, except hidden names.
+            if len(parts) == 1:
+                return all(name.startswith('.') == False for name in names)
+
+            return self.matchNames(names, parts[1:], directory) or self.matchNames(names[1:], parts, directory)
+
+        if name.startswith('.') and part.startswith('.') == False:
+            return False
+
+        matcher = self.matchers.get(part)
+
+        if matcher is None:
+            matcher = self.matchers[part] = re.compile(fnmatch.translate(os.path.normcase(part))).match
+
+        if matcher(os.path.normcase(name)) is None:
+            return False
+
+        return self.matchNames(names[1:], parts[1:], directory)
+
+'''
+fileSignature: Return (device, inode, size, modification time) of a regular file, or None if it isn't one (anymore).
+'''
+def fileSignature (path):
+    try:
+        statResult = os.stat(path)
+    except OSError:
+        return None
+
+    if stat.S_ISREG(statResult.st_mode) == False:
+        return None
+
+    return (statResult.st_dev, statResult.st_ino, statResult.st_size, statResult.st_mtime_ns)
+
+'''
+InotifyWatcher: Report files written or moved into the watched directories, with Linux inotify through ctypes.
+
+Every directory which can hold matching files, or directories leading to them, is watched, and
+new directories are watched as they appear. wait() returns the matching paths which got events,
+so files are never listed again. Raises OSError if inotify isn't available, and watches on
+filesystems without inotify support (most network filesystems only report local changes) are
+the reason for PollingWatcher.
+'''
+class InotifyWatcher:
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    # struct inotify_event: int wd; uint32_t mask, cookie, len; char name[len].
+    EVENT = struct.Struct('iIII')
+
+    def __init__ (self, patterns):
+        localLogger = logging.getLogger('InotifyWatcher')
+        self.patterns = patterns
+        # Watched directory by watch descriptor.
+        self.directories = dict ()
+
+        try:
+            import ctypes
+            import ctypes.util
+
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+            self.getErrno = ctypes.get_errno
+            self.inotifyAddWatch = libc.inotify_add_watch
+            self.inotifyAddWatch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError, TypeError) as exception:
+            raise OSError('inotify is not available: %s' % exception)
+
+        if self.fd < 0:
+            raise OSError(self.getErrno(), 'Cannot initialize inotify: ' + os.strerror(self.getErrno()))
+
+        try:
+            for root in patterns.roots():
+                self.watchTree(root)
+        except BaseException:
+            self.close()
+            raise
+
+        localLogger.debug('Watching %d directories with inotify.', len(self.directories))
+
+    '''
+    watchTree: Watch a directory and the directories below it the patterns need. Returns the matching files already there.
+    '''
+    def watchTree (self, directory):
+        files = list ()
+        directories = [directory]
+
+        while len(directories) > 0:
+            directory = directories.pop()
+            descriptor = self.inotifyAddWatch(self.fd, os.fsencode(directory or os.curdir), self.WATCH_MASK)
+
+            if descriptor < 0:
+                errorNumber = self.getErrno()
+
+                # The root must be watchable, or we would wait for nothing.
+                if len(self.directories) == 0:
+                    raise OSError(errorNumber, 'Cannot watch directory %s: %s' % (directory or os.curdir, os.strerror(errorNumber)))
+
+                logging.getLogger('InotifyWatcher').warning('Cannot watch directory %s, will miss its files: %s', directory, os.strerror(errorNumber))
+                continue
+
+            self.directories[descriptor] = directory
+
+            try:
+                with os.scandir(directory or os.curdir) as iterator:
+                    for entry in iterator:
+                        path = os.path.join(directory, entry.name) if directory != '' else entry.name
+
+                        if entry.is_dir(follow_symlinks = False):
+                            if self.patterns.wantsDirectory(path):
+                                directories.append(path)
+                        elif self.patterns.matchesFile(path):
+                            files.append(path)
+            except OSError:
+                pass
+
+        return files
+
+    '''
+    wait: Wait up to timeout seconds (None is forever) for events, and return the matching paths which changed.
+
+    Returns None if the kernel dropped events, then everything has to be looked at again.
+    '''
+    def wait (self, timeout):
+        if len(select.select([self.fd], [], [], timeout)[0]) == 0:
+            return []
+
+        paths = list ()
+        buffer = b''
+
+        while True:
+            try:
+                block = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+
+            buffer += block
+
+            if len(block) < 65536:
+                break
+
+        position = 0
+
+        while position + self.EVENT.size <= len(buffer):
+            descriptor, mask, cookie, length = self.EVENT.unpack_from(buffer, position)
+            name = os.fsdecode(buffer[position + self.EVENT.size:position + self.EVENT.size + length].rstrip(b'\0'))
+            position += self.EVENT.size + length
+
+            if mask & self.IN_Q_OVERFLOW:
+                logging.getLogger('InotifyWatcher').warning('Too many changes at once, will look at all files again.')
+                return None
+
+            if mask & self.IN_IGNORED:
+                self.directories.pop(descriptor, None)
+                continue
+
+            directory = self.directories.get(descriptor)
+
+            if directory is None or name == '':
+                continue
+
+            path = os.path.join(directory, name) if directory != '' else name
+
+            if mask & self.IN_ISDIR:
+                # Files may have been put in a new directory before we watched it.
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO) and self.patterns.wantsDirectory(path):
+                    paths.extend(self.watchTree(path))
+            elif self.patterns.matchesFile(path):
+                paths.append(path)
+
+        return paths
+
+    def close (self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+'''
+PollingWatcher: Report changed files by listing all directories every interval seconds, where inotify can't be used.
+
+The same interface as InotifyWatcher. Every poll is a full discoverFiles walk, comparing the
+size and modification time of every file to the previous walk.
+'''
+class PollingWatcher:
+    def __init__ (self, patterns, recursive = False, extensions = None, interval = 2.0, threads = 8):
+        self.patterns = patterns
+        self.recursive = recursive
+        self.extensions = extensions
+        self.interval = interval
+        self.threads = threads
+        self.signatures = self.poll()
+        self.nextPoll = time.monotonic() + interval
+
+    def poll (self):
+        signatures = dict ()
+
+        for entry in discoverFiles(self.patterns, self.recursive, self.extensions, self.threads):
+            try:
+                statResult = entry.stat()
+            except OSError:
+                continue
+
+            signatures[entry.path] = (statResult.st_size, statResult.st_mtime_ns)
+
+        return signatures
+
+    def wait (self, timeout):
+        delay = self.nextPoll - time.monotonic()
+
+        if timeout is not None and timeout < delay:
+            time.sleep(max(timeout, 0))
+            return []
+
+        time.sleep(max(delay, 0))
+        self.nextPoll = time.monotonic() + self.interval
+        previousSignatures, self.signatures = self.signatures, self.poll()
+
+        return [path for path, signature in self.signatures.items() if previousSignatures.get(path) != signature]
+
+    def close (self):
+        pass
+
+'''
+watchFiles: Rename files as they are written or moved in, until interrupted. Returns the number of files renamed.
+
+Files are debounced first: a file is only passed on once its size and modification time stayed
+the same for settle seconds since its last event, so files still being downloaded are left
+alone. Settled files are handed to processBatch, which renames a list of file entries and
+returns the count, in micro-batches of at most batchSize files. Files which didn't change since
+they were last passed on are skipped, which also ignores the events of our own renames. The
+files of the first pass are given as their signatures (see fileSignature) in handled, so they
+are skipped the same way.
+'''
+def watchFiles (watcher, processBatch, batchSize = 100, settle = 0.25, rescan = None, handled = ()):
+    localLogger = logging.getLogger('watchFiles')
+    # Path -> (signature at the last event, time it counts as settled).
+    pending = dict ()
+    # (device, inode) -> (size, modification time) of files passed on, the most recent last.
+    processed = collections.OrderedDict((signature[:2], signature[2:]) for signature in handled)
+    # The files of the first pass are all kept, since a rescan sees them again.
+    processedLimit = max(100000, len(processed))
+    renamedFiles = 0
+
+    try:
+        while True:
+            timeout = None
+
+            if len(pending) > 0:
+                timeout = max(min(deadline for signature, deadline in pending.values()) - time.monotonic(), 0)
+
+            paths = watcher.wait(timeout)
+
+            if paths is None:
+                paths = [entry.path for entry in rescan()] if rescan is not None else []
+
+            now = time.monotonic()
+
+            for path in paths:
+                pending[path] = (fileSignature(path), now + settle)
+
+            ready = list ()
+
+            for path, (signature, deadline) in list(pending.items()):
+                if deadline > now:
+                    continue
+
+                currentSignature = fileSignature(path)
+
+                if currentSignature is None:
+                    del pending[path]
+                elif currentSignature != signature:
+                    pending[path] = (currentSignature, now + settle)
+                else:
+                    del pending[path]
+
+                    if processed.get(signature[:2]) != signature[2:]:
+                        ready.append((path, signature))
+
+            for batch in chunked(ready, batchSize):
+                localLogger.debug('Renaming a micro-batch of %d settled files.', len(batch))
+                renamedFiles += processBatch([PathEntry(path) for path, signature in batch])
+
+                for path, signature in batch:
+                    processed[signature[:2]] = signature[2:]
+                    processed.move_to_end(signature[:2])
+
+                while len(processed) > processedLimit:
+                    processed.popitem(last = False)
+    except KeyboardInterrupt:
+        localLogger.info('Stopped watching.')
+
+    return renamedFiles
 
 if __name__ == '__main__':
     # This is the global logging level. Will be changed with verbosity if required in the future.
@@ -107,14 +2838,52 @@ if __name__ == '__main__':
     # Let's start with building the argument parser.
     argumentParser = argparse.ArgumentParser()
     argumentParser.description = 'Rename many video files using their meta data with ease.'
-    argumentParser.epilog = 'In order to match recursive files correctly, please put your wildcard containing paths into single quotes.'
+    argumentParser.epilog = 'In order to match recursive files correctly, please put your wildcard containing paths into single quotes. To split the work over several hosts, run "plan" (e.g. with --shard) instead of renaming right away, then "apply" the plans.'
+
+    # 'plan' and 'apply' are subcommands, without them files are renamed right away as before.
+    command = None
+
+    if len(sys.argv) > 1 and sys.argv[1] in ('plan', 'apply'):
+        command = sys.argv[1]
+        argumentParser.prog += ' ' + command
 
     # Optional arguments are below.
     argumentParser.add_argument ('--alternative-exiftool', metavar = 'EXIFTOOL_PATH', help = 'Use an alternative exiftool binary, instead of the installed one.')
     # Count gives the number of '-v' s provided. So one can handle the verbosity easily.
+    argumentParser.add_argument ('--format', metavar = 'TEMPLATE', help = 'Template of the new file names, fields are metadata tags (default: %(default)s).', default = '{Title}.{ext}')
     argumentParser.add_argument ('--fat32-safe', help = 'Rename files only with FAT32 safe characters.', action = 'store_true')
     argumentParser.add_argument ('--console-friendly', help = 'Do not use characters which need escaping in shells.', action = 'store_true')
+    argumentParser.add_argument ('--windows-safe', help = 'Rename files only with names Windows accepts (implies FAT32 safe characters, avoids reserved names).', action = 'store_true')
+    argumentParser.add_argument ('--unicode-form', help = 'Normalize names to this Unicode normalization form.', choices = ['NFC', 'NFD', 'NFKC', 'NFKD'])
+    argumentParser.add_argument ('--max-bytes', metavar = 'N', help = 'Shorten names longer than this many bytes, keeping the extension (default: %(default)s).', type = int, default = 255)
     argumentParser.add_argument ('-r', '--recursive', help = 'Work recursively on the given path.', action = 'store_true')
+    argumentParser.add_argument ('--ext', metavar = 'EXTENSIONS', help = 'Only work on files with these comma separated extensions (e.g. mp4,mkv).')
+    argumentParser.add_argument ('--discovery-threads', metavar = 'N', help = 'Number of threads listing directories in parallel (default: %(default)s).', type = int, default = 8)
+    argumentParser.add_argument ('-j', '--jobs', metavar = 'N', help = 'Number of exiftool processes to run in parallel (default: number of CPUs).', type = int, default = os.cpu_count() or 1)
+    argumentParser.add_argument ('--fast', help = 'Read less of every file to find the metadata (-fast). Use twice for -fast2.', action = 'count', default = 0)
+    argumentParser.add_argument ('--no-cache', help = 'Do not use the metadata cache.', action = 'store_true')
+    argumentParser.add_argument ('--refresh-cache', help = 'Ignore the cached metadata and read every file again, updating the cache.', action = 'store_true')
+    argumentParser.add_argument ('--cache-size', metavar = 'N', help = 'Maximum number of files to keep in the metadata cache (default: %(default)s).', type = int, default = 1000000)
+    argumentParser.add_argument ('--no-quicktime-reader', help = 'Always use exiftool, also for MP4/MOV/M4V files.', action = 'store_true')
+    argumentParser.add_argument ('--timeout', metavar = 'SECONDS', help = 'Give up on a batch exiftool has not finished in this many seconds, and look for the files it hangs on (default: %(default)s).', type = float, default = 300)
+    argumentParser.add_argument ('--batch-size', metavar = 'N', help = 'Maximum number of files to send to exiftool at once. Batches start smaller and adapt to --batch-target (default: %(default)s).', type = int, default = 100)
+    argumentParser.add_argument ('--batch-bytes', metavar = 'BYTES', help = 'Maximum total size of the files sent to exiftool at once, larger files are sent on their own (default: %(default)s).', type = int, default = 16 << 30)
+    argumentParser.add_argument ('--batch-target', metavar = 'SECONDS', help = 'Time an exiftool batch should take, the number of files per batch is adjusted to it (default: %(default)s, not used with --asyncio).', type = float, default = 0.5)
+    argumentParser.add_argument ('--duplicates', choices = ['ignore', 'report', 'link', 'remove'], help = 'What to do with a file identical to another file competing for its new name: nothing, report it, replace it with a hard link to the other file, or remove it (default: %(default)s).', default = 'report')
+    argumentParser.add_argument ('--io-order', choices = ['none', 'inode', 'extent'], help = 'Read files in the order they are on the disk, found from their inode numbers or, on Linux, their physical extents, to save seeking on rotating disks (default: %(default)s).', default = 'none')
+    argumentParser.add_argument ('--io-window', metavar = 'N', help = 'With --io-order, order this many files at a time (default: %(default)s).', type = int, default = 1000)
+    argumentParser.add_argument ('--prefetch', help = 'Ask the operating system to read the header and trailer of the next files while exiftool works on the current ones.', action = 'store_true')
+    argumentParser.add_argument ('--rename-threads', metavar = 'N', help = 'Number of directories to rename files in at once, useful on network filesystems (default: %(default)s).', type = int, default = 1)
+    argumentParser.add_argument ('--broker', metavar = 'SOCKET', help = 'Socket of the exiftool broker started with --serve, used if it is running (default: %(default)s).', default = defaultBrokerPath())
+    argumentParser.add_argument ('--no-broker', help = 'Always start exiftool, even if an exiftool broker is running.', action = 'store_true')
+    argumentParser.add_argument ('--asyncio', help = 'Use a single asyncio driven exiftool with several batches in flight, instead of the process pool.', action = 'store_true')
+    argumentParser.add_argument ('--watch', help = 'After renaming, keep running and rename new or changed files as they are written, until interrupted.', action = 'store_true')
+    argumentParser.add_argument ('--settle', metavar = 'SECONDS', help = 'With --watch, wait until a file did not change for this long before renaming it (default: %(default)s).', type = float, default = 0.25)
+    argumentParser.add_argument ('--poll', metavar = 'SECONDS', help = 'With --watch, look for changes by listing the directories this often instead of using inotify, e.g. on network filesystems (default: only without inotify, every 2 seconds).', type = float)
+    argumentParser.add_argument ('--journal', metavar = 'JOURNAL', help = 'Record every rename in this journal. Files it lists as renamed are skipped, so an interrupted run can be resumed without reading them again.')
+    argumentParser.add_argument ('--stats', help = 'Print where the time went and other figures of the run to standard error at the end.', action = 'store_true')
+    argumentParser.add_argument ('--stats-json', metavar = 'FILE', help = 'Write the figures of --stats to this file as JSON.')
+    argumentParser.add_argument ('--profile', metavar = 'FILE', help = 'Profile the run with cProfile and write the results to this file (main thread only, see pstats).')
     argumentParser.add_argument ('--dry-run', help = 'Do not actually rename files, print actions to be taken (implies -vv).', action = 'store_true')
     argumentParser.add_argument ('-v', '--verbose', help = 'Print more detail about the process. Using more than one -v increases verbosity.', action = 'count')
     argumentParser.add_argument ('-q', '--quiet', help = 'Do not print anything to console (overrides verbose).', action = 'store_true') # Will override --verbose.
@@ -122,10 +2891,101 @@ if __name__ == '__main__':
     # Ability to handle version in-library is nice.
     argumentParser.add_argument ('-V', '--version', help = 'Print ' + argumentParser.prog + ' version and exit.', action = 'version', version = argumentParser.prog + ' version 0.0.2')
 
+    if command is None:
+        argumentParser.add_argument ('--undo', metavar = 'JOURNAL', help = 'Rename the files recorded in this journal back to their old names, instead of renaming FILE(s).')
+        argumentParser.add_argument ('--serve', help = 'Keep exiftool processes running for other runs on the --broker socket until interrupted, instead of renaming FILE(s). Short runs skip starting exiftool this way.', action = 'store_true')
+
+    if command == 'plan':
+        argumentParser.add_argument ('--output', metavar = 'PLAN', help = 'Write the rename plan to this file as JSON lines, "-" is standard output (default: %(default)s).', default = '-')
+        argumentParser.add_argument ('--shard', metavar = 'I/N', help = 'Only plan the I-th of N shards of the files, split by directory. Give every host the same FILE arguments.')
+
     # Mandatory FILE(s) argument. nargs = '+' means "at least one, but can provide more if you wish"
-    argumentParser.add_argument ('FILE', help = 'File(s) to be renamed.', nargs = '+')
+    if command == 'apply':
+        argumentParser.add_argument ('FILE', help = 'Rename plan(s) written by the plan command.', nargs = '+')
+    elif command == 'plan':
+        argumentParser.add_argument ('FILE', help = 'File(s) to be planned.', nargs = '+')
+    else:
+        # Not needed with --undo, so checked below.
+        argumentParser.add_argument ('FILE', help = 'File(s) to be renamed.', nargs = '*')
+
+    arguments = argumentParser.parse_args(sys.argv[1:] if command is None else sys.argv[2:])
+
+    if command is None and arguments.undo is None and arguments.serve == False and len(arguments.FILE) == 0:
+        argumentParser.error('the following arguments are required: FILE')
+
+    if command is None and arguments.serve and (len(arguments.FILE) > 0 or arguments.undo is not None or arguments.watch or arguments.no_broker):
+        argumentParser.error('--serve cannot be used with FILE arguments, --undo, --watch or --no-broker.')
 
-    arguments = argumentParser.parse_args()
+    if command is None and arguments.undo is not None and len(arguments.FILE) > 0:
+        argumentParser.error('FILE arguments cannot be used with --undo.')
+
+    if arguments.watch and (command is not None or arguments.undo is not None or arguments.asyncio):
+        argumentParser.error('--watch can only be used to rename, without --asyncio.')
+
+    if arguments.settle < 0:
+        argumentParser.error('--settle cannot be negative.')
+
+    if arguments.poll is not None and arguments.poll <= 0:
+        argumentParser.error('--poll must be positive.')
+
+    if command == 'plan' and arguments.journal is not None:
+        argumentParser.error('--journal cannot be used to plan, use it to apply the plan.')
+
+    shard = None
+
+    if command == 'plan':
+        if arguments.asyncio:
+            argumentParser.error('--asyncio cannot be used to plan.')
+
+        if arguments.shard is not None:
+            try:
+                shard = parseShard(arguments.shard)
+            except ValueError as exception:
+                argumentParser.error(str(exception))
+
+    if arguments.batch_size < 1:
+        argumentParser.error('--batch-size must be at least 1.')
+
+    if arguments.batch_bytes < 1:
+        argumentParser.error('--batch-bytes must be at least 1.')
+
+    if arguments.batch_target <= 0:
+        argumentParser.error('--batch-target must be positive.')
+
+    if arguments.jobs < 1:
+        argumentParser.error('--jobs must be at least 1.')
+
+    if arguments.timeout <= 0:
+        argumentParser.error('--timeout must be positive.')
+
+    if arguments.max_bytes < 16:
+        argumentParser.error('--max-bytes must be at least 16.')
+
+    # Compile the template and the naming rules once, we will use them for every file.
+    fileNamePolicy = FileNamePolicy(fat32Safe = arguments.fat32_safe, consoleFriendly = arguments.console_friendly, windowsSafe = arguments.windows_safe, maxBytes = arguments.max_bytes, unicodeForm = arguments.unicode_form)
+
+    try:
+        fileNameTemplate = FileNameTemplate(arguments.format)
+    except ValueError as exception:
+        argumentParser.error(str(exception))
+
+    if arguments.io_window < 1:
+        argumentParser.error('--io-window must be at least 1.')
+
+    if arguments.prefetch and hasattr(os, 'posix_fadvise') == False:
+        argumentParser.error('--prefetch is not supported on this platform.')
+
+    if arguments.rename_threads < 1:
+        argumentParser.error('--rename-threads must be at least 1.')
+
+    if arguments.discovery_threads < 1:
+        argumentParser.error('--discovery-threads must be at least 1.')
+
+    # Extensions are compared in lower case, with the dot.
+    extensions = None
+
+    if arguments.ext is not None:
+        extensions = frozenset('.' + extension.strip().lstrip('.').lower() for extension in arguments.ext.split(',') if extension.strip() != '')
 
     if arguments.verbose == None:
         arguments.verbose = 0;
@@ -158,69 +3018,314 @@ if __name__ == '__main__':
         print ('Something about disk I/O went bad: ' + str(exception), file = sys.stderr)
         sys.exit(1)
 
-    # Need to expand the files with glob first.
-    filesToWorkOn = list ()
+    # Profile everything from here on, dumping the profile however we exit.
+    if arguments.profile is not None:
+        import cProfile
+
+        profiler = cProfile.Profile()
+
+        def dumpProfile ():
+            profiler.disable()
+
+            try:
+                profiler.dump_stats(arguments.profile)
+            except OSError as exception:
+                localLogger.error('Cannot write the profile: %s', exception)
+
+        atexit.register(dumpProfile)
+        profiler.enable()
+
+    # As a broker, we only keep exiftool processes running for other runs, until interrupted.
+    if command is None and arguments.serve:
+        try:
+            os.makedirs(os.path.dirname(arguments.broker), mode = 0o700, exist_ok = True)
+            broker = exiftool.ExifToolBroker(arguments.broker, jobs = arguments.jobs, executable_ = arguments.alternative_exiftool, common_args = exiftoolArguments(arguments.fast), timeout = arguments.timeout)
+            broker.start()
+        except OSError as exception:
+            localLogger.error('Cannot start the exiftool broker: %s', exception)
+            sys.exit (7)
+
+        # Stop as cleanly on a TERM signal as on Ctrl-C, like a daemon should.
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        localLogger.info('Serving exiftool processes on %s.', arguments.broker)
+
+        try:
+            broker.serve_forever()
+        except KeyboardInterrupt:
+            localLogger.info('Stopping the exiftool broker.')
+        finally:
+            broker.terminate()
+
+        sys.exit (0)
+
+    # Timers and counters are only collected if someone is going to look at them.
+    runStats = None
+
+    if arguments.stats or arguments.stats_json is not None:
+        runStats = Stats()
+
+    # The journal is read first, to know what an earlier run already did, then appended to.
+    journaledRenames = list ()
+    renameJournal = None
+
+    # Only the plain command has --undo.
+    undoJournal = getattr(arguments, 'undo', None)
+
+    if arguments.journal is not None or undoJournal is not None:
+        journalPath = arguments.journal if undoJournal is None else undoJournal
+
+        try:
+            if os.path.exists(journalPath):
+                journaledRenames = RenameJournal.read(journalPath)
+
+            renameJournal = RenameJournal(journalPath)
+        except OSError as exception:
+            localLogger.error('Cannot open the journal: %s', exception)
+            sys.exit (6)
+
+        localLogger.debug('Journal %s lists %d renames.', journalPath, len(journaledRenames))
+
+    # Undoing needs neither exiftool nor the cache.
+    if undoJournal is not None:
+        try:
+            undoneFiles = undoRenames(journaledRenames, renameJournal, arguments.dry_run)
+        finally:
+            renameJournal.close()
+
+        localLogger.info ('Journal lists %d renames, renamed %d files back.', len(journaledRenames), undoneFiles)
+        sys.exit (0)
+
+    # Applying plans needs neither exiftool nor the cache.
+    if command == 'apply':
+        try:
+            planRecords = readPlans(arguments.FILE)
+        except (OSError, ValueError) as exception:
+            localLogger.error('Cannot read the rename plan: %s', exception)
+            sys.exit (5)
+
+        # When resuming, the renames the journal lists are done already.
+        journaledPlans = set((record['directory'], record['source'], record['target']) for record in journaledRenames)
+        pendingRecords = [record for record in planRecords if (record['directory'], record['source'], record['target']) not in journaledPlans]
+
+        try:
+            renamedFiles = applyPlans(pendingRecords, RenameExecutor(dryRun = arguments.dry_run, threads = arguments.rename_threads, journal = renameJournal, stats = runStats, duplicates = arguments.duplicates, maxBytes = arguments.max_bytes))
+        finally:
+            if renameJournal is not None:
+                renameJournal.close()
+
+        localLogger.info ('Planned %d files, renamed %d of them.', len(planRecords), renamedFiles)
+
+        if runStats is not None:
+            runStats.count('files', len(planRecords))
+            runStats.count('files renamed', renamedFiles)
+            reportStats(runStats, arguments.stats, arguments.stats_json)
+
+        if len(planRecords) == 0:
+            localLogger.error ('No files in the given rename plans, aborting.')
+            sys.exit (2)
+
+        sys.exit (0)
 
     # Let's print some information about the passed parameters.
     localLogger.debug('Recursiveness is set to %s.', arguments.recursive)
     localLogger.debug('FAT32 safety is set to %s.', arguments.fat32_safe)
     localLogger.debug('Console friendliness is set to %s.', arguments.console_friendly)
+    localLogger.debug('Windows safety is set to %s.', arguments.windows_safe)
+    localLogger.debug('Unicode normalization form is set to %s.', arguments.unicode_form)
+    localLogger.debug('Maximum name length is set to %d bytes.', arguments.max_bytes)
+    localLogger.debug('Extensions to work on are: %s.', 'all' if extensions is None else sorted(extensions))
+    localLogger.debug('Batch size is set to %d.', arguments.batch_size)
+    localLogger.debug('Number of exiftool jobs is set to %d.', arguments.jobs)
+    localLogger.debug('Fast scan level is set to %d.', arguments.fast)
+    localLogger.debug('exiftool timeout is set to %g seconds.', arguments.timeout)
+
+    # Only ask exiftool for what we are going to use.
+    tagsToExtract = requiredTags(fileNameTemplate.fields)
+    localLogger.debug('Tags to extract are: %s.', tagsToExtract)
+
+    # The built-in reader only knows about titles, so it can only stand in for exiftool if that is all we need.
+    useQuickTimeReader = arguments.no_quicktime_reader == False and set(tagsToExtract) <= QUICKTIME_TAGS
+    localLogger.debug('Built-in QuickTime title reader is set to %s.', useQuickTimeReader)
+
+    # The cache is optional, but on by default. Entries are only valid for the same tags and exiftool arguments.
+    metadataCache = None
+
+    if arguments.no_cache == False:
+        import sqlite3
+
+        try:
+            metadataCache = MetadataCache(defaultCachePath(), '\x1f'.join(tagsToExtract + exiftoolArguments(arguments.fast)), maxEntries = arguments.cache_size, refresh = arguments.refresh_cache)
+        except (OSError, sqlite3.Error) as exception:
+            localLogger.error('Cannot open the metadata cache: %s', exception)
+            sys.exit (4)
 
     # Let's get the passed files from arguments, and work on them.
     localLogger.debug ('Files to be processed are: %s.', arguments.FILE)
 
-    # File path handling is not easy. We need to expand the vars, the user and glob it to see how many files we get.
-    # Oh, don't forget the recursive switch too.
-    for inputFile in arguments.FILE:
-        possibleFiles = glob.iglob (os.path.expanduser (os.path.expandvars (inputFile)), recursive = arguments.recursive)
+    # Files are counted while they stream by, since we never hold the whole list.
+    matchedFiles = 0
 
-        # Not all returned glob paths are existing files. We need to verify each one.
-        # The loop is here, because glob expands regex to independent files.
-        for possibleFile in possibleFiles:
-            if os.path.isfile (possibleFile):
-                filesToWorkOn.append(possibleFile)
+    def countFiles (files):
+        global matchedFiles
 
-    # This is the final list we work on. It may be empty or, well... long.
-    localLogger.debug ('Final file list is: %s', filesToWorkOn)
-    localLogger.info ('Matched %d files to rename.', len(filesToWorkOn))
+        for possibleFile in files:
+            matchedFiles += 1
+            yield possibleFile
 
+    # Files exiftool dies or hangs on are skipped, the rest of their batch is still renamed.
+    # This is called from the pool threads or the event loop, appending to a list is safe there.
+    failedFiles = list ()
+
+    def reportFailure (path, exception):
+        localLogger.error ('exiftool failed on file %s, will skip: %s', path, exception)
+        failedFiles.append(path)
+
+    # The plan goes to a file or standard output, instead of renaming.
+    planOutput = None
+
+    if command == 'plan':
+        localLogger.debug('Shard is set to %s.', 'all' if shard is None else '%d/%d' % shard)
+
+        if arguments.output == '-':
+            planOutput = sys.stdout
+        else:
+            try:
+                planOutput = open(arguments.output, 'w', encoding = 'utf-8')
+            except OSError as exception:
+                localLogger.error('Cannot write the rename plan: %s', exception)
+                sys.exit (5)
+
+    # Batches grow from a few files to what exiftool reads in --batch-target, shared by all passes of --watch.
+    batchScheduler = BatchScheduler(arguments.batch_size, arguments.batch_bytes, arguments.batch_target)
+
+    # Borrow running exiftool processes from a broker if there is one, instead of starting our own.
+    exiftoolFactory = None
+
+    if arguments.no_broker == False and arguments.asyncio == False:
+        exiftoolFactory = brokerFactory(arguments.broker, arguments.alternative_exiftool, exiftoolArguments(arguments.fast))
 
-    if len(filesToWorkOn) == 0:
-        localLogger.error ('No files match againts the given FILE arguments, aborting.')
-        sys.exit (2)
-        
     # If the logger is up, we can start building the PyExifTool wrapper.
     try:
-        with exiftool.ExifTool(executable_ = arguments.alternative_exiftool) as et:
-            fileMetadata = et.get_metadata_batch(filesToWorkOn)
-
-            for metadata in fileMetadata:
-                # Need to search for a title field here. Let's take a look.
-                requestedField = findField(metadata, 'Title')
-                                                
-                # We may have metadata collision, warn people.                                                
-                if len(requestedField) > 1:
-                    localLogger.warning ('There a more than one field which contains the title. Please make sure the file is renamed correctly.')
-                
-                if len(requestedField) == 0:
-                    localLogger.error ('No matching fields found for file %s, will skip.', metadata['File:FileName'])
-                    continue
-                                
-                # Get the normalized file name and add the extension. Make extension lower case to make things look better.
-                normalizedFileName = normalizeFileName(requestedField[0], fat32Safe = arguments.fat32_safe, consoleFriendly = arguments.console_friendly) + '.' + metadata['File:FileTypeExtension'].lower()
-                
-                # Talk to me!
-                localLogger.info('Will rename file %s to %s.', metadata['File:FileName'], normalizedFileName )
-                         
-                if arguments.dry_run == False:
+        with exiftool.ExifToolPool(executable_ = arguments.alternative_exiftool, jobs = arguments.jobs, common_args = exiftoolArguments(arguments.fast), timeout = arguments.timeout, hooks = None if runStats is None else [runStats.exiftoolHook], factory = exiftoolFactory) as pool:
+            # Start watching before the first pass, so files written meanwhile aren't missed.
+            fileWatcher = None
+            filePrefetcher = None
+
+            if arguments.watch:
+                watchPatterns = WatchPatterns(arguments.FILE, arguments.recursive, extensions)
+
+                if arguments.poll is None:
                     try:
-                        os.rename(metadata['File:Directory'] + '/' + metadata['File:FileName'], metadata['File:Directory'] + '/' + normalizedFileName)
+                        fileWatcher = InotifyWatcher(watchPatterns)
                     except OSError as exception:
-                        if exception.errno == 22:
-                            localLogger.error('Cannot rename file "%s", some characters may not be supported on this filesystem. Please try --fat32-safe.', metadata['File:FileName'])
-                        else:
-                            localLogger.error("Cannot rename file %s, an exception ocurred: %s", metadata['File:FileName'], exception)
-                
+                        localLogger.warning('Cannot use inotify, will look for changes every 2 seconds instead: %s', exception)
+
+                if fileWatcher is None:
+                    fileWatcher = PollingWatcher(arguments.FILE, arguments.recursive, extensions, arguments.poll or 2.0, arguments.discovery_threads)
+
+                # Stop as cleanly on a TERM signal as on Ctrl-C, like a daemon should.
+                signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+            # The pipeline: discovery -> chunks -> metadata -> new names -> rename.
+            # Every stage is a generator, so renaming starts after the first chunk is read.
+            discoveredFiles = discoverFiles(arguments.FILE, arguments.recursive, extensions, arguments.discovery_threads)
+
+            if runStats is not None:
+                discoveredFiles = runStats.timedIterator('discovery', discoveredFiles)
+
+            if shard is not None:
+                discoveredFiles = selectShard(discoveredFiles, *shard)
+
+            discoveredFiles = countFiles(discoveredFiles)
+
+            # Files renamed by an earlier run are counted, but not read again.
+            if len(journaledRenames) > 0:
+                discoveredFiles = skipJournaled(discoveredFiles, dict(((record['device'], record['inode']), record['target']) for record in journaledRenames))
+
+            if arguments.io_order != 'none':
+                discoveredFiles = orderForIO(discoveredFiles, arguments.io_order, arguments.io_window)
+
+            # Hint a batch ahead of what is read, on top of the batches the pool takes ahead.
+            if arguments.prefetch:
+                filePrefetcher = Prefetcher()
+                discoveredFiles = filePrefetcher.prefetch(discoveredFiles, arguments.batch_size)
+
+            chunks = chunked(discoveredFiles, arguments.batch_size)
+            renameExecutor = RenameExecutor(dryRun = arguments.dry_run, threads = arguments.rename_threads, journal = renameJournal, stats = runStats, duplicates = arguments.duplicates, maxBytes = arguments.max_bytes)
+
+            # The watcher is already running, and will report the files this pass renames.
+            if fileWatcher is not None:
+                renameExecutor.handledPaths = list ()
+
+            if command == 'plan':
+                metadataStream = extractMetadata(pool, chunks, tagsToExtract, metadataCache, useQuickTimeReader, reportFailure, batchScheduler)
+                renamedFiles = writePlan(metadataStream, fileNameTemplate, fileNamePolicy, planOutput)
+            elif arguments.asyncio:
+                import asyncio
+
+                renamedFiles = asyncio.run(renameFilesAsync(chunks, tagsToExtract, fileNameTemplate, fileNamePolicy, renameExecutor, arguments.alternative_exiftool, exiftoolArguments(arguments.fast), metadataCache, useQuickTimeReader, inFlight = arguments.jobs, stats = runStats, timeout = arguments.timeout, onFailure = reportFailure))
+            else:
+                metadataStream = extractMetadata(pool, chunks, tagsToExtract, metadataCache, useQuickTimeReader, reportFailure, batchScheduler)
+                renamedFiles = renameFiles(planRenames(metadataStream, fileNameTemplate, fileNamePolicy, runStats), renameExecutor, arguments.batch_size)
+
+            # A daemon thread, so left behind if the pipeline fails.
+            if filePrefetcher is not None:
+                filePrefetcher.close()
+
+            if fileWatcher is not None:
+                # The pool keeps its exiftool processes running, so a micro-batch costs a round trip, not a start.
+                def processBatch (entries):
+                    # Other programs add files all the time, so directories have to be listed again.
+                    renameExecutor.forgetNames()
+                    metadataStream = extractMetadata(pool, [list(countFiles(entries))], tagsToExtract, metadataCache, useQuickTimeReader, reportFailure, batchScheduler)
+                    return renameExecutor.run(list(planRenames(metadataStream, fileNameTemplate, fileNamePolicy, runStats)))
+
+                def rescan ():
+                    return discoverFiles(arguments.FILE, arguments.recursive, extensions, arguments.discovery_threads)
+
+                localLogger.info('Renamed %d files, watching for new ones.', renamedFiles)
+                handledSignatures = [signature for signature in map(fileSignature, renameExecutor.handledPaths) if signature is not None]
+                renameExecutor.handledPaths = None
+
+                try:
+                    renamedFiles += watchFiles(fileWatcher, processBatch, arguments.batch_size, arguments.settle, rescan, handledSignatures)
+                finally:
+                    fileWatcher.close()
+
     except FileNotFoundError as exception:
         localLogger.error (exception)
-        sys.exit (3)
\ No newline at end of file
+        sys.exit (3)
+    except KeyboardInterrupt:
+        # The pool has stopped its exiftool processes by now.
+        localLogger.warning ('Interrupted, files renamed until now keep their new names.')
+        sys.exit (130)
+    finally:
+        if planOutput is not None and planOutput is not sys.stdout:
+            planOutput.close()
+
+        if renameJournal is not None:
+            renameJournal.close()
+
+        if metadataCache is not None:
+            metadataCache.close()
+            localLogger.info ('Metadata cache hits: %d, misses: %d.', metadataCache.hits, metadataCache.misses)
+
+    localLogger.info ('Matched %d files, %s %d of them.', matchedFiles, 'planned' if command == 'plan' else 'renamed', renamedFiles)
+
+    if len(failedFiles) > 0:
+        localLogger.warning ('exiftool failed on %d files, they were not renamed.', len(failedFiles))
+
+    if runStats is not None:
+        runStats.count('files', matchedFiles)
+        runStats.count('files planned' if command == 'plan' else 'files renamed', renamedFiles)
+        runStats.count('files exiftool failed on', len(failedFiles))
+
+        if metadataCache is not None:
+            runStats.count('cache hits', metadataCache.hits)
+            runStats.count('cache misses', metadataCache.misses)
+
+        reportStats(runStats, arguments.stats, arguments.stats_json)
+
+    if matchedFiles == 0 and arguments.watch == False:
+        localLogger.error ('No files match againts the given FILE arguments, aborting.')
+        sys.exit (2)